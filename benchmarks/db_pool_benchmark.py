@@ -0,0 +1,83 @@
+"""
+Micro-benchmark: per-call latency of DatabaseManager lookups under concurrent callbacks
+
+Compares the old connect-per-call-under-a-global-lock access pattern against
+the pooled WAL connections used by DatabaseManager.
+
+Usage: python benchmarks/db_pool_benchmark.py [threads] [calls_per_thread]
+"""
+
+import os
+import sys
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bot.database.db_manager import DatabaseManager
+
+
+def legacy_get_user(db_path, lock, user_id):
+    """The access pattern DatabaseManager used before pooling"""
+    with lock:
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
+        result = cursor.fetchone()
+        conn.close()
+        return result
+
+
+def run(label, call, threads, calls_per_thread):
+    latencies = []
+    latencies_lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker(worker_id):
+        local = []
+        barrier.wait()
+        for i in range(calls_per_thread):
+            start = time.perf_counter()
+            call((worker_id * calls_per_thread + i) % 500)
+            local.append(time.perf_counter() - start)
+        with latencies_lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    wall_start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    wall = time.perf_counter() - wall_start
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95)]
+    print(f"{label:<10} calls={len(latencies):<6} wall={wall:.2f}s "
+          f"mean={statistics.mean(latencies) * 1e3:.3f}ms "
+          f"p50={statistics.median(latencies) * 1e3:.3f}ms p95={p95 * 1e3:.3f}ms")
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    calls_per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        db = DatabaseManager(db_path)
+        for user_id in range(500):
+            db.add_user(user_id, f"user{user_id}", language='en')
+
+        print(f"{threads} threads x {calls_per_thread} get_user calls")
+        legacy_lock = threading.Lock()
+        run('legacy', lambda uid: legacy_get_user(db_path, legacy_lock, uid), threads, calls_per_thread)
+        run('pooled', db.get_user, threads, calls_per_thread)
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
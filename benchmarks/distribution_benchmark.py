@@ -0,0 +1,262 @@
+"""
+Benchmark: host-by-host SFTP uploads vs the fan-out distribution engine
+
+Runs against a local paramiko server stand-in for sshd on 127.0.0.1 that
+serves SFTP from a per-host directory and runs exec requests with bash in
+it, behind a relay that delays traffic by a WAN-like round trip time.
+Every "host" is a distinct username with its own directory. The payload is
+an image-sized artifact plus a certificate and a compose file.
+
+  sequential - one host after another, sftp.putfo of every file, no checks
+  fan-out    - SSHManager.distribute_files on a cold fleet
+  repeat     - the same distribution again; every file already matches
+  capped     - fan-out to fresh paths with DISTRIBUTION_MAX_MBPS-style cap
+
+Reported per run: wall time, MiB uploaded and the aggregate upload rate.
+
+Usage: python benchmarks/distribution_benchmark.py [hosts] [artifact MiB] [cap MiB/s] [rtt ms]
+"""
+
+import logging
+import os
+import queue
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import paramiko
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('BOT_TOKEN', '0:benchmark')
+
+from bot.services.distribution import BandwidthLimiter, Payload, distribute
+from bot.services.ssh_manager import SSHManager
+
+PASSWORD = 'bench'
+
+
+class LocalSFTP(paramiko.SFTPServerInterface):
+    """SFTP rooted in the logged-in host's directory"""
+
+    def __init__(self, server, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.root = server.home
+
+    def _path(self, path):
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(self._path(path), flags, 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        mode = 'wb' if flags & os.O_WRONLY else 'r+b' if flags & os.O_RDWR else 'rb'
+        handle = paramiko.SFTPHandle(flags)
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._path(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def chattr(self, path, attr):
+        if attr.st_mode is not None:
+            os.chmod(self._path(path), attr.st_mode)
+        return paramiko.SFTP_OK
+
+    def remove(self, path):
+        try:
+            os.remove(self._path(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+
+class StubServer(paramiko.ServerInterface):
+    """Accepts the benchmark password; each username gets its own directory"""
+
+    def __init__(self, base):
+        self.base = base
+        self.home = None
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        if password != PASSWORD:
+            return paramiko.AUTH_FAILED
+        self.home = os.path.join(self.base, username)
+        os.makedirs(self.home, exist_ok=True)
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self._run, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+    def _run(self, channel, command):
+        try:
+            result = subprocess.run(['bash', '-c', command], cwd=self.home, capture_output=True,
+                                    env={'HOME': self.home, 'PATH': os.environ['PATH']})
+            channel.sendall(result.stdout)
+            channel.sendall_stderr(result.stderr)
+            channel.send_exit_status(result.returncode)
+        except EOFError:
+            pass  # The client already hung up
+        finally:
+            channel.close()
+
+
+def serve(listener, host_key, base, stop):
+    while not stop.is_set():
+        try:
+            conn, _ = listener.accept()
+        except OSError:
+            return
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(host_key)
+        transport.set_subsystem_handler('sftp', paramiko.SFTPServer, LocalSFTP)
+        transport.start_server(server=StubServer(base))
+
+
+def _pump(source, target, delay):
+    """Forward source to target, delivering each read delay seconds after it arrived"""
+    pending = queue.Queue()
+
+    def deliver():
+        while True:
+            due, data = pending.get()
+            if data is None:
+                break
+            time.sleep(max(0.0, due - time.monotonic()))
+            try:
+                target.sendall(data)
+            except OSError:
+                break
+        target.close()
+
+    threading.Thread(target=deliver, daemon=True).start()
+    while True:
+        try:
+            data = source.recv(65536)
+        except OSError:
+            data = b''
+        pending.put((time.monotonic() + delay, data or None))
+        if not data:
+            return
+
+
+def relay(listener, server_port, rtt, stop):
+    """Accept clients and connect each to the server through a delayed pipe"""
+    while not stop.is_set():
+        try:
+            client, _ = listener.accept()
+        except OSError:
+            return
+        upstream = socket.create_connection(('127.0.0.1', server_port))
+        for sock in (client, upstream):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        threading.Thread(target=_pump, args=(client, upstream, rtt / 2), daemon=True).start()
+        threading.Thread(target=_pump, args=(upstream, client, rtt / 2), daemon=True).start()
+
+
+def sequential(manager, servers, payloads):
+    for server in servers:
+        with manager.server_session(server) as client:
+            sftp = client.open_sftp()
+            for payload in payloads:
+                parent = os.path.dirname(payload.remote_path)
+                if parent:
+                    client.exec_command(f"mkdir -p {parent}")[1].channel.recv_exit_status()
+                with payload.open() as f:
+                    sftp.putfo(f, payload.remote_path, file_size=payload.size)
+            sftp.close()
+    return sum(payload.size for payload in payloads) * len(servers)
+
+
+def report(name, wall, sent):
+    mib = sent / (1024 * 1024)
+    print(f"{name:<11} {wall:>8.2f} {mib:>9.1f} {mib / wall if wall else 0:>8.1f}")
+
+
+def main():
+    hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    artifact_mib = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    cap_mib = float(sys.argv[3]) if len(sys.argv) > 3 else 8
+    rtt = (float(sys.argv[4]) if len(sys.argv) > 4 else 100) / 1000
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    logging.getLogger('bot').setLevel(logging.WARNING)
+
+    base = tempfile.mkdtemp(prefix='marz-dist-bench-')
+    stop = threading.Event()
+    listeners = []
+    for _ in range(2):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(128)
+        listeners.append(listener)
+    server_port, port = (listener.getsockname()[1] for listener in listeners)
+    threading.Thread(target=serve, args=(listeners[0], paramiko.RSAKey.generate(2048), base, stop),
+                     daemon=True).start()
+    threading.Thread(target=relay, args=(listeners[1], server_port, rtt, stop), daemon=True).start()
+
+    artifact = Path(base) / 'artifact.tar'
+    artifact.write_bytes(os.urandom(artifact_mib * 1024 * 1024))
+    payloads = [
+        Payload('rollout/image.tar', source=artifact),
+        Payload('node/ssl_client_cert.pem', b'-----BEGIN CERTIFICATE-----\n' + b'A' * 1800 + b'\n', mode=0o600),
+        Payload('Marzban-node/docker-compose.yml', b'services:\n  marzban-node:\n    image: x\n'),
+    ]
+    servers = [{'ip_address': '127.0.0.1', 'port': port, 'username': f"host{n}", 'password': PASSWORD,
+                'auth_method': 'password', 'ssh_key': None} for n in range(hosts)]
+    manager = SSHManager()
+    label = lambda server: server['username']
+
+    print(f"{hosts} hosts, {artifact_mib} MiB artifact, {rtt * 1000:g} ms round trip")
+    print(f"{'run':<11} {'wall s':>8} {'MiB sent':>9} {'MiB/s':>8}")
+
+    start = time.perf_counter()
+    sent = sequential(manager, servers, payloads)
+    report('sequential', time.perf_counter() - start, sent)
+    for server in servers:
+        home = os.path.join(base, server['username'])
+        shutil.rmtree(home)
+        os.makedirs(home)
+
+    for name in ('fan-out', 'repeat'):
+        start = time.perf_counter()
+        results = manager.distribute_files(servers, payloads)
+        report(name, time.perf_counter() - start, sum(result['bytes'] for result in results))
+        failed = [result['host'] for result in results if not result['success']]
+        if failed:
+            print(f"  failed: {failed}")
+
+    capped = [Payload('capped/' + payload.remote_path, source=payload.source, data=payload.data)
+              for payload in payloads]
+    start = time.perf_counter()
+    results = distribute(servers, capped, manager.server_session, label=label,
+                         limiter=BandwidthLimiter(cap_mib * 1024 * 1024))
+    report(f"capped {cap_mib:g}", time.perf_counter() - start, sum(result['bytes'] for result in results))
+
+    manager.pool.close_all()
+    stop.set()
+    for listener in listeners:
+        listener.close()
+    shutil.rmtree(base)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark: finding a node's local row by (panel_id, node_id)
+
+Compares the old approach (load every node of the panel and scan in Python),
+the same SQL lookup without an index (full table scan) and
+DatabaseManager.get_node_by_remote_id on the unique (panel_id, node_id) index.
+
+Usage: python benchmarks/node_lookup_benchmark.py [max_nodes]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bot.database.db_manager import DatabaseManager
+
+PANELS = 4
+LOOKUPS = 200
+
+
+def seed(db, start, stop):
+    with db._write() as cursor:
+        cursor.executemany(
+            'INSERT INTO nodes (panel_id, node_id, name, address, port, api_port) VALUES (?, ?, ?, ?, ?, ?)',
+            ((n % PANELS + 1, n, f"node-{n}", f"10.0.{n // 256 % 256}.{n % 256}", 62050, 62051)
+             for n in range(start, stop))
+        )
+
+
+def python_scan(db, panel_id, node_id):
+    for db_node in db.get_nodes(panel_id):
+        if db_node['node_id'] == node_id:
+            return db_node
+    return None
+
+
+def unindexed_sql(db, panel_id, node_id):
+    with db._read() as cursor:
+        cursor.execute('SELECT * FROM nodes NOT INDEXED WHERE panel_id = ? AND node_id = ?', (panel_id, node_id))
+        return cursor.fetchone()
+
+
+def measure(fn, db, targets, repeat):
+    start = time.perf_counter()
+    for node_id in targets[:repeat]:
+        fn(db, node_id % PANELS + 1, node_id)
+    return (time.perf_counter() - start) / repeat * 1e3
+
+
+def main():
+    max_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    sizes = [size for size in (1_000, 10_000, 100_000) if size <= max_nodes] or [max_nodes]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, 'bench.db'))
+        seeded = 0
+        print(f"{'nodes':>8} {'python scan':>14} {'unindexed SQL':>15} {'indexed':>10}   (ms per lookup)")
+        for size in sizes:
+            seed(db, seeded, size)
+            seeded = size
+            targets = [random.randrange(size) for _ in range(LOOKUPS)]
+            scan = measure(python_scan, db, targets, 20)
+            unindexed = measure(unindexed_sql, db, targets, 50)
+            indexed = measure(lambda d, p, n: d.get_node_by_remote_id(p, n), db, targets, LOOKUPS)
+            print(f"{size:>8} {scan:>14.3f} {unindexed:>15.3f} {indexed:>10.4f}")
+
+        with db._read() as cursor:
+            plan = cursor.execute(
+                'EXPLAIN QUERY PLAN SELECT * FROM nodes WHERE panel_id = ? AND node_id = ?', (1, 1)
+            ).fetchall()
+        print("query plan:", "; ".join(row[-1] for row in plan))
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Benchmark: legacy sleep-poll command loop vs the selector-based SSH executor
+
+Runs against a local paramiko server stand-in for sshd on 127.0.0.1 that
+emits apt-like output. Three workloads are measured:
+
+  stream - one long command printing output as fast as it can
+  quiet  - one long command printing a line every 250 ms (a slow download)
+  short  - many short commands (the per-step execs of an install)
+
+Reported per workload: wall time, CPU time of the calling thread and wall
+time per command. Chunk logging goes to a temporary file at INFO, as the
+bot configures it in production.
+
+Usage: python benchmarks/ssh_executor_benchmark.py [stream_lines] [short_commands]
+"""
+
+import logging
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import paramiko
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bot.services.ssh_executor import execute_command
+
+USERNAME = 'bench'
+PASSWORD = 'bench'
+
+
+class StubServer(paramiko.ServerInterface):
+    """Accepts any password and answers 'emit <lines> <burst> <pause ms>' exec requests"""
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self._run, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+    @staticmethod
+    def _run(channel, command):
+        # sshd replies to the exec request before the command starts writing
+        time.sleep(0.005)
+        _, lines, burst, pause = command.split()
+        lines, burst, pause = int(lines), int(burst), int(pause) / 1000
+        for n in range(lines):
+            channel.sendall(f"Get:{n} http://archive.ubuntu.com/ubuntu jammy-updates/main amd64 pkg-{n} [1,024 kB]\n".encode())
+            if n % 500 == 499:
+                channel.sendall_stderr(b"debconf: delaying package configuration\n")
+            if n % burst == burst - 1:
+                time.sleep(pause)
+        channel.send_exit_status(0)
+        channel.close()
+
+
+def serve(listener, host_key, stop):
+    while not stop.is_set():
+        try:
+            conn, _ = listener.accept()
+        except OSError:
+            return
+        # Like sshd, push small writes out immediately instead of waiting on delayed ACKs
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(host_key)
+        transport.start_server(server=StubServer())
+
+
+def legacy_execute(ssh_client, command, timeout=600):
+    """The loop SSHManager._execute_command used before the executor"""
+    logger = logging.getLogger('legacy')
+    stdin, stdout, stderr = ssh_client.exec_command(command, timeout=timeout)
+    stdout.channel.settimeout(timeout)
+    stderr.channel.settimeout(timeout)
+    output_data = []
+    error_data = []
+    while True:
+        if stdout.channel.exit_status_ready():
+            break
+        if stdout.channel.recv_ready():
+            chunk = stdout.read(4096).decode('utf-8', errors='ignore')
+            if chunk:
+                output_data.append(chunk)
+                logger.info(f"Command output chunk: {chunk[:200]}...")
+        if stderr.channel.recv_stderr_ready():
+            chunk = stderr.read(4096).decode('utf-8', errors='ignore')
+            if chunk:
+                error_data.append(chunk)
+                logger.warning(f"Command error chunk: {chunk[:200]}...")
+        import time as _time
+        _time.sleep(0.1)
+    exit_status = stdout.channel.recv_exit_status()
+    output_data.append(stdout.read().decode('utf-8', errors='ignore'))
+    error_data.append(stderr.read().decode('utf-8', errors='ignore'))
+    return exit_status, ''.join(output_data), ''.join(error_data)
+
+
+def executor_execute(ssh_client, command):
+    result = execute_command(ssh_client, command)
+    return result.exit_status, result.stdout, result.stderr
+
+
+def measure(fn, client, command, repeat):
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    size = 0
+    for _ in range(repeat):
+        _, out, _ = fn(client, command)
+        size += len(out)
+    return time.perf_counter() - wall, time.thread_time() - cpu, size
+
+
+def main():
+    stream_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    short_commands = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    with tempfile.TemporaryDirectory() as tmp:
+        logging.basicConfig(filename=os.path.join(tmp, 'bench.log'), level=logging.INFO)
+        logging.getLogger('paramiko').setLevel(logging.WARNING)
+
+        host_key = paramiko.RSAKey.generate(2048)
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(8)
+        stop = threading.Event()
+        threading.Thread(target=serve, args=(listener, host_key, stop), daemon=True).start()
+
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect('127.0.0.1', listener.getsockname()[1], USERNAME, PASSWORD,
+                       look_for_keys=False, allow_agent=False)
+        client.get_transport().sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        workloads = [
+            ('stream', f"emit {stream_lines} 50 1", 1),
+            ('quiet', "emit 12 1 250", 1),
+            ('short', "emit 5 50 0", short_commands),
+        ]
+        print(f"{'workload':<8} {'executor':<9} {'wall s':>8} {'cpu s':>8} {'ms/cmd':>8} {'bytes':>10}")
+        for name, command, repeat in workloads:
+            for label, fn in (('legacy', legacy_execute), ('selector', executor_execute)):
+                wall, cpu, size = measure(fn, client, command, repeat)
+                print(f"{name:<8} {label:<9} {wall:>8.3f} {cpu:>8.3f} {wall / repeat * 1e3:>8.1f} {size:>10}")
+
+        log_size = os.path.getsize(os.path.join(tmp, 'bench.log'))
+        print(f"log written: {log_size} bytes")
+        client.close()
+        stop.set()
+        listener.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Benchmark: SSH test-connect latency with per-attempt key parsing vs the key cache and session pool
+
+Runs against a local paramiko server stand-in for sshd on 127.0.0.1 that
+accepts any public key. Every "host" is a distinct username, so pooled
+sessions are never shared between hosts. One Ed25519 key in OpenSSH
+format (the ssh-keygen default) is used for every host, as in a bulk
+install with one key.
+
+  legacy - what install_node did per host before: the connection test and
+           the install each parse the key trying RSA, Ed25519, ... in order
+           and open their own connection
+  cached - SSHManager.test_ssh_connection followed by the install's pool
+           acquire: the key is parsed once for the whole job and the
+           install reuses the test's session
+
+Reported per host count: wall time, ms per host, key parses and handshakes.
+
+Usage: python benchmarks/ssh_key_benchmark.py [host counts...]
+"""
+
+import io
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+import paramiko
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('BOT_TOKEN', '0:benchmark')
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
+from bot.services.ssh_keys import get_key_cache
+from bot.services.ssh_manager import SSHManager
+
+LEGACY_KEY_TYPES = [paramiko.RSAKey, paramiko.Ed25519Key, paramiko.ECDSAKey, paramiko.DSSKey]
+
+
+class StubServer(paramiko.ServerInterface):
+    """Accepts any public key and answers every exec request with one line"""
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def get_allowed_auths(self, username):
+        return 'publickey'
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_exec_request(self, channel, command):
+        def run():
+            # sshd replies to the exec request before the command starts writing
+            time.sleep(0.005)
+            try:
+                channel.sendall(b"Connection test successful\n")
+                channel.send_exit_status(0)
+                channel.close()
+            except EOFError:
+                pass  # The client already hung up
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+
+def serve(listener, host_key, stop):
+    while not stop.is_set():
+        try:
+            conn, _ = listener.accept()
+        except OSError:
+            return
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(host_key)
+        transport.start_server(server=StubServer())
+
+
+def legacy_connect(port, username, ssh_key, counters):
+    """Connect the way SSHManager did before the key cache: parse on every attempt"""
+    private_key = None
+    for key_type in LEGACY_KEY_TYPES:
+        counters['parses'] += 1
+        try:
+            private_key = key_type.from_private_key(io.StringIO(ssh_key))
+            break
+        except Exception:
+            continue
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    client.connect('127.0.0.1', port, username, pkey=private_key, look_for_keys=False, allow_agent=False)
+    counters['handshakes'] += 1
+    return client
+
+
+def legacy_host(port, username, ssh_key, counters):
+    # Connection test
+    client = legacy_connect(port, username, ssh_key, counters)
+    _, stdout, _ = client.exec_command('echo "Connection test successful"')
+    stdout.read()
+    client.close()
+    # The install's own connection
+    legacy_connect(port, username, ssh_key, counters).close()
+
+
+def cached_host(manager, port, username, ssh_key):
+    success, message = manager.test_ssh_connection('127.0.0.1', port, username, ssh_key=ssh_key)
+    if not success:
+        raise RuntimeError(message)
+    client = manager.pool.acquire('127.0.0.1', port, username, pkey=get_key_cache().load(ssh_key))
+    manager.pool.release(client)
+
+
+def main():
+    host_counts = [int(arg) for arg in sys.argv[1:]] or [1, 50, 500]
+    logging.basicConfig(level=logging.WARNING)
+    # The stub server logs every client disconnect as a socket error
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    logging.getLogger('bot').setLevel(logging.WARNING)
+
+    host_key = paramiko.RSAKey.generate(2048)
+    ssh_key = ed25519.Ed25519PrivateKey.generate().private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.OpenSSH, serialization.NoEncryption()
+    ).decode()
+
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(64)
+    port = listener.getsockname()[1]
+    stop = threading.Event()
+    threading.Thread(target=serve, args=(listener, host_key, stop), daemon=True).start()
+
+    manager = SSHManager()
+    print(f"{'hosts':>6} {'mode':<7} {'wall s':>8} {'ms/host':>8} {'parses':>7} {'handshakes':>10}")
+    for hosts in host_counts:
+        counters = {'parses': 0, 'handshakes': 0}
+        start = time.perf_counter()
+        for n in range(hosts):
+            legacy_host(port, f"legacy-{hosts}-{n}", ssh_key, counters)
+        wall = time.perf_counter() - start
+        print(f"{hosts:>6} {'legacy':<7} {wall:>8.3f} {wall / hosts * 1e3:>8.1f} "
+              f"{counters['parses']:>7} {counters['handshakes']:>10}")
+
+        cache = get_key_cache()
+        cache._keys.clear()
+        parses, connects = cache.stats['parses'], manager.pool.stats['connects']
+        start = time.perf_counter()
+        for n in range(hosts):
+            cached_host(manager, port, f"cached-{hosts}-{n}", ssh_key)
+        wall = time.perf_counter() - start
+        print(f"{hosts:>6} {'cached':<7} {wall:>8.3f} {wall / hosts * 1e3:>8.1f} "
+              f"{cache.stats['parses'] - parses:>7} {manager.pool.stats['connects'] - connects:>10}")
+        manager.pool.close_all()
+
+    stop.set()
+    listener.close()
+
+
+if __name__ == '__main__':
+    main()
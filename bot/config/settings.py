@@ -4,6 +4,7 @@ Bot configuration settings
 
 import os
 import logging
+import hashlib
 from typing import List
 from pathlib import Path
 
@@ -48,14 +49,104 @@ if admin_ids_str:
 
 # Database settings
 DATABASE_PATH = os.getenv('DATABASE_PATH') or 'bot_database.db'
+DATABASE_POOL_SIZE = int(os.getenv('DATABASE_POOL_SIZE') or '8')
+# Write-behind batching for non-durable writes (0 disables the queue)
+DATABASE_WRITE_BEHIND_MS = int(os.getenv('DATABASE_WRITE_BEHIND_MS') or '250')
+DATABASE_WRITE_BEHIND_ROWS = int(os.getenv('DATABASE_WRITE_BEHIND_ROWS') or '100')
+# In-memory user lookup cache
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE') or '1024')
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL') or '300')
 
 # SSH connection settings  
 SSH_TIMEOUT = int(os.getenv('SSH_TIMEOUT') or '30')
 MAX_SSH_RETRIES = int(os.getenv('MAX_SSH_RETRIES') or '3')
+# Pooled SSH sessions: max open, idle seconds before closing, keepalive interval
+SSH_POOL_SIZE = int(os.getenv('SSH_POOL_SIZE') or '64')
+SSH_POOL_IDLE_TIMEOUT = int(os.getenv('SSH_POOL_IDLE_TIMEOUT') or '300')
+SSH_KEEPALIVE = int(os.getenv('SSH_KEEPALIVE') or '30')
+# Upper bound for one run of the generated install script
+INSTALL_SCRIPT_TIMEOUT = int(os.getenv('INSTALL_SCRIPT_TIMEOUT') or '1800')
+# Readiness wait after 'docker compose up': deadline and longest pause between probes (seconds)
+NODE_READY_TIMEOUT = int(os.getenv('NODE_READY_TIMEOUT') or '120')
+NODE_READY_MAX_INTERVAL = float(os.getenv('NODE_READY_MAX_INTERVAL') or '5')
+# Probe hosts before installing and leave out steps they already satisfy
+INSTALL_SKIP_SATISFIED = (os.getenv('INSTALL_SKIP_SATISFIED') or 'true').lower() == 'true'
+# Docker older than this is reinstalled even when compose is present
+MIN_DOCKER_VERSION = os.getenv('MIN_DOCKER_VERSION') or '20.10'
+# On-demand node diagnostics: cache lifetime and container log lines shown
+NODE_DIAGNOSTICS_TTL = int(os.getenv('NODE_DIAGNOSTICS_TTL') or '60')
+NODE_DIAGNOSTICS_LOG_LINES = int(os.getenv('NODE_DIAGNOSTICS_LOG_LINES') or '20')
 
 # API settings
 API_TIMEOUT = int(os.getenv('API_TIMEOUT') or '30')
+API_CONNECT_TIMEOUT = int(os.getenv('API_CONNECT_TIMEOUT') or '5')
 MAX_API_RETRIES = int(os.getenv('MAX_API_RETRIES') or '3')
+API_POOL_SIZE = int(os.getenv('API_POOL_SIZE') or '10')
+# Renew panel tokens this many seconds before their JWT expiry
+TOKEN_REFRESH_MARGIN = int(os.getenv('TOKEN_REFRESH_MARGIN') or '300')
+TOKEN_CHECK_INTERVAL = int(os.getenv('TOKEN_CHECK_INTERVAL') or '60')
+
+# Update dispatch settings
+ASYNC_MODE = (os.getenv('ASYNC_MODE') or 'false').lower() == 'true'
+HANDLER_WORKERS = int(os.getenv('HANDLER_WORKERS') or '16')
+INSTALL_WORKERS = int(os.getenv('INSTALL_WORKERS') or '8')
+POLLING_TIMEOUT = int(os.getenv('POLLING_TIMEOUT') or '25')
+
+# Outbound Telegram limits: requests/s overall and per private chat, per group (20/min)
+OUTBOX_GLOBAL_RATE = float(os.getenv('OUTBOX_GLOBAL_RATE') or '30')
+OUTBOX_CHAT_RATE = float(os.getenv('OUTBOX_CHAT_RATE') or '1')
+OUTBOX_GROUP_RATE = float(os.getenv('OUTBOX_GROUP_RATE') or str(20 / 60))
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS') or '4')
+OUTBOX_MAX_RETRIES = int(os.getenv('OUTBOX_MAX_RETRIES') or '3')
+
+# Node inventory settings
+INVENTORY_WORKERS = int(os.getenv('INVENTORY_WORKERS') or '16')
+INVENTORY_DEADLINE = int(os.getenv('INVENTORY_DEADLINE') or '10')
+NODES_PAGE_SIZE = int(os.getenv('NODES_PAGE_SIZE') or '20')
+NODE_SNAPSHOT_TTL = int(os.getenv('NODE_SNAPSHOT_TTL') or '30')
+
+# Background node health monitor (panels can override the interval)
+NODE_MONITOR_ENABLED = (os.getenv('NODE_MONITOR_ENABLED') or 'true').lower() == 'true'
+NODE_MONITOR_INTERVAL = int(os.getenv('NODE_MONITOR_INTERVAL') or '120')
+
+# Bulk install concurrency: global cap, per-panel cap and adaptive starting point
+BULK_MAX_CONCURRENCY = int(os.getenv('BULK_MAX_CONCURRENCY') or '32')
+BULK_PER_PANEL_LIMIT = int(os.getenv('BULK_PER_PANEL_LIMIT') or '16')
+BULK_INITIAL_CONCURRENCY = int(os.getenv('BULK_INITIAL_CONCURRENCY') or '5')
+# Minimum seconds between edits of a bulk job's progress message
+BULK_PROGRESS_INTERVAL = float(os.getenv('BULK_PROGRESS_INTERVAL') or '10')
+
+# Rollout mode: the bot downloads the docker installer and node image once and
+# pushes them to each host over SSH; cache location, size cap (MB) and seconds
+# before upstream is checked for a newer script or image
+ROLLOUT_MODE = (os.getenv('ROLLOUT_MODE') or 'false').lower() == 'true'
+ROLLOUT_CACHE_DIR = os.getenv('ROLLOUT_CACHE_DIR') or 'data/rollout-cache'
+ROLLOUT_CACHE_MAX_MB = int(os.getenv('ROLLOUT_CACHE_MAX_MB') or '2048')
+ROLLOUT_CACHE_TTL = int(os.getenv('ROLLOUT_CACHE_TTL') or '86400')
+DOCKER_INSTALL_SCRIPT_URL = os.getenv('DOCKER_INSTALL_SCRIPT_URL') or 'https://get.docker.com'
+
+# File distribution over SFTP: hosts served at once and total upload cap in MB/s (0 = no cap)
+DISTRIBUTION_WORKERS = int(os.getenv('DISTRIBUTION_WORKERS') or '16')
+DISTRIBUTION_MAX_MBPS = float(os.getenv('DISTRIBUTION_MAX_MBPS') or '0')
+
+# Fleet command runner: hosts at once, rolling batch size, failure rate (%) that
+# stops the run before the next batch and per-host command timeout (seconds)
+FLEET_PARALLELISM = int(os.getenv('FLEET_PARALLELISM') or '10')
+FLEET_BATCH_SIZE = int(os.getenv('FLEET_BATCH_SIZE') or '20')
+FLEET_MAX_FAILURE_RATE = float(os.getenv('FLEET_MAX_FAILURE_RATE') or '20')
+FLEET_COMMAND_TIMEOUT = int(os.getenv('FLEET_COMMAND_TIMEOUT') or '300')
+
+# Embedded HTTP server (/health, /metrics and webhook ingress)
+HTTP_SERVER_ENABLED = (os.getenv('HTTP_SERVER_ENABLED') or 'true').lower() == 'true'
+HTTP_HOST = os.getenv('HTTP_HOST') or '0.0.0.0'
+HTTP_PORT = int(os.getenv('HTTP_PORT') or '8000')
+
+# Webhook mode replaces polling when WEBHOOK_URL (public https base URL) is set
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH') or '/telegram/webhook'
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or hashlib.sha256(BOT_TOKEN.encode()).hexdigest()[:32]
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS') or str(HANDLER_WORKERS))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE') or '1000')
 
 # Node installation settings - FIXED PORTS
 FIXED_NODE_PORT = int(os.getenv('DEFAULT_NODE_PORT') or '62050')
@@ -71,10 +162,11 @@ DEFAULT_LANGUAGE = os.getenv('DEFAULT_LANGUAGE') or 'en'
 INSTALL_ENABLED = (os.getenv('INSTALL_ENABLED') or 'false').lower() == 'true'
 
 # Docker compose content for Marzban node
-DOCKER_COMPOSE_CONTENT = """services:
+NODE_IMAGE = os.getenv('NODE_IMAGE') or 'gozargah/marzban-node:latest'
+DOCKER_COMPOSE_CONTENT = f"""services:
   marzban-node:
     # build: .
-    image: gozargah/marzban-node:latest
+    image: {NODE_IMAGE}
     restart: always
     network_mode: host
 
@@ -85,28 +177,38 @@ DOCKER_COMPOSE_CONTENT = """services:
       - /var/lib/marzban-node:/var/lib/marzban-node
 """
 
-# Installation commands with enhanced error prevention
-INSTALL_COMMANDS = [
-    # Comprehensive system preparation
-    "export DEBIAN_FRONTEND=noninteractive",
+# Installation steps with enhanced error prevention
+# requires: steps that must run first; check: shell test that marks the step
+# as already satisfied; checkpoint: completion is recorded per server so an
+# interrupted install resumes after it; unless: host facts (see host_probe)
+# that, when all true, make the step unnecessary
+INSTALL_STEPS = [
     # Kill any hanging processes and clean up (gracefully handle if no processes exist)
-    "pkill -f dpkg 2>/dev/null || true",
-    "pkill -f apt 2>/dev/null || true", 
-    "while fuser /var/lib/dpkg/lock-frontend >/dev/null 2>&1; do echo 'Waiting for package managers...'; sleep 3; done || true",
+    {'name': 'stop-apt', 'unless': ['docker_ready', 'packages_ready'], 'command': "pkill -f dpkg 2>/dev/null || true; pkill -f apt 2>/dev/null || true"},
+    {'name': 'wait-locks', 'unless': ['docker_ready', 'packages_ready'], 'requires': ['stop-apt'],
+     'command': "while fuser /var/lib/dpkg/lock-frontend >/dev/null 2>&1; do echo 'Waiting for package managers...'; sleep 3; done || true"},
     # Remove all possible lock files
-    "rm -f /var/lib/dpkg/lock-frontend /var/lib/dpkg/lock /var/cache/apt/archives/lock || true",
+    {'name': 'clear-locks', 'unless': ['docker_ready', 'packages_ready'], 'requires': ['wait-locks'],
+     'command': "rm -f /var/lib/dpkg/lock-frontend /var/lib/dpkg/lock /var/cache/apt/archives/lock || true"},
     # Fix any interrupted dpkg operations
-    "dpkg --configure -a || true",
+    {'name': 'dpkg-configure', 'unless': ['docker_ready', 'packages_ready'], 'requires': ['clear-locks'], 'command': "dpkg --configure -a || true"},
     # Clean and update package cache
-    "apt-get clean && apt-get autoclean",
-    "apt-get update",
+    {'name': 'apt-clean', 'unless': ['docker_ready', 'packages_ready'], 'requires': ['dpkg-configure'], 'command': "apt-get clean && apt-get autoclean"},
+    {'name': 'apt-update', 'unless': ['docker_ready', 'packages_ready'], 'requires': ['apt-clean'], 'command': "apt-get update", 'checkpoint': True},
     # Install packages with error handling
-    "apt-get upgrade -y -o Dpkg::Options::='--force-confdef' -o Dpkg::Options::='--force-confold'",
-    "apt-get install curl socat git -y -o Dpkg::Options::='--force-confdef' -o Dpkg::Options::='--force-confold'",
+    {'name': 'apt-upgrade', 'unless': ['docker_ready', 'packages_ready'], 'requires': ['apt-update'], 'checkpoint': True,
+     'command': "apt-get upgrade -y -o Dpkg::Options::='--force-confdef' -o Dpkg::Options::='--force-confold'"},
+    {'name': 'apt-install', 'unless': ['packages_ready'], 'requires': ['apt-upgrade'], 'checkpoint': True,
+     'command': "apt-get install curl socat git -y -o Dpkg::Options::='--force-confdef' -o Dpkg::Options::='--force-confold'",
+     'check': "command -v curl && command -v socat && command -v git"},
     # Install Docker
-    "curl -fsSL https://get.docker.com | sh",
+    {'name': 'docker', 'unless': ['docker_ready'], 'requires': ['apt-install'], 'checkpoint': True,
+     'command': "curl -fsSL https://get.docker.com | sh",
+     'check': "command -v docker && docker compose version"},
     # Clone Marzban-node
-    "git clone https://github.com/Gozargah/Marzban-node || true",
+    {'name': 'clone', 'unless': ['repo_cloned'], 'requires': ['apt-install'], 'checkpoint': True,
+     'command': "git clone https://github.com/Gozargah/Marzban-node || true",
+     'check': "test -d ~/Marzban-node/.git"},
     # Create directory
-    "mkdir -p /var/lib/marzban-node",
+    {'name': 'data-dir', 'unless': ['data_dir'], 'command': "mkdir -p /var/lib/marzban-node"},
 ]
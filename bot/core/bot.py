@@ -2,12 +2,25 @@
 Main bot class and initialization
 """
 
-import telebot
+import asyncio
+import functools
 import threading
 import logging
 from typing import Dict, Any
-from bot.config.settings import BOT_TOKEN, ADMIN_IDS
+from bot.config.settings import (
+    BOT_TOKEN, ADMIN_IDS, DATABASE_PATH, DATABASE_POOL_SIZE,
+    DATABASE_WRITE_BEHIND_MS, DATABASE_WRITE_BEHIND_ROWS, USER_CACHE_SIZE, USER_CACHE_TTL,
+    HANDLER_WORKERS, POLLING_TIMEOUT, HTTP_SERVER_ENABLED, HTTP_HOST, HTTP_PORT,
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE,
+    NODE_MONITOR_ENABLED
+)
+from bot.core import executors
+from bot.core.outbox import ThrottledTeleBot
+from bot.core.webhook import WebhookServer
 from bot.database.db_manager import DatabaseManager
+from bot.services.token_manager import get_token_manager
+from bot.services.node_monitor import NodeMonitor
+from bot.services.ssh_pool import get_ssh_pool
 from bot.handlers.start_handler import StartHandler
 from bot.handlers.panel_handler import PanelHandler
 from bot.handlers.node_handler import NodeHandler
@@ -17,9 +30,26 @@ from bot.utils.decorators import admin_only
 logger = logging.getLogger(__name__)
 
 class MarzNodeBot:
-    def __init__(self):
-        self.bot = telebot.TeleBot(BOT_TOKEN)
-        self.db = DatabaseManager()
+    def __init__(self, async_mode: bool = False):
+        self.async_mode = async_mode
+        self.webhook_mode = bool(WEBHOOK_URL)
+        self._stop_event = threading.Event()
+        # In async and webhook mode updates are dispatched to our own worker pools,
+        # so the sync bot only runs handlers inline and sends replies.
+        # Replies go through a rate-limited outbox (see bot.core.outbox)
+        self.bot = ThrottledTeleBot(
+            BOT_TOKEN,
+            threaded=not (async_mode or self.webhook_mode),
+            num_threads=HANDLER_WORKERS
+        )
+        self.db = DatabaseManager(
+            DATABASE_PATH,
+            pool_size=DATABASE_POOL_SIZE,
+            write_behind_ms=DATABASE_WRITE_BEHIND_MS,
+            write_behind_rows=DATABASE_WRITE_BEHIND_ROWS,
+            user_cache_size=USER_CACHE_SIZE,
+            user_cache_ttl=USER_CACHE_TTL
+        )
         self.active_sessions = {}
 
         # Initialize handlers
@@ -28,6 +58,9 @@ class MarzNodeBot:
         self.node_handler = NodeHandler(self.bot, self.db)
         self.admin_handler = AdminHandler(self.bot, self.db)
 
+        # Polls node status in the background and alerts on connected/error changes
+        self.node_monitor = NodeMonitor(on_alert=self.node_handler.send_health_alert)
+
         self._register_handlers()
 
     def _register_handlers(self):
@@ -313,12 +346,142 @@ class MarzNodeBot:
             except:
                 pass  # Give up if we can't even send basic error
 
+    def _process_update(self, update):
+        """Run the registered sync handlers for one update (called on the handler pool)
+
+        Handler errors propagate so the caller can log and count them.
+        """
+        self.bot.process_new_updates([update])
+
+    @staticmethod
+    def _update_done(in_flight: asyncio.Semaphore, update, future: asyncio.Future):
+        """Free the update's in-flight slot and log a handler failure"""
+        in_flight.release()
+        if not future.cancelled() and future.exception():
+            logger.error(f"Error processing update {update.update_id}: {future.exception()}")
+
+    async def _poll_async(self):
+        """Long-poll with AsyncTeleBot and hand each update to the bounded handler pool"""
+        from telebot.async_telebot import AsyncTeleBot
+
+        async_bot = AsyncTeleBot(BOT_TOKEN)
+        await async_bot.delete_webhook()
+        loop = asyncio.get_running_loop()
+        handler_pool = executors.get_executor('handlers')
+        # Cap queued-but-unstarted updates so a flood cannot grow memory without bound
+        in_flight = asyncio.Semaphore(HANDLER_WORKERS * 4)
+        offset = None
+
+        try:
+            while True:
+                try:
+                    updates = await async_bot.get_updates(offset=offset, timeout=POLLING_TIMEOUT)
+                except Exception as e:
+                    logger.error(f"Error fetching updates: {e}")
+                    await asyncio.sleep(1)
+                    continue
+
+                for update in updates:
+                    offset = update.update_id + 1
+                    await in_flight.acquire()
+                    future = loop.run_in_executor(handler_pool, self._process_update, update)
+                    future.add_done_callback(functools.partial(self._update_done, in_flight, update))
+        finally:
+            await async_bot.close_session()
+
+    def _metrics(self) -> Dict[str, float]:
+        """Application gauges exported on /metrics"""
+        cache_stats = self.db.get_user_cache_stats()
+        write_behind = self.db.get_write_behind_stats()
+        outbox = self.bot.outbox
+        return {
+            'active_sessions': len(getattr(self.bot, 'active_sessions', {})),
+            'user_cache_hits': cache_stats['hits'],
+            'user_cache_misses': cache_stats['misses'],
+            'user_cache_size': cache_stats['size'],
+            'db_write_behind_pending': write_behind['pending'],
+            'db_write_behind_failed': write_behind['failed'],
+            'outbox_pending': outbox.pending(),
+            'outbox_sent': outbox.stats['sent'],
+            'outbox_coalesced': outbox.stats['coalesced'],
+            'outbox_rate_limited': outbox.stats['rate_limited'],
+            'outbox_failed': outbox.stats['failed'],
+            'ssh_pool_sessions': get_ssh_pool().size(),
+            'ssh_pool_connects': get_ssh_pool().stats['connects'],
+            'ssh_pool_hits': get_ssh_pool().stats['hits'],
+        }
+
+    def _run_webhook(self):
+        """Register the webhook with Telegram and block until stopped"""
+        webhook_url = WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH
+        self.bot.remove_webhook()
+        self.bot.set_webhook(
+            url=webhook_url,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=max(1, min(WEBHOOK_WORKERS, 100))
+        )
+        logger.info(f"Webhook registered at {webhook_url}")
+
+        while not self._stop_event.wait(1):
+            pass
+
+    def stop(self):
+        """Ask a running webhook-mode bot to shut down"""
+        self._stop_event.set()
+
     def start(self):
         """Start the bot"""
         logger.info("Starting Marzban Node Management Bot...")
+        http_server = None
+        token_manager = get_token_manager()
         try:
-            self.bot.infinity_polling(none_stop=True, interval=1)
+            # Keep panel tokens renewed so user actions never wait on a login
+            token_manager.start(self.db)
+            if NODE_MONITOR_ENABLED:
+                self.node_monitor.start(self.db)
+
+            if self.webhook_mode:
+                http_server = WebhookServer(
+                    HTTP_HOST, HTTP_PORT,
+                    process_update=self._process_update,
+                    webhook_path=WEBHOOK_PATH,
+                    secret_token=WEBHOOK_SECRET,
+                    workers=WEBHOOK_WORKERS,
+                    queue_size=WEBHOOK_QUEUE_SIZE,
+                    metrics_provider=self._metrics
+                )
+            elif HTTP_SERVER_ENABLED:
+                http_server = WebhookServer(HTTP_HOST, HTTP_PORT, metrics_provider=self._metrics)
+
+            if http_server:
+                try:
+                    http_server.start()
+                except OSError as e:
+                    if self.webhook_mode:
+                        raise
+                    logger.error(f"Could not start health server on port {HTTP_PORT}: {e}")
+                    http_server = None
+
+            if self.webhook_mode:
+                logger.info("Using webhook update ingress")
+                self._run_webhook()
+            elif self.async_mode:
+                logger.info("Using asyncio update dispatch")
+                asyncio.run(self._poll_async())
+            else:
+                self.bot.remove_webhook()
+                self.bot.infinity_polling(none_stop=True, interval=1)
+        except (KeyboardInterrupt, SystemExit):
+            pass
         except Exception as e:
             logger.error(f"Bot polling error: {e}")
         finally:
+            token_manager.stop()
+            self.node_monitor.stop()
+            if http_server:
+                http_server.stop()
+            executors.shutdown()
+            self.bot.outbox.close()
+            get_ssh_pool().close_all()
+            self.db.close()
             logger.info("Bot stopped")
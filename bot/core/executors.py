@@ -0,0 +1,63 @@
+"""
+Bounded thread pools for blocking work
+
+Interactive update handling and long-running jobs (SSH installs) get
+separate pools so a burst of installs can never occupy the workers that
+answer button presses.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Dict
+from bot.config.settings import (
+    HANDLER_WORKERS, INSTALL_WORKERS, INVENTORY_WORKERS, BULK_MAX_CONCURRENCY, DISTRIBUTION_WORKERS,
+    FLEET_PARALLELISM
+)
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZES = {
+    'handlers': HANDLER_WORKERS,
+    'installs': INSTALL_WORKERS,
+    'inventory': INVENTORY_WORKERS,
+    'bulk': BULK_MAX_CONCURRENCY,
+    'distribution': DISTRIBUTION_WORKERS,
+    'fleet': FLEET_PARALLELISM,
+}
+
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name: str) -> ThreadPoolExecutor:
+    """Return the shared pool for name, creating it on first use"""
+    with _executors_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=POOL_SIZES.get(name, 4),
+                thread_name_prefix=f"marz-{name}"
+            )
+            _executors[name] = executor
+        return executor
+
+
+def submit(name: str, func: Callable, *args, **kwargs) -> Future:
+    """Run func on the named pool, logging any exception it raises"""
+    def run():
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"Error in background task {getattr(func, '__name__', func)}: {e}")
+            raise
+
+    return get_executor(name).submit(run)
+
+
+def shutdown(wait: bool = False):
+    """Stop accepting work on every pool"""
+    with _executors_lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=wait, cancel_futures=not wait)
+        _executors.clear()
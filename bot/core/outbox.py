@@ -0,0 +1,303 @@
+"""
+Outbound Telegram scheduler
+
+Every send, edit and callback answer goes through one queue served by a
+few sender threads. Token buckets keep us under Telegram's limits (about
+30 requests/s overall, 1 message/s per private chat, 20/min per group),
+a 429 pauses the chat for the retry_after Telegram asks for and the
+request is retried instead of lost. A pending edit of a message is
+replaced by a newer edit of the same message, and callback answers are
+served before interactive replies, which are served before background
+(bulk) notifications.
+
+Callers keep the TeleBot interface: each call blocks until its request
+has been sent and returns (or raises) what TeleBot returned.
+"""
+
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+import telebot
+from telebot.apihelper import ApiTelegramException
+from bot.config.settings import (
+    OUTBOX_GLOBAL_RATE, OUTBOX_CHAT_RATE, OUTBOX_GROUP_RATE, OUTBOX_WORKERS, OUTBOX_MAX_RETRIES
+)
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_CALLBACK = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_BACKGROUND = 2
+
+# Messages a chat may receive back to back before its rate applies
+CHAT_BURST = 3
+# Drop per-chat buckets idle this long
+CHAT_BUCKET_IDLE = 300
+
+_context = threading.local()
+
+
+@contextmanager
+def background_sends():
+    """Send everything in this block at background priority (bulk notifications)"""
+    previous = getattr(_context, 'priority', PRIORITY_INTERACTIVE)
+    _context.priority = PRIORITY_BACKGROUND
+    try:
+        yield
+    finally:
+        _context.priority = previous
+
+
+class TokenBucket:
+    """rate tokens per second, bursting up to capacity"""
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _Request:
+    __slots__ = ('priority', 'seq', 'method', 'args', 'kwargs', 'chat_id', 'edit_key',
+                 'futures', 'attempts', 'not_before')
+
+    def __init__(self, priority, seq, method, args, kwargs, chat_id, edit_key):
+        self.priority = priority
+        self.seq = seq
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.chat_id = chat_id
+        self.edit_key = edit_key
+        self.futures: List[Future] = [Future()]
+        self.attempts = 0
+        self.not_before = 0.0
+
+
+class Outbox:
+    """Priority queue of outbound requests with rate limits and flood-wait handling"""
+
+    def __init__(self, global_rate: float = OUTBOX_GLOBAL_RATE, chat_rate: float = OUTBOX_CHAT_RATE,
+                 group_rate: float = OUTBOX_GROUP_RATE, workers: int = OUTBOX_WORKERS,
+                 max_retries: int = OUTBOX_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.workers = max(1, workers)
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._paused: Dict[Any, float] = {}
+        self._busy_chats = set()
+        self._pending: List[_Request] = []
+        self._edits: Dict[Any, _Request] = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._closed = False
+        self.stats = {'sent': 0, 'coalesced': 0, 'rate_limited': 0, 'failed': 0}
+
+    def call(self, method: Callable, args: tuple, kwargs: dict, chat_id=None, edit_key=None,
+             priority: Optional[int] = None):
+        """Queue method(*args, **kwargs) and block until it has been sent"""
+        if priority is None:
+            priority = getattr(_context, 'priority', PRIORITY_INTERACTIVE)
+
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Outbox is closed")
+            self._start_workers()
+
+            pending = self._edits.get(edit_key) if edit_key is not None else None
+            if pending is not None:
+                # Only the newest text of a message matters; whoever waited for the old one gets this result
+                pending.args, pending.kwargs = args, kwargs
+                pending.priority = min(pending.priority, priority)
+                future = Future()
+                pending.futures.append(future)
+                self.stats['coalesced'] += 1
+            else:
+                request = _Request(priority, next(self._seq), method, args, kwargs, chat_id, edit_key)
+                future = request.futures[0]
+                self._pending.append(request)
+                if edit_key is not None:
+                    self._edits[edit_key] = request
+            self._cond.notify()
+
+        return future.result()
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def close(self):
+        """Fail queued requests and stop the sender threads"""
+        with self._cond:
+            self._closed = True
+            pending, self._pending = self._pending, []
+            self._edits.clear()
+            self._cond.notify_all()
+        for request in pending:
+            for future in request.futures:
+                future.set_exception(RuntimeError("Outbox is closed"))
+
+    def _start_workers(self):
+        if self._threads:
+            return
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"marz-outbox-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _chat_bucket(self, chat_id, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 1000:
+                self._chats = {key: value for key, value in self._chats.items()
+                               if now - value.updated < CHAT_BUCKET_IDLE}
+            # Negative ids are groups and channels, which get a much lower limit
+            is_group = isinstance(chat_id, int) and chat_id < 0
+            bucket = TokenBucket(self.group_rate if is_group else self.chat_rate, CHAT_BURST)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _next(self):
+        """Pick the next sendable request, or return how long to wait for one (under the lock)"""
+        now = time.monotonic()
+        wait = None
+        global_wait = self._global.wait_time(now)
+        for request in sorted(self._pending, key=lambda item: (item.priority, item.seq)):
+            chat_id = request.chat_id
+            if chat_id is not None and chat_id in self._busy_chats:
+                continue  # Keep messages to one chat in order
+            delay = max(request.not_before - now, self._paused.get(chat_id, 0) - now, global_wait)
+            if chat_id is not None:
+                delay = max(delay, self._chat_bucket(chat_id, now).wait_time(now))
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+
+            self._global.take(now)
+            if chat_id is not None:
+                self._chat_bucket(chat_id, now).take(now)
+                self._busy_chats.add(chat_id)
+            self._pending.remove(request)
+            if request.edit_key is not None:
+                self._edits.pop(request.edit_key, None)
+            return request, None
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    request, wait = self._next()
+                    if request:
+                        break
+                    self._cond.wait(wait)
+            self._send(request)
+
+    def _send(self, request: _Request):
+        try:
+            for arg in list(request.args) + list(request.kwargs.values()):
+                # Rewind uploads (send_document) before a retry
+                if request.attempts and hasattr(arg, 'seek'):
+                    arg.seek(0)
+            request.attempts += 1
+            result = request.method(*request.args, **request.kwargs)
+        except ApiTelegramException as e:
+            if e.error_code == 429 and request.attempts <= self.max_retries:
+                retry_after = float(((e.result_json or {}).get('parameters') or {}).get('retry_after', 1))
+                logger.warning(f"Telegram flood limit for chat {request.chat_id}, retrying in {retry_after}s")
+                with self._cond:
+                    self.stats['rate_limited'] += 1
+                    resume = time.monotonic() + retry_after
+                    if request.chat_id is not None:
+                        self._paused[request.chat_id] = max(self._paused.get(request.chat_id, 0), resume)
+                    request.not_before = resume
+                    self._requeue(request)
+                return
+            self._finish(request, error=e)
+        except Exception as e:
+            self._finish(request, error=e)
+        else:
+            self._finish(request, result=result)
+
+    def _requeue(self, request: _Request):
+        """Put a rate-limited request back, merging it with a newer edit of the same message (under the lock)"""
+        self._busy_chats.discard(request.chat_id)
+        newer = self._edits.get(request.edit_key) if request.edit_key is not None else None
+        if newer is not None:
+            newer.futures = request.futures + newer.futures
+            newer.not_before = max(newer.not_before, request.not_before)
+        else:
+            self._pending.append(request)
+            if request.edit_key is not None:
+                self._edits[request.edit_key] = request
+        self._cond.notify_all()
+
+    def _finish(self, request: _Request, result=None, error: Exception = None):
+        with self._cond:
+            self._busy_chats.discard(request.chat_id)
+            if request.chat_id in self._paused and self._paused[request.chat_id] <= time.monotonic():
+                del self._paused[request.chat_id]
+            self.stats['failed' if error else 'sent'] += 1
+            self._cond.notify_all()
+        for future in request.futures:
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+class ThrottledTeleBot(telebot.TeleBot):
+    """TeleBot whose outgoing messages go through an Outbox"""
+
+    def __init__(self, *args, outbox: Optional[Outbox] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.outbox = outbox or Outbox()
+
+    def send_message(self, chat_id, *args, **kwargs):
+        return self.outbox.call(super().send_message, (chat_id,) + args, kwargs, chat_id=chat_id)
+
+    def send_document(self, chat_id, *args, **kwargs):
+        return self.outbox.call(super().send_document, (chat_id,) + args, kwargs, chat_id=chat_id)
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, *args, **kwargs):
+        edit_key = ('text', chat_id, message_id or kwargs.get('inline_message_id'))
+        return self.outbox.call(super().edit_message_text, (text, chat_id, message_id) + args, kwargs,
+                                chat_id=chat_id, edit_key=edit_key)
+
+    def edit_message_reply_markup(self, chat_id=None, message_id=None, *args, **kwargs):
+        edit_key = ('markup', chat_id, message_id or kwargs.get('inline_message_id'))
+        return self.outbox.call(super().edit_message_reply_markup, (chat_id, message_id) + args, kwargs,
+                                chat_id=chat_id, edit_key=edit_key)
+
+    def delete_message(self, chat_id, *args, **kwargs):
+        return self.outbox.call(super().delete_message, (chat_id,) + args, kwargs, chat_id=chat_id)
+
+    def answer_callback_query(self, callback_query_id, *args, **kwargs):
+        # Not tied to a chat: only the global limit applies
+        return self.outbox.call(super().answer_callback_query, (callback_query_id,) + args, kwargs,
+                                priority=PRIORITY_CALLBACK)
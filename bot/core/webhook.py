@@ -0,0 +1,178 @@
+"""
+Embedded HTTP server: Telegram webhook ingress, /health and /metrics
+"""
+
+import json
+import logging
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+from telebot.types import Update
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookServer:
+    """Accepts updates over HTTP, acknowledges immediately and processes them on worker threads"""
+
+    def __init__(self, host: str, port: int, process_update: Callable[[Update], None] = None,
+                 webhook_path: str = None, secret_token: str = None, workers: int = 4,
+                 queue_size: int = 1000, metrics_provider: Callable[[], Dict[str, float]] = None):
+        self.host = host
+        self.port = port
+        self.process_update = process_update
+        # Without a webhook path the server only answers /health and /metrics
+        self.webhook_path = webhook_path if process_update else None
+        self.secret_token = secret_token
+        self.workers = workers
+        self.metrics_provider = metrics_provider
+        self.updates = queue.Queue(maxsize=queue_size)
+        self.started_at = time.time()
+        self.counters = {
+            'updates_received': 0,
+            'updates_processed': 0,
+            'updates_failed': 0,
+            'updates_rejected': 0,
+        }
+        self.processing_seconds = 0.0
+        self._counters_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._httpd: Optional[ThreadingHTTPServer] = None
+        self._threads = []
+
+    def _count(self, name: str, seconds: float = 0.0):
+        with self._counters_lock:
+            self.counters[name] += 1
+            self.processing_seconds += seconds
+
+    def enqueue(self, update: Update) -> bool:
+        """Queue an update for the workers; False when the queue is full"""
+        try:
+            self.updates.put_nowait(update)
+            self._count('updates_received')
+            return True
+        except queue.Full:
+            self._count('updates_rejected')
+            return False
+
+    def _worker(self):
+        """Drain the update queue until stopped"""
+        while not self._stop.is_set():
+            try:
+                update = self.updates.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            start = time.perf_counter()
+            try:
+                self.process_update(update)
+                self._count('updates_processed', time.perf_counter() - start)
+            except Exception as e:
+                logger.error(f"Error processing webhook update: {e}")
+                self._count('updates_failed', time.perf_counter() - start)
+            finally:
+                self.updates.task_done()
+
+    def render_metrics(self) -> str:
+        """Prometheus text exposition of server counters and provider gauges"""
+        with self._counters_lock:
+            counters = dict(self.counters)
+            processing_seconds = self.processing_seconds
+
+        lines = []
+        for name, value in counters.items():
+            lines.append(f"# TYPE marz_{name}_total counter")
+            lines.append(f"marz_{name}_total {value}")
+        lines.append("# TYPE marz_update_processing_seconds_total counter")
+        lines.append(f"marz_update_processing_seconds_total {processing_seconds:.6f}")
+        lines.append("# TYPE marz_update_queue_depth gauge")
+        lines.append(f"marz_update_queue_depth {self.updates.qsize()}")
+        lines.append("# TYPE marz_uptime_seconds gauge")
+        lines.append(f"marz_uptime_seconds {time.time() - self.started_at:.0f}")
+
+        if self.metrics_provider:
+            try:
+                for name, value in self.metrics_provider().items():
+                    lines.append(f"# TYPE marz_{name} gauge")
+                    lines.append(f"marz_{name} {value}")
+            except Exception as e:
+                logger.error(f"Error collecting metrics: {e}")
+
+        return '\n'.join(lines) + '\n'
+
+    def _make_handler(self):
+        server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def _reply(self, status: int, body: bytes = b'', content_type: str = 'text/plain'):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if body:
+                    self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == '/health':
+                    body = json.dumps({
+                        'status': 'ok',
+                        'queue_depth': server.updates.qsize()
+                    }).encode()
+                    self._reply(200, body, 'application/json')
+                elif self.path == '/metrics':
+                    self._reply(200, server.render_metrics().encode(), 'text/plain; version=0.0.4')
+                else:
+                    self._reply(404)
+
+            def do_POST(self):
+                if not server.webhook_path or self.path != server.webhook_path:
+                    self._reply(404)
+                    return
+
+                if server.secret_token and \
+                        self.headers.get('X-Telegram-Bot-Api-Secret-Token') != server.secret_token:
+                    self._reply(403)
+                    return
+
+                try:
+                    length = int(self.headers.get('Content-Length') or 0)
+                    update = Update.de_json(self.rfile.read(length).decode('utf-8'))
+                except Exception as e:
+                    logger.error(f"Invalid webhook payload: {e}")
+                    self._reply(400)
+                    return
+
+                # 503 makes Telegram redeliver later instead of the update being dropped
+                self._reply(200 if server.enqueue(update) else 503)
+
+            def log_message(self, format, *args):
+                logger.debug(f"HTTP {self.address_string()} {format % args}")
+
+        return RequestHandler
+
+    def start(self):
+        """Start the HTTP listener and update workers in background threads"""
+        self._httpd = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self._httpd.daemon_threads = True
+
+        listener = threading.Thread(target=self._httpd.serve_forever, name='http-server', daemon=True)
+        listener.start()
+        self._threads.append(listener)
+
+        if self.webhook_path:
+            for n in range(self.workers):
+                worker = threading.Thread(target=self._worker, name=f"webhook-worker-{n}", daemon=True)
+                worker.start()
+                self._threads.append(worker)
+
+        logger.info(f"HTTP server listening on {self.host}:{self.port}")
+
+    def stop(self):
+        """Stop accepting requests and let workers exit"""
+        self._stop.set()
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
@@ -6,25 +6,289 @@ Database management for the bot
 import sqlite3
 import logging
 import threading
+import queue
 import json
 import os
-from typing import List, Dict, Any, Optional
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# Pragmas applied to every pooled connection. WAL lets readers run alongside
+# the single writer, and NORMAL sync is durable across application crashes.
+SQLITE_PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -8000",       # ~8 MiB page cache per connection
+    "PRAGMA mmap_size = 67108864",     # 64 MiB memory-mapped reads
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+]
+
+# Versioned schema migrations. Migration N (1-based) moves PRAGMA user_version
+# from N-1 to N; shipped entries must never change - append new ones instead.
+MIGRATIONS = [
+    # 1: secondary indexes for per-panel, per-owner and per-host lookups
+    [
+        "CREATE INDEX IF NOT EXISTS idx_panels_added_by ON panels (added_by)",
+        "CREATE INDEX IF NOT EXISTS idx_panels_url_username ON panels (url, username)",
+        # Keep the newest row of any duplicated remote node before enforcing uniqueness
+        """DELETE FROM nodes WHERE node_id IS NOT NULL AND id NOT IN (
+               SELECT MAX(id) FROM nodes WHERE node_id IS NOT NULL GROUP BY panel_id, node_id
+           )""",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_nodes_panel_node ON nodes (panel_id, node_id)",
+        "CREATE INDEX IF NOT EXISTS idx_ssh_servers_host ON ssh_servers (ip_address, port)",
+        "CREATE INDEX IF NOT EXISTS idx_ssh_servers_node ON ssh_servers (node_id)",
+    ],
+    # 2: per-server install checkpoints
+    [
+        "ALTER TABLE ssh_servers ADD COLUMN panel_id INTEGER REFERENCES panels (id)",
+        "ALTER TABLE ssh_servers ADD COLUMN completed_steps TEXT DEFAULT ''",
+        "ALTER TABLE ssh_servers ADD COLUMN updated_at TIMESTAMP",
+        "CREATE INDEX IF NOT EXISTS idx_ssh_servers_panel_host ON ssh_servers (panel_id, ip_address, port)",
+    ],
+    # 3: per-panel node health check interval (NULL = NODE_MONITOR_INTERVAL)
+    [
+        "ALTER TABLE panels ADD COLUMN health_interval INTEGER",
+    ],
+]
+
 class DatabaseManager:
-    def __init__(self, db_path: str = 'bot_database.db'):
+    def __init__(self, db_path: str = 'bot_database.db', pool_size: int = 8,
+                 write_behind_ms: int = 0, write_behind_rows: int = 100,
+                 user_cache_size: int = 1024, user_cache_ttl: int = 300):
         self.db_path = db_path
+        self.pool_size = max(1, pool_size)
+        # Serializes writers only - readers use their own pooled connection
         self.lock = threading.Lock()
+        self._pool = queue.LifoQueue()
+        self._pool_lock = threading.Lock()
+        self._connections: List[sqlite3.Connection] = []
+        
+        # Write-behind queue for non-durable writes (disabled when write_behind_ms is 0)
+        self.write_behind_ms = write_behind_ms
+        self.write_behind_rows = max(1, write_behind_rows)
+        # (query, params, table, row id); table/row id None when the write may touch anything
+        self._pending: List[Tuple[str, tuple, Optional[str], Any]] = []
+        self._pending_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._flusher_stop = threading.Event()
+        self._flusher = None
+        # Queued writes that failed or were rolled back; their callers already returned True
+        self.write_behind_failed = 0
+        
+        # Bounded LRU+TTL cache for get_user (user_id -> (expires_at, row))
+        self.user_cache_size = user_cache_size
+        self.user_cache_ttl = user_cache_ttl
+        self._user_cache = OrderedDict()
+        self._user_cache_lock = threading.Lock()
+        self._user_cache_generation = 0
+        self.user_cache_hits = 0
+        self.user_cache_misses = 0
+        
         self._init_database()
+        
+        if self.write_behind_ms > 0:
+            self._flusher = threading.Thread(
+                target=self._flush_loop, name='db-write-behind', daemon=True
+            )
+            self._flusher.start()
+    
+    def _create_connection(self) -> sqlite3.Connection:
+        """Open a long-lived connection with the tuned pragmas applied"""
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+    
+    def _acquire(self) -> sqlite3.Connection:
+        """Take a connection from the pool, opening a new one while below pool_size"""
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self._pool_lock:
+            if len(self._connections) < self.pool_size:
+                conn = self._create_connection()
+                self._connections.append(conn)
+                return conn
+        
+        return self._pool.get()
+    
+    def _release(self, conn: sqlite3.Connection):
+        """Return a connection to the pool"""
+        if conn.in_transaction:
+            conn.rollback()
+        self._pool.put(conn)
+    
+    @contextmanager
+    def _read(self, table: str = None, row_id: Any = None):
+        """Cursor on a pooled connection for read-only queries
+
+        Read-your-writes: queued writes are committed first, but only when
+        one of them touches table (row row_id if given); table None reads
+        anything. Reads of other rows never wait for the writer.
+        """
+        if self._pending and self._pending_touches(table, row_id):
+            self.flush()
+        conn = self._acquire()
+        try:
+            yield conn.cursor()
+        finally:
+            self._release(conn)
+    
+    @contextmanager
+    def _write(self):
+        """Cursor on a pooled connection inside a committed write transaction"""
+        with self.lock:
+            conn = self._acquire()
+            try:
+                cursor = conn.cursor()
+                # Queued writes go first so they are never applied after a newer durable one,
+                # in their own transaction so a failing caller can't roll them back
+                applied = self._apply_pending(cursor)
+                if applied:
+                    try:
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        with self._pending_lock:
+                            self.write_behind_failed += applied
+                        logger.error(f"{applied} queued writes were lost in a failed commit")
+                        raise
+                yield cursor
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                self._release(conn)
+    
+    def _apply_pending(self, cursor: sqlite3.Cursor) -> int:
+        """Execute every queued write on cursor (caller owns the transaction); returns how many succeeded"""
+        with self._pending_lock:
+            batch, self._pending = self._pending, []
+        
+        applied = 0
+        for query, params, _, _ in batch:
+            try:
+                cursor.execute(query, params)
+                applied += 1
+            except Exception as e:
+                logger.error(f"Error applying queued write: {e}")
+                with self._pending_lock:
+                    self.write_behind_failed += 1
+        return applied
+    
+    def _pending_touches(self, table: Optional[str], row_id: Any) -> bool:
+        """Whether a queued write may touch what a read of table (row row_id) sees"""
+        with self._pending_lock:
+            for _, _, pending_table, pending_row in self._pending:
+                if table is None or pending_table is None:
+                    return True
+                if pending_table == table and (row_id is None or pending_row is None or pending_row == row_id):
+                    return True
+        return False
+    
+    def _execute_write(self, query: str, params: tuple, durable: bool = True,
+                       table: str = None, row_id: Any = None):
+        """Run a single write now, or queue it for the next batch when not durable
+
+        table/row_id name what a queued write touches, so only reads of it flush the queue.
+        """
+        if not durable and self._flusher:
+            with self._pending_lock:
+                self._pending.append((query, params, table, row_id))
+                queued = len(self._pending)
+            if queued >= self.write_behind_rows:
+                self._flush_event.set()
+            return
+        
+        with self._write() as cursor:
+            cursor.execute(query, params)
+    
+    def flush(self):
+        """Commit all queued writes in a single transaction"""
+        if not self._pending:
+            return
+        try:
+            with self._write():
+                pass
+        except Exception as e:
+            logger.error(f"Error flushing queued writes: {e}")
+    
+    def _flush_loop(self):
+        """Background flusher - wakes every write_behind_ms or when write_behind_rows are queued"""
+        interval = self.write_behind_ms / 1000
+        while not self._flusher_stop.is_set():
+            self._flush_event.wait(interval)
+            self._flush_event.clear()
+            self.flush()
+    
+    def _cache_user(self, user_id: int, user: Optional[Dict[str, Any]], generation: int):
+        """Store a get_user result, evicting the least recently used entry when full"""
+        if self.user_cache_size <= 0:
+            return
+        with self._user_cache_lock:
+            # An invalidation raced with this read - the row may already be stale
+            if generation != self._user_cache_generation:
+                return
+            self._user_cache[user_id] = (time.monotonic() + self.user_cache_ttl, user)
+            self._user_cache.move_to_end(user_id)
+            while len(self._user_cache) > self.user_cache_size:
+                self._user_cache.popitem(last=False)
+    
+    def invalidate_user_cache(self, user_id: int = None):
+        """Drop one cached user, or the whole cache when user_id is None"""
+        with self._user_cache_lock:
+            self._user_cache_generation += 1
+            if user_id is None:
+                self._user_cache.clear()
+            else:
+                self._user_cache.pop(user_id, None)
+    
+    def get_user_cache_stats(self) -> Dict[str, int]:
+        """Hit/miss counters for the user cache"""
+        with self._user_cache_lock:
+            return {
+                'hits': self.user_cache_hits,
+                'misses': self.user_cache_misses,
+                'size': len(self._user_cache)
+            }
+    
+    def get_write_behind_stats(self) -> Dict[str, int]:
+        """Queued writes not yet committed and queued writes that were lost"""
+        with self._pending_lock:
+            return {
+                'pending': len(self._pending),
+                'failed': self.write_behind_failed
+            }
+    
+    def close(self):
+        """Flush queued writes and close every pooled connection"""
+        if self._flusher:
+            self._flusher_stop.set()
+            self._flush_event.set()
+            self._flusher.join(timeout=5)
+            self._flusher = None
+        self.flush()
+        
+        with self._pool_lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except Exception as e:
+                    logger.error(f"Error closing database connection: {e}")
+            self._connections = []
+            self._pool = queue.LifoQueue()
     
     def _init_database(self):
         """Initialize database tables"""
-        with self.lock:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
+        with self._write() as cursor:
             # Users table
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS users (
@@ -107,46 +371,90 @@ class DatabaseManager:
                     commands_executed INTEGER DEFAULT 0
                 )
             ''')
-            
-            conn.commit()
-            conn.close()
-            logger.info("Database initialized successfully")
+        
+        self._migrate()
+        logger.info("Database initialized successfully")
+    
+    def _migrate(self):
+        """Apply pending MIGRATIONS, each in its own transaction"""
+        with self.lock:
+            conn = self._acquire()
+            try:
+                self._apply_migrations(conn)
+            finally:
+                self._release(conn)
+    
+    @staticmethod
+    def _apply_migrations(conn: sqlite3.Connection):
+        """Bring conn's schema up to the latest migration (caller holds the writer lock)"""
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        
+        for target, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            logger.info(f"Applying database migration {target}")
+            conn.execute('BEGIN')
+            try:
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {target}')
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+    
+    @staticmethod
+    def _node_from_row(result) -> Dict[str, Any]:
+        """Map a nodes table row to a dict"""
+        return {
+            'id': result[0],
+            'panel_id': result[1],
+            'node_id': result[2],
+            'name': result[3],
+            'address': result[4],
+            'port': result[5],
+            'api_port': result[6],
+            'usage_coefficient': result[7],
+            'xray_version': result[8],
+            'status': result[9],
+            'message': result[10],
+            'created_at': result[11],
+            'updated_at': result[12]
+        }
     
     def add_user(self, user_id: int, username: str = None, first_name: str = None, 
-                 last_name: str = None, language: str = 'en') -> bool:
+                 last_name: str = None, language: str = 'en', durable: bool = True) -> bool:
         """Add or update user"""
         try:
-            with self.lock:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    INSERT OR REPLACE INTO users 
-                    (user_id, username, first_name, last_name, language, last_active)
-                    VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-                ''', (user_id, username, first_name, last_name, language))
-                
-                conn.commit()
-                conn.close()
-                return True
+            self._execute_write('''
+                INSERT OR REPLACE INTO users
+                (user_id, username, first_name, last_name, language, last_active)
+                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ''', (user_id, username, first_name, last_name, language), durable, table='users', row_id=user_id)
+            self.invalidate_user_cache(user_id)
+            
+            return True
         except Exception as e:
             logger.error(f"Error adding user: {e}")
             return False
     
     def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Get user by ID"""
+        with self._user_cache_lock:
+            cached = self._user_cache.get(user_id)
+            if cached and cached[0] > time.monotonic():
+                self._user_cache.move_to_end(user_id)
+                self.user_cache_hits += 1
+                return dict(cached[1]) if cached[1] else None
+            self.user_cache_misses += 1
+            generation = self._user_cache_generation
+        
         try:
-            with self.lock:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
+            with self._read('users', user_id) as cursor:
                 cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
                 result = cursor.fetchone()
                 
-                conn.close()
-                
+                user = None
                 if result:
-                    return {
+                    user = {
                         'user_id': result[0],
                         'username': result[1],
                         'first_name': result[2],
@@ -156,47 +464,55 @@ class DatabaseManager:
                         'created_at': result[6],
                         'last_active': result[7]
                     }
-                return None
+                
+                self._cache_user(user_id, user, generation)
+                return dict(user) if user else None
         except Exception as e:
             logger.error(f"Error getting user: {e}")
             return None
     
-    def update_user_language(self, user_id: int, language: str) -> bool:
+    def update_user_language(self, user_id: int, language: str, durable: bool = True) -> bool:
         """Update user language"""
         try:
-            with self.lock:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    UPDATE users SET language = ?, last_active = CURRENT_TIMESTAMP 
-                    WHERE user_id = ?
-                ''', (language, user_id))
-                
-                conn.commit()
-                conn.close()
-                return True
+            self._execute_write('''
+                UPDATE users SET language = ?, last_active = CURRENT_TIMESTAMP
+                WHERE user_id = ?
+            ''', (language, user_id), durable, table='users', row_id=user_id)
+            self.invalidate_user_cache(user_id)
+            
+            return True
         except Exception as e:
             logger.error(f"Error updating user language: {e}")
             return False
     
+    @staticmethod
+    def _panel_from_row(result) -> Dict[str, Any]:
+        """Map a panels table row to a dict"""
+        return {
+            'id': result[0],
+            'name': result[1],
+            'url': result[2],
+            'username': result[3],
+            'password': result[4],
+            'panel_type': result[5],
+            'access_token': result[6],
+            'token_expires': result[7],
+            'added_by': result[8],
+            'created_at': result[9],
+            'health_interval': result[10]
+        }
+    
     def add_panel(self, name: str, url: str, username: str, password: str, 
                   panel_type: str = 'marzban', added_by: int = None) -> Optional[int]:
         """Add new panel"""
         try:
-            with self.lock:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
+            with self._write() as cursor:
                 cursor.execute('''
                     INSERT INTO panels (name, url, username, password, panel_type, added_by)
                     VALUES (?, ?, ?, ?, ?, ?)
                 ''', (name, url, username, password, panel_type, added_by))
                 
-                panel_id = cursor.lastrowid
-                conn.commit()
-                conn.close()
-                return panel_id
+                return cursor.lastrowid
         except Exception as e:
             logger.error(f"Error adding panel: {e}")
             return None
@@ -204,33 +520,15 @@ class DatabaseManager:
     def get_panels(self, user_id: int = None) -> List[Dict[str, Any]]:
         """Get all panels or panels by user"""
         try:
-            with self.lock:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
+            with self._read('panels') as cursor:
                 if user_id:
                     cursor.execute('SELECT * FROM panels WHERE added_by = ?', (user_id,))
                 else:
                     cursor.execute('SELECT * FROM panels')
                 
                 results = cursor.fetchall()
-                conn.close()
                 
-                panels = []
-                for result in results:
-                    panels.append({
-                        'id': result[0],
-                        'name': result[1],
-                        'url': result[2],
-                        'username': result[3],
-                        'password': result[4],
-                        'panel_type': result[5],
-                        'access_token': result[6],
-                        'token_expires': result[7],
-                        'added_by': result[8],
-                        'created_at': result[9]
-                    })
-                return panels
+                return [self._panel_from_row(result) for result in results]
         except Exception as e:
             logger.error(f"Error getting panels: {e}")
             return []
@@ -238,48 +536,37 @@ class DatabaseManager:
     def get_panel(self, panel_id: int) -> Optional[Dict[str, Any]]:
         """Get panel by ID"""
         try:
-            with self.lock:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
+            with self._read('panels', panel_id) as cursor:
                 cursor.execute('SELECT * FROM panels WHERE id = ?', (panel_id,))
                 result = cursor.fetchone()
                 
-                conn.close()
-                
-                if result:
-                    return {
-                        'id': result[0],
-                        'name': result[1],
-                        'url': result[2],
-                        'username': result[3],
-                        'password': result[4],
-                        'panel_type': result[5],
-                        'access_token': result[6],
-                        'token_expires': result[7],
-                        'added_by': result[8],
-                        'created_at': result[9]
-                    }
-                return None
+                return self._panel_from_row(result) if result else None
         except Exception as e:
             logger.error(f"Error getting panel: {e}")
             return None
     
-    def update_panel_token(self, panel_id: int, access_token: str, expires_at: str = None) -> bool:
+    def set_panel_health_interval(self, panel_id: int, seconds: Optional[int]) -> bool:
+        """Set how often the node monitor polls a panel (None restores the default)"""
+        try:
+            self._execute_write(
+                'UPDATE panels SET health_interval = ? WHERE id = ?',
+                (seconds, panel_id)
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Error updating panel health interval: {e}")
+            return False
+    
+    def update_panel_token(self, panel_id: int, access_token: str, expires_at: str = None,
+                           durable: bool = True) -> bool:
         """Update panel access token"""
         try:
-            with self.lock:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    UPDATE panels SET access_token = ?, token_expires = ?
-                    WHERE id = ?
-                ''', (access_token, expires_at, panel_id))
-                
-                conn.commit()
-                conn.close()
-                return True
+            self._execute_write('''
+                UPDATE panels SET access_token = ?, token_expires = ?
+                WHERE id = ?
+            ''', (access_token, expires_at, panel_id), durable, table='panels', row_id=panel_id)
+            
+            return True
         except Exception as e:
             logger.error(f"Error updating panel token: {e}")
             return False
@@ -287,92 +574,123 @@ class DatabaseManager:
     def add_node(self, panel_id: int, node_id: int, name: str, address: str, 
                  port: int, api_port: int, usage_coefficient: float = 1.0,
                  xray_version: str = None, status: str = None, message: str = None) -> Optional[int]:
-        """Add new node"""
+        """Add new node, or refresh the existing row for the same remote node"""
         try:
-            with self.lock:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
+            with self._write() as cursor:
                 cursor.execute('''
                     INSERT INTO nodes 
                     (panel_id, node_id, name, address, port, api_port, usage_coefficient, 
                      xray_version, status, message)
                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (panel_id, node_id) DO UPDATE SET
+                        name = excluded.name,
+                        address = excluded.address,
+                        port = excluded.port,
+                        api_port = excluded.api_port,
+                        usage_coefficient = excluded.usage_coefficient,
+                        xray_version = excluded.xray_version,
+                        status = excluded.status,
+                        message = excluded.message,
+                        updated_at = CURRENT_TIMESTAMP
                 ''', (panel_id, node_id, name, address, port, api_port, usage_coefficient,
                       xray_version, status, message))
                 
-                db_node_id = cursor.lastrowid
-                conn.commit()
-                conn.close()
-                return db_node_id
+                if node_id is None:
+                    return cursor.lastrowid
+                
+                # lastrowid is not reliable when the upsert took the UPDATE path
+                cursor.execute(
+                    'SELECT id FROM nodes WHERE panel_id = ? AND node_id = ?',
+                    (panel_id, node_id)
+                )
+                return cursor.fetchone()[0]
         except Exception as e:
             logger.error(f"Error adding node: {e}")
             return None
     
+    def upsert_nodes(self, panel_id: int, nodes: List[Dict[str, Any]]) -> bool:
+        """Insert or refresh many of a panel's nodes (API dicts) in one transaction"""
+        if not nodes:
+            return True
+        try:
+            with self._write() as cursor:
+                cursor.executemany('''
+                    INSERT INTO nodes
+                    (panel_id, node_id, name, address, port, api_port, usage_coefficient,
+                     xray_version, status, message)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (panel_id, node_id) DO UPDATE SET
+                        name = excluded.name,
+                        address = excluded.address,
+                        port = excluded.port,
+                        api_port = excluded.api_port,
+                        usage_coefficient = excluded.usage_coefficient,
+                        xray_version = excluded.xray_version,
+                        status = excluded.status,
+                        message = excluded.message,
+                        updated_at = CURRENT_TIMESTAMP
+                ''', [
+                    (panel_id, node.get('id'), node.get('name'), node.get('address'), node.get('port'),
+                     node.get('api_port'), node.get('usage_coefficient'), node.get('xray_version'),
+                     node.get('status'), node.get('message'))
+                    for node in nodes
+                ])
+            return True
+        except Exception as e:
+            logger.error(f"Error upserting nodes: {e}")
+            return False
+    
     def get_nodes(self, panel_id: int = None) -> List[Dict[str, Any]]:
         """Get nodes by panel"""
         try:
-            with self.lock:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
+            with self._read('nodes') as cursor:
                 if panel_id:
                     cursor.execute('SELECT * FROM nodes WHERE panel_id = ?', (panel_id,))
                 else:
                     cursor.execute('SELECT * FROM nodes')
                 
                 results = cursor.fetchall()
-                conn.close()
                 
-                nodes = []
-                for result in results:
-                    nodes.append({
-                        'id': result[0],
-                        'panel_id': result[1],
-                        'node_id': result[2],
-                        'name': result[3],
-                        'address': result[4],
-                        'port': result[5],
-                        'api_port': result[6],
-                        'usage_coefficient': result[7],
-                        'xray_version': result[8],
-                        'status': result[9],
-                        'message': result[10],
-                        'created_at': result[11],
-                        'updated_at': result[12]
-                    })
-                return nodes
+                return [self._node_from_row(result) for result in results]
         except Exception as e:
             logger.error(f"Error getting nodes: {e}")
             return []
     
-    def update_node(self, db_node_id: int, **kwargs) -> bool:
-        """Update node information"""
+    def get_node_by_remote_id(self, panel_id: int, node_id: int) -> Optional[Dict[str, Any]]:
+        """Get the local row for a panel's node id (uses the (panel_id, node_id) index)"""
         try:
-            with self.lock:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
-                # Build update query dynamically
-                fields = []
-                values = []
-                for key, value in kwargs.items():
-                    if key in ['name', 'address', 'port', 'api_port', 'usage_coefficient',
-                              'xray_version', 'status', 'message']:
-                        fields.append(f"{key} = ?")
-                        values.append(value)
+            with self._read('nodes') as cursor:
+                cursor.execute(
+                    'SELECT * FROM nodes WHERE panel_id = ? AND node_id = ?',
+                    (panel_id, node_id)
+                )
+                result = cursor.fetchone()
                 
-                if fields:
-                    fields.append("updated_at = CURRENT_TIMESTAMP")
-                    values.append(db_node_id)
-                    
-                    query = f"UPDATE nodes SET {', '.join(fields)} WHERE id = ?"
-                    cursor.execute(query, values)
-                    
-                    conn.commit()
+                return self._node_from_row(result) if result else None
+        except Exception as e:
+            logger.error(f"Error getting node: {e}")
+            return None
+    
+    def update_node(self, db_node_id: int, durable: bool = True, **kwargs) -> bool:
+        """Update node information"""
+        try:
+            # Build update query dynamically
+            fields = []
+            values = []
+            for key, value in kwargs.items():
+                if key in ['name', 'address', 'port', 'api_port', 'usage_coefficient',
+                          'xray_version', 'status', 'message']:
+                    fields.append(f"{key} = ?")
+                    values.append(value)
+            
+            if fields:
+                fields.append("updated_at = CURRENT_TIMESTAMP")
+                values.append(db_node_id)
                 
-                conn.close()
-                return True
+                query = f"UPDATE nodes SET {', '.join(fields)} WHERE id = ?"
+                self._execute_write(query, tuple(values), durable, table='nodes', row_id=db_node_id)
+            
+            return True
         except Exception as e:
             logger.error(f"Error updating node: {e}")
             return False
@@ -380,41 +698,187 @@ class DatabaseManager:
     def delete_node(self, db_node_id: int) -> bool:
         """Delete node"""
         try:
-            with self.lock:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
+            with self._write() as cursor:
                 cursor.execute('DELETE FROM nodes WHERE id = ?', (db_node_id,))
                 
-                conn.commit()
-                conn.close()
                 return True
         except Exception as e:
             logger.error(f"Error deleting node: {e}")
             return False
     
-    def create_backup(self) -> str:
-        """Create database backup"""
+    @staticmethod
+    def _ssh_server_from_row(result) -> Dict[str, Any]:
+        return {
+            'id': result[0],
+            'ip_address': result[1],
+            'port': result[2],
+            'username': result[3],
+            'auth_method': result[4],
+            'password': result[5],
+            'ssh_key': result[6],
+            'status': result[7],
+            'node_id': result[8],
+            'added_by': result[9],
+            'created_at': result[10],
+            'panel_id': result[11],
+            'completed_steps': [step for step in (result[12] or '').split(',') if step],
+            'updated_at': result[13]
+        }
+    
+    def get_ssh_server(self, ip_address: str, port: int, panel_id: int) -> Optional[Dict[str, Any]]:
+        """Get the install record of a server for a panel"""
+        try:
+            with self._read('ssh_servers') as cursor:
+                cursor.execute(
+                    'SELECT * FROM ssh_servers WHERE panel_id = ? AND ip_address = ? AND port = ?',
+                    (panel_id, ip_address, port)
+                )
+                result = cursor.fetchone()
+                
+                return self._ssh_server_from_row(result) if result else None
+        except Exception as e:
+            logger.error(f"Error getting SSH server: {e}")
+            return None
+    
+    def get_ssh_servers(self, panel_id: int, status: str = None) -> List[Dict[str, Any]]:
+        """Install records of a panel's servers, optionally only those with status"""
+        try:
+            with self._read('ssh_servers') as cursor:
+                if status:
+                    cursor.execute(
+                        'SELECT * FROM ssh_servers WHERE panel_id = ? AND status = ? ORDER BY ip_address, port',
+                        (panel_id, status)
+                    )
+                else:
+                    cursor.execute('SELECT * FROM ssh_servers WHERE panel_id = ? ORDER BY ip_address, port', (panel_id,))
+                return [self._ssh_server_from_row(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Error getting SSH servers: {e}")
+            return []
+    
+    def get_ssh_server_for_node(self, panel_id: int, db_node_id: Optional[int],
+                                address: str = None) -> Optional[Dict[str, Any]]:
+        """Server a node was installed on: linked by node id, else matched by the node's address"""
+        try:
+            with self._read('ssh_servers') as cursor:
+                cursor.execute('''
+                    SELECT * FROM ssh_servers
+                    WHERE node_id = ? OR (panel_id = ? AND ip_address = ?)
+                    ORDER BY node_id IS ? DESC, updated_at DESC
+                    LIMIT 1
+                ''', (db_node_id, panel_id, address, db_node_id))
+                result = cursor.fetchone()
+                
+                return self._ssh_server_from_row(result) if result else None
+        except Exception as e:
+            logger.error(f"Error getting SSH server of node: {e}")
+            return None
+    
+    def save_ssh_server(self, ip_address: str, port: int, username: str, panel_id: int,
+                        auth_method: str = 'password', password: str = None,
+                        ssh_key: str = None, added_by: int = None) -> Optional[int]:
+        """Create or refresh the install record of a server, keeping its checkpoints"""
+        try:
+            with self._write() as cursor:
+                cursor.execute(
+                    'SELECT id FROM ssh_servers WHERE panel_id = ? AND ip_address = ? AND port = ?',
+                    (panel_id, ip_address, port)
+                )
+                result = cursor.fetchone()
+                
+                if result:
+                    cursor.execute('''
+                        UPDATE ssh_servers SET username = ?, auth_method = ?, password = ?, ssh_key = ?,
+                            updated_at = CURRENT_TIMESTAMP
+                        WHERE id = ?
+                    ''', (username, auth_method, password, ssh_key, result[0]))
+                    return result[0]
+                
+                cursor.execute('''
+                    INSERT INTO ssh_servers (ip_address, port, username, auth_method, password, ssh_key,
+                                             added_by, panel_id, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ''', (ip_address, port, username, auth_method, password, ssh_key, added_by, panel_id))
+                return cursor.lastrowid
+        except Exception as e:
+            logger.error(f"Error saving SSH server: {e}")
+            return None
+    
+    def update_ssh_server(self, server_id: int, durable: bool = True, **kwargs) -> bool:
+        """Update install status, node link or completed steps of a server"""
         try:
-            backup_path = f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
+            fields = []
+            values = []
+            for key, value in kwargs.items():
+                if key == 'completed_steps':
+                    value = ','.join(value)
+                if key in ['status', 'node_id', 'completed_steps']:
+                    fields.append(f"{key} = ?")
+                    values.append(value)
             
-            with self.lock:
-                # Copy database file
-                import shutil
-                shutil.copy2(self.db_path, backup_path)
+            if fields:
+                fields.append("updated_at = CURRENT_TIMESTAMP")
+                values.append(server_id)
+                
+                query = f"UPDATE ssh_servers SET {', '.join(fields)} WHERE id = ?"
+                self._execute_write(query, tuple(values), durable, table='ssh_servers', row_id=server_id)
             
-            return backup_path
+            return True
         except Exception as e:
-            logger.error(f"Error creating backup: {e}")
-            return None
+            logger.error(f"Error updating SSH server: {e}")
+            return False
+    
+    def backup_to(self, backup_path: str) -> bool:
+        """Copy a consistent snapshot of the database (including WAL contents) to backup_path"""
+        try:
+            with self.lock:
+                conn = self._acquire()
+                try:
+                    target = sqlite3.connect(backup_path)
+                    try:
+                        conn.backup(target)
+                    finally:
+                        target.close()
+                finally:
+                    self._release(conn)
+            return True
+        except Exception as e:
+            logger.error(f"Error copying database to {backup_path}: {e}")
+            return False
+    
+    def restore_from(self, backup_path: str) -> bool:
+        """Overwrite the live database with the contents of backup_path, then migrate it to the current schema"""
+        try:
+            with self.lock:
+                conn = self._acquire()
+                try:
+                    source = sqlite3.connect(backup_path)
+                    try:
+                        source.backup(conn)
+                    finally:
+                        source.close()
+                    # Backups made by older versions carry their older schema and user_version
+                    self._apply_migrations(conn)
+                finally:
+                    self._release(conn)
+            self.invalidate_user_cache()
+            return True
+        except Exception as e:
+            logger.error(f"Error restoring database from {backup_path}: {e}")
+            return False
+    
+    def create_backup(self) -> str:
+        """Create database backup"""
+        backup_path = f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
+        
+        if self.backup_to(backup_path):
+            return backup_path
+        return None
     
     def add_admin(self, user_id: int, permissions: Dict[str, bool]) -> bool:
         """Add new admin with specific permissions"""
         try:
-            with self.lock:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
+            with self._write() as cursor:
                 # First ensure user exists
                 cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
                 if not cursor.fetchone():
@@ -454,10 +918,9 @@ class DatabaseManager:
                       permissions.get('can_view_stats', False),
                       permissions.get('can_backup', False),
                       permissions.get('can_add_admins', False)))
-                
-                conn.commit()
-                conn.close()
-                return True
+            
+            self.invalidate_user_cache(user_id)
+            return True
         except Exception as e:
             logger.error(f"Error adding admin: {e}")
             return False
@@ -465,15 +928,10 @@ class DatabaseManager:
     def get_admin_permissions(self, user_id: int) -> Dict[str, bool]:
         """Get admin permissions for user"""
         try:
-            with self.lock:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
+            with self._read('admin_permissions') as cursor:
                 cursor.execute('SELECT * FROM admin_permissions WHERE user_id = ?', (user_id,))
                 result = cursor.fetchone()
                 
-                conn.close()
-                
                 if result:
                     return {
                         'can_manage_panels': bool(result[1]),
@@ -486,14 +944,11 @@ class DatabaseManager:
         except Exception as e:
             logger.error(f"Error getting admin permissions: {e}")
             return {}
-
+    
     def get_stats(self) -> Dict[str, Any]:
         """Get bot statistics"""
         try:
-            with self.lock:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
+            with self._read() as cursor:
                 # Count users
                 cursor.execute('SELECT COUNT(*) FROM users')
                 total_users = cursor.fetchone()[0]
@@ -513,8 +968,6 @@ class DatabaseManager:
                 ''')
                 active_users = cursor.fetchone()[0]
                 
-                conn.close()
-                
                 return {
                     'total_users': total_users,
                     'total_panels': total_panels,
@@ -11,7 +11,6 @@ from bot.utils.decorators import admin_only
 import logging
 import os
 import sqlite3
-import shutil
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -106,6 +105,11 @@ class AdminHandler:
             stats_text += f"{get_text('total_nodes', lang, count=stats.get('total_nodes', 0))}\n"
             stats_text += f"{get_text('active_sessions', lang, count=len(getattr(self.bot, 'active_sessions', {})))}\n"
             
+            cache_stats = self.db.get_user_cache_stats()
+            lookups = cache_stats['hits'] + cache_stats['misses']
+            hit_rate = round(100 * cache_stats['hits'] / lookups, 1) if lookups else 0
+            stats_text += f"{get_text('user_cache_stats', lang, hits=cache_stats['hits'], misses=cache_stats['misses'], hit_rate=hit_rate)}\n"
+            
             keyboard = InlineKeyboardMarkup()
             keyboard.row(InlineKeyboardButton(
                 get_text('back', lang),
@@ -519,10 +523,12 @@ class AdminHandler:
         try:
             # Create backup of current database
             current_backup = f"current_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
-            shutil.copy2(self.db.db_path, current_backup)
+            if not self.db.backup_to(current_backup):
+                raise RuntimeError("could not back up current database")
             
-            # Replace with backup
-            shutil.copy2(backup_path, self.db.db_path)
+            # Replace with backup through the live connection pool so WAL stays consistent
+            if not self.db.restore_from(backup_path):
+                raise RuntimeError("could not restore backup")
             
             # Clean up temp file
             os.remove(backup_path)
@@ -1,26 +1,69 @@
 """Node management handler"""
 
 import telebot
+from telebot.apihelper import ApiTelegramException
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 from bot.database.db_manager import DatabaseManager
 from bot.texts.bot_texts import get_text
 from bot.services.marzban_api import MarzbanAPI
 from bot.services.ssh_manager import SSHManager
+from bot.services.ssh_keys import load_private_key
+from bot.services.bulk_scheduler import parse_server_line, run_bulk
+from bot.services.bulk_progress import BulkProgress, host_label
+from bot.services.node_diagnostics import certificate_checksum, get_diagnostics_cache
+from bot.services.node_inventory import (
+    fetch_inventory, flatten_inventory, paginate, get_panel_nodes,
+    get_node_snapshots, filter_nodes, NODE_FILTERS
+)
 from bot.utils.decorators import admin_only
+from bot.core.executors import get_executor, submit
+from bot.core.outbox import background_sends
+from bot.config.settings import (
+    ADMIN_IDS, BULK_PROGRESS_INTERVAL, FLEET_BATCH_SIZE, FLEET_MAX_FAILURE_RATE, FLEET_COMMAND_TIMEOUT,
+    NODE_MONITOR_INTERVAL, NODE_SNAPSHOT_TTL
+)
+import io
 import logging
 import random
 import string
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
 
 logger = logging.getLogger(__name__)
 
+# Minimum seconds between progress edits of the same message
+INVENTORY_EDIT_INTERVAL = 1.0
+# Nodes listed by name in one health alert
+HEALTH_ALERT_MAX_NODES = 20
+# Shortest per-panel health check interval an admin can set (seconds)
+MIN_HEALTH_INTERVAL = 30
+# Fleet command reports longer than this are sent as a file
+FLEET_REPORT_MAX_CHARS = 3500
+# Log lines in the diagnostics view are cut to this width (Telegram caps messages at 4096 chars)
+DIAGNOSTICS_LOG_LINE_CHARS = 120
+
+STATUS_EMOJI = {
+    'connected': "🟢",
+    'connecting': "🟡",
+    'disabled': "⚪",
+}
+
+FILTER_EMOJI = {
+    'all': "📋",
+    'connected': "🟢",
+    'error': "🔴",
+    'disabled': "⚪",
+}
+
 class NodeHandler:
     def __init__(self, bot: telebot.TeleBot, db: DatabaseManager):
         self.bot = bot
         self.db = db
         self.marzban_api = MarzbanAPI()
         self.ssh_manager = SSHManager()
+        # Last all-panels inventory per user as (fetched at, results), paged
+        # without refetching until it is as old as a panel snapshot
+        self._inventories = {}
 
     @admin_only
     def handle_manage_nodes_menu(self, call):
@@ -47,6 +90,12 @@ class NodeHandler:
                 callback_data=f'node_select_panel_{panel["id"]}'
             ))
 
+        if len(panels) > 1:
+            keyboard.row(InlineKeyboardButton(
+                get_text('all_panels_nodes', lang),
+                callback_data='node_all'
+            ))
+
         keyboard.row(InlineKeyboardButton(
             get_text('back', lang),
             callback_data='node_back_main'
@@ -68,9 +117,26 @@ class NodeHandler:
             panel_id = int(call.data.split('_')[3])
             self._show_node_management_options(call, panel_id, lang)
 
+        elif call.data == 'node_all':
+            self._show_all_nodes(call, lang)
+
+        elif call.data.startswith('node_all_p'):
+            page = int(call.data[len('node_all_p'):])
+            self._show_all_nodes_page(call, page, lang)
+
         elif call.data.startswith('node_list_'):
-            panel_id = int(call.data.split('_')[2])
-            self._show_nodes_list(call, panel_id, lang)
+            # node_list_{panel_id}[_p{page}][_{filter}][_r]
+            parts = call.data.split('_')
+            panel_id = int(parts[2])
+            page, status_filter, refresh = 0, 'all', False
+            for part in parts[3:]:
+                if part == 'r':
+                    refresh = True
+                elif part in NODE_FILTERS:
+                    status_filter = part
+                elif part.startswith('p') and part[1:].isdigit():
+                    page = int(part[1:])
+            self._show_nodes_list(call, panel_id, lang, page, status_filter, refresh)
 
         elif call.data.startswith('node_add_'):
             panel_id = int(call.data.split('_')[2])
@@ -82,6 +148,15 @@ class NodeHandler:
             node_id = int(parts[3])
             self._show_node_info(call, panel_id, node_id, lang)
 
+        elif call.data.startswith('node_diag_'):
+            # node_diag_{panel_id}_{node_id}
+            parts = call.data.split('_')
+            self._show_node_diagnostics(call, int(parts[2]), int(parts[3]), lang)
+
+        elif call.data.startswith('node_reconnect_failed_'):
+            panel_id = int(call.data.split('_')[3])
+            self._reconnect_failed_nodes(call, panel_id, lang)
+
         elif call.data.startswith('node_reconnect_'):
             parts = call.data.split('_')
             panel_id = int(parts[2])
@@ -100,6 +175,26 @@ class NodeHandler:
             node_id = int(parts[3])
             self._update_node_info(call, panel_id, node_id, lang)
 
+        elif call.data.startswith('node_fleet_run_'):
+            panel_id = int(call.data.split('_')[3])
+            self._run_fleet_command(call, panel_id, lang)
+
+        elif call.data.startswith('node_fleet_'):
+            panel_id = int(call.data.split('_')[2])
+            self._start_fleet_command(call, panel_id, lang)
+
+        elif call.data.startswith('node_sync_run_'):
+            panel_id = int(call.data.split('_')[3])
+            self._run_node_sync(call, panel_id, lang)
+
+        elif call.data.startswith('node_sync_'):
+            panel_id = int(call.data.split('_')[2])
+            self._confirm_node_sync(call, panel_id, lang)
+
+        elif call.data.startswith('node_health_'):
+            panel_id = int(call.data.split('_')[2])
+            self._start_health_interval(call, panel_id, lang)
+
         elif call.data.startswith('node_install_single_'):
             panel_id = int(call.data.split('_')[3])
             self._start_single_install(call, panel_id, lang)
@@ -133,6 +228,21 @@ class NodeHandler:
             callback_data=f'node_add_{panel_id}'
         ))
 
+        keyboard.row(InlineKeyboardButton(
+            get_text('fleet_command', lang),
+            callback_data=f'node_fleet_{panel_id}'
+        ))
+
+        keyboard.row(InlineKeyboardButton(
+            get_text('node_sync', lang),
+            callback_data=f'node_sync_{panel_id}'
+        ))
+
+        keyboard.row(InlineKeyboardButton(
+            get_text('health_interval', lang),
+            callback_data=f'node_health_{panel_id}'
+        ))
+
         keyboard.row(InlineKeyboardButton(
             get_text('back', lang),
             callback_data='node_back_main'
@@ -145,63 +255,172 @@ class NodeHandler:
             reply_markup=keyboard
         )
 
-    def _show_nodes_list(self, call, panel_id, lang):
-        """Show list of nodes for panel"""
+    def _render_inventory(self, results, page, lang, done=None, total=None):
+        """Build text and keyboard for an all-panels inventory page"""
+        entries = flatten_inventory(results)
+        page_entries, page, pages = paginate(entries, page)
+
+        if done is not None:
+            text = get_text('inventory_loading', lang, done=done, total=total)
+        else:
+            text = get_text(
+                'inventory_summary', lang,
+                nodes=len(entries),
+                online=sum(1 for _, node in entries if node.get('status') == 'connected'),
+                ok=sum(1 for result in results if result['success']),
+                total=len(results)
+            )
+
+        failed = [result for result in results if not result['success']]
+        for result in failed[:10]:
+            text += "\n" + get_text(
+                'inventory_panel_failed', lang,
+                panel=result['panel']['name'],
+                error=result['error']
+            )
+
+        if pages > 1:
+            text += "\n\n" + get_text('page_indicator', lang, page=page + 1, pages=pages)
+
+        keyboard = InlineKeyboardMarkup()
+        for panel, node in page_entries:
+            status_emoji = STATUS_EMOJI.get(node.get('status'), "🔴")
+            keyboard.row(InlineKeyboardButton(
+                f"{status_emoji} {panel['name']} › {node.get('name', 'Unnamed')}",
+                callback_data=f'node_info_{panel["id"]}_{node.get("id")}'
+            ))
+
+        if done is None:
+            nav = []
+            if page > 0:
+                nav.append(InlineKeyboardButton("◀️", callback_data=f'node_all_p{page - 1}'))
+            if page < pages - 1:
+                nav.append(InlineKeyboardButton("▶️", callback_data=f'node_all_p{page + 1}'))
+            if nav:
+                keyboard.row(*nav)
+            keyboard.row(InlineKeyboardButton(
+                get_text('refresh', lang),
+                callback_data='node_all'
+            ))
+
+        keyboard.row(InlineKeyboardButton(
+            get_text('back', lang),
+            callback_data='node_back_main'
+        ))
+
+        return text, keyboard
+
+    def _edit_inventory(self, call, text, keyboard):
+        """Edit the inventory message, ignoring "message is not modified" and similar races"""
         try:
-            panel = self.db.get_panel(panel_id)
-            if not panel:
-                self.bot.answer_callback_query(call.id, get_text('error_occurred', lang))
-                return
+            self.bot.edit_message_text(
+                text,
+                call.message.chat.id,
+                call.message.message_id,
+                reply_markup=keyboard
+            )
+        except Exception as e:
+            logger.debug(f"Inventory edit skipped: {e}")
 
-            # Get nodes from API
-            success, nodes_data = self.marzban_api.get_nodes(
-                panel['url'],
-                panel['access_token']
+    def _show_all_nodes(self, call, lang):
+        """Fetch nodes of every panel in parallel, rendering results as they arrive"""
+        panels = self.db.get_panels(call.from_user.id)
+        if not panels:
+            self.bot.edit_message_text(
+                get_text('no_panels', lang),
+                call.message.chat.id,
+                call.message.message_id
             )
+            return
 
-            if not success:
-                # Try to re-authenticate
-                auth_success, token_data = self.marzban_api.authenticate(
-                    panel['url'],
-                    panel['username'],
-                    panel['password']
-                )
+        collected = []
+        last_edit = [time.monotonic()]
+        self._edit_inventory(call, *self._render_inventory([], 0, lang, done=0, total=len(panels)))
 
-                if auth_success:
-                    self.db.update_panel_token(
-                        panel_id,
-                        token_data.get('access_token')
-                    )
+        def on_result(result, done, total):
+            collected.append(result)
+            # The final page is rendered below; intermediate edits are throttled
+            if done == total or time.monotonic() - last_edit[0] < INVENTORY_EDIT_INTERVAL:
+                return
+            last_edit[0] = time.monotonic()
+            self._edit_inventory(call, *self._render_inventory(collected, 0, lang, done=done, total=total))
+
+        results = fetch_inventory(panels, self.db, on_result=on_result)
+        now = time.monotonic()
+        for user_id, (fetched_at, _) in list(self._inventories.items()):
+            if now - fetched_at > NODE_SNAPSHOT_TTL:
+                self._inventories.pop(user_id, None)
+        self._inventories[call.from_user.id] = (now, results)
+        self._edit_inventory(call, *self._render_inventory(results, 0, lang))
+
+    def _show_all_nodes_page(self, call, page, lang):
+        """Show another page of the last inventory without calling the panels again"""
+        entry = self._inventories.get(call.from_user.id)
+        if entry is None or time.monotonic() - entry[0] > NODE_SNAPSHOT_TTL:
+            self._show_all_nodes(call, lang)
+            return
+        results = entry[1]
+        self._edit_inventory(call, *self._render_inventory(results, page, lang))
 
-                    success, nodes_data = self.marzban_api.get_nodes(
-                        panel['url'],
-                        token_data.get('access_token')
-                    )
+    def _show_nodes_list(self, call, panel_id, lang, page=0, status_filter='all', refresh=False):
+        """Show one page of a panel's nodes, served from the panel's snapshot"""
+        try:
+            panel = self.db.get_panel(panel_id)
+            if not panel:
+                self.bot.answer_callback_query(call.id, get_text('error_occurred', lang))
+                return
 
+            success, nodes_data, age = get_panel_nodes(panel, self.db, refresh=refresh)
+
+            keyboard = InlineKeyboardMarkup()
             if success and nodes_data:
-                keyboard = InlineKeyboardMarkup()
+                nodes = filter_nodes(nodes_data, status_filter)
+                page_nodes, page, pages = paginate(nodes, page)
 
-                for node in nodes_data:
-                    status_emoji = "🟢" if node.get('status') == 'connected' else "🔴"
+                for node in page_nodes:
+                    status_emoji = STATUS_EMOJI.get(node.get('status'), "🔴")
                     keyboard.row(InlineKeyboardButton(
                         f"{status_emoji} {node.get('name', 'Unnamed')}",
                         callback_data=f'node_info_{panel_id}_{node.get("id")}'
                     ))
 
+                nav = []
+                if page > 0:
+                    nav.append(InlineKeyboardButton(
+                        "◀️", callback_data=f'node_list_{panel_id}_p{page - 1}_{status_filter}'
+                    ))
+                if page < pages - 1:
+                    nav.append(InlineKeyboardButton(
+                        "▶️", callback_data=f'node_list_{panel_id}_p{page + 1}_{status_filter}'
+                    ))
+                if nav:
+                    keyboard.row(*nav)
+
+                filters = []
+                for name, emoji in FILTER_EMOJI.items():
+                    label = f"{emoji} {len(filter_nodes(nodes_data, name))}"
+                    if name == status_filter:
+                        label = f"· {label} ·"
+                    filters.append(InlineKeyboardButton(label, callback_data=f'node_list_{panel_id}_p0_{name}'))
+                keyboard.row(*filters)
+
                 keyboard.row(InlineKeyboardButton(
-                    get_text('back', lang),
-                    callback_data=f'node_select_panel_{panel_id}'
+                    get_text('refresh', lang),
+                    callback_data=f'node_list_{panel_id}_p{page}_{status_filter}_r'
                 ))
 
-                text = get_text('nodes_list', lang)
+                text = get_text('nodes_list', lang) if nodes else get_text('no_nodes_filtered', lang)
+                if pages > 1:
+                    text += "\n" + get_text('page_indicator', lang, page=page + 1, pages=pages)
+                text += "\n" + get_text('snapshot_age', lang, seconds=int(age))
             else:
-                keyboard = InlineKeyboardMarkup()
-                keyboard.row(InlineKeyboardButton(
-                    get_text('back', lang),
-                    callback_data=f'node_select_panel_{panel_id}'
-                ))
                 text = get_text('no_nodes', lang)
 
+            keyboard.row(InlineKeyboardButton(
+                get_text('back', lang),
+                callback_data=f'node_select_panel_{panel_id}'
+            ))
+
             self.bot.edit_message_text(
                 text,
                 call.message.chat.id,
@@ -216,19 +435,15 @@ class NodeHandler:
                 get_text('error_occurred', lang, error=str(e))
             )
 
-    def _show_node_info(self, call, panel_id, node_id, lang):
-        """Show detailed node information"""
+    def _show_node_info(self, call, panel_id, node_id, lang, diagnostics=None):
+        """Show detailed node information, with the node's diagnostics when collected"""
         try:
             panel = self.db.get_panel(panel_id)
             if not panel:
                 return
 
             # Get node info from API
-            success, node_data = self.marzban_api.get_node_info(
-                panel['url'],
-                panel['access_token'],
-                node_id
-            )
+            success, node_data = self.marzban_api.call_with_reauth(panel, self.db, 'get_node_info', node_id)
 
             if success and node_data:
                 # Format node information (truncated for Telegram limits)
@@ -255,6 +470,14 @@ class NodeHandler:
                         message = message[:100] + "..."
                     info_text += f"💬 Message: {message}\n"
 
+                if diagnostics is None:
+                    server = self.db.get_ssh_server_for_node(panel_id, self._local_node_id(panel_id, node_id),
+                                                             node_data.get('address'))
+                    if server:
+                        diagnostics = get_diagnostics_cache().get(server['ip_address'], server['port'])
+                if diagnostics:
+                    info_text += "\n" + self._render_diagnostics(diagnostics, lang)
+
                 keyboard = InlineKeyboardMarkup()
                 keyboard.row(
                     InlineKeyboardButton(
@@ -266,10 +489,16 @@ class NodeHandler:
                         callback_data=f'node_delete_{panel_id}_{node_id}'
                     )
                 )
-                keyboard.row(InlineKeyboardButton(
-                    get_text('update_node', lang),
-                    callback_data=f'node_update_{panel_id}_{node_id}'
-                ))
+                keyboard.row(
+                    InlineKeyboardButton(
+                        get_text('update_node', lang),
+                        callback_data=f'node_update_{panel_id}_{node_id}'
+                    ),
+                    InlineKeyboardButton(
+                        get_text('node_diagnostics', lang),
+                        callback_data=f'node_diag_{panel_id}_{node_id}'
+                    )
+                )
                 keyboard.row(InlineKeyboardButton(
                     get_text('back', lang),
                     callback_data=f'node_list_{panel_id}'
@@ -294,6 +523,85 @@ class NodeHandler:
                 get_text('error_occurred', lang, error=str(e))
             )
 
+    def _local_node_id(self, panel_id, node_id):
+        node = self.db.get_node_by_remote_id(panel_id, node_id)
+        return node['id'] if node else None
+
+    @admin_only
+    def _show_node_diagnostics(self, call, panel_id, node_id, lang):
+        """Collect fresh diagnostics over SSH and show them in the node info view"""
+        try:
+            panel = self.db.get_panel(panel_id)
+            if not panel:
+                return
+
+            success, node_data = self.marzban_api.call_with_reauth(panel, self.db, 'get_node_info', node_id)
+            if not success or not node_data:
+                self.bot.answer_callback_query(call.id, get_text('node_not_found', lang))
+                return
+
+            server = self.db.get_ssh_server_for_node(panel_id, self._local_node_id(panel_id, node_id),
+                                                     node_data.get('address'))
+            if not server:
+                self.bot.answer_callback_query(call.id, get_text('diagnostics_no_server', lang), show_alert=True)
+                return
+
+            self.bot.answer_callback_query(call.id, get_text('collecting_diagnostics', lang))
+            success, diagnostics = self.ssh_manager.diagnose_node(
+                server,
+                node_port=node_data.get('port'),
+                api_port=node_data.get('api_port'),
+                refresh=True
+            )
+            if not success:
+                self.bot.send_message(
+                    call.message.chat.id,
+                    get_text('diagnostics_failed', lang, error=diagnostics)
+                )
+                return
+
+            # Compare against the certificate the panel currently hands out
+            settings_ok, settings_data = self.marzban_api.call_with_reauth(panel, self.db, 'get_node_settings')
+            if settings_ok and settings_data and settings_data.get('certificate'):
+                diagnostics['cert_expected'] = certificate_checksum(settings_data['certificate'])
+
+            self._show_node_info(call, panel_id, node_id, lang, diagnostics=diagnostics)
+
+        except Exception as e:
+            logger.error(f"Error showing node diagnostics: {e}")
+            self.bot.send_message(
+                call.message.chat.id,
+                get_text('error_occurred', lang, error=str(e))
+            )
+
+    def _render_diagnostics(self, diagnostics, lang):
+        """Diagnostics section of the node info view"""
+        age = int(time.time() - diagnostics['collected_at'])
+        text = get_text('diagnostics_title', lang, age=age) + "\n"
+
+        containers = diagnostics['containers'] or ['-']
+        text += f"{'🟢' if diagnostics['running'] else '🔴'} Container: {'; '.join(containers)[:200]}\n"
+
+        ports = ', '.join(f"{port} {'✅' if listening else '❌'}" for port, listening in diagnostics['ports'].items())
+        text += f"🔌 Listening: {ports or '-'}\n"
+
+        checksum = diagnostics['cert_checksum']
+        if not checksum:
+            cert_state = "❌ missing"
+        elif 'cert_expected' not in diagnostics:
+            cert_state = checksum[:12]
+        elif diagnostics['cert_expected'] == checksum:
+            cert_state = f"✅ {checksum[:12]}"
+        else:
+            cert_state = f"❌ {checksum[:12]} (panel {diagnostics['cert_expected'][:12]})"
+        text += f"🔐 Certificate: {cert_state}\n"
+        text += f"📈 Load: {diagnostics['load'] or '-'}\n"
+
+        if diagnostics['logs']:
+            logs = [line[:DIAGNOSTICS_LOG_LINE_CHARS] for line in diagnostics['logs']]
+            text += "📜 Logs:\n" + "\n".join(logs)
+        return text
+
     def _show_add_node_options(self, call, panel_id, lang):
         """Show add node options"""
         keyboard = InlineKeyboardMarkup()
@@ -412,8 +720,8 @@ class NodeHandler:
                         # Handle text input
                         ssh_key_content = message.text.strip()
 
-                    # Validate SSH key format
-                    if not ssh_key_content.startswith('-----BEGIN'):
+                    # Parse the key now; the install reuses the parsed key from the cache
+                    if load_private_key(ssh_key_content) is None:
                         self.bot.send_message(
                             message.chat.id,
                             get_text('invalid_ssh_key_format', lang)
@@ -469,8 +777,9 @@ class NodeHandler:
                 else:
                     session['data']['node_name'] = message.text.strip()
 
-                # Start installation
-                self._start_node_installation(message, session, lang, user_id)
+                # Start installation off the update-handling workers
+                session['step'] = 'installing'
+                submit('installs', self._start_node_installation, message, session, lang, user_id)
 
         except Exception as e:
             logger.error(f"Error handling install input: {e}")
@@ -511,6 +820,7 @@ class NodeHandler:
             )
 
             if success:
+                get_node_snapshots().invalidate(session['panel_id'])
                 self.bot.send_message(
                     message.chat.id,
                     get_text('node_installed', lang)
@@ -539,13 +849,10 @@ class NodeHandler:
             if not panel:
                 return
 
-            success, result = self.marzban_api.reconnect_node(
-                panel['url'],
-                panel['access_token'],
-                node_id
-            )
+            success, result = self.marzban_api.call_with_reauth(panel, self.db, 'reconnect_node', node_id)
 
             if success:
+                get_node_snapshots().invalidate(panel_id)
                 self.bot.answer_callback_query(
                     call.id,
                     get_text('node_reconnected', lang),
@@ -566,6 +873,75 @@ class NodeHandler:
                 show_alert=True
             )
 
+    @admin_only
+    def _reconnect_failed_nodes(self, call, panel_id, lang):
+        """Reconnect every node of a panel the health monitor last saw in error"""
+        panel = self.db.get_panel(panel_id)
+        if not panel:
+            return
+
+        failed_nodes = [node for node in self.db.get_nodes(panel_id)
+                        if node['status'] == 'error' and node['node_id'] is not None]
+        self.bot.answer_callback_query(call.id, get_text('reconnecting_nodes', lang, count=len(failed_nodes)))
+
+        def reconnect(node):
+            try:
+                success, _ = self.marzban_api.call_with_reauth(panel, self.db, 'reconnect_node', node['node_id'])
+                return success
+            except Exception as e:
+                logger.error(f"Error reconnecting node {node['node_id']}: {e}")
+                return False
+
+        results = list(get_executor('inventory').map(reconnect, failed_nodes))
+        if failed_nodes:
+            get_node_snapshots().invalidate(panel_id)
+
+        try:
+            self.bot.edit_message_text(
+                call.message.text + "\n\n" + get_text('reconnect_failed_done', lang,
+                                                      ok=sum(results), total=len(failed_nodes)),
+                call.message.chat.id,
+                call.message.message_id
+            )
+        except Exception as e:
+            logger.error(f"Error reporting reconnect result: {e}")
+
+    def send_health_alert(self, panel, went_down, recovered):
+        """Tell the panel owner and the admins about nodes that went down or recovered"""
+        recipients = set(ADMIN_IDS)
+        if panel.get('added_by'):
+            recipients.add(panel['added_by'])
+
+        def node_line(node):
+            line = f"• {node.get('name')} ({node.get('address')})"
+            message = str(node.get('message') or '')
+            return line + (f": {message[:100]}" if message else '')
+
+        with background_sends():
+            for chat_id in recipients:
+                user = self.db.get_user(chat_id)
+                lang = user['language'] if user else 'en'
+                parts = []
+                if went_down:
+                    parts.append(get_text('health_alert_down', lang, panel=panel['name'], count=len(went_down)))
+                    parts += [node_line(node) for node in went_down[:HEALTH_ALERT_MAX_NODES]]
+                if recovered:
+                    parts.append(get_text('health_alert_recovered', lang, panel=panel['name'], count=len(recovered)))
+                    parts += [node_line(node) for node in recovered[:HEALTH_ALERT_MAX_NODES]]
+
+                keyboard = None
+                if went_down:
+                    keyboard = InlineKeyboardMarkup()
+                    keyboard.row(InlineKeyboardButton(
+                        get_text('reconnect_failed_nodes', lang),
+                        callback_data=f'node_reconnect_failed_{panel["id"]}'
+                    ))
+
+                try:
+                    self.bot.send_message(chat_id, "\n".join(parts), reply_markup=keyboard)
+                except Exception as e:
+                    logger.error(f"Error sending health alert to {chat_id}: {e}")
+
     def _delete_node(self, call, panel_id, node_id, lang):
         """Delete node"""
         try:
@@ -573,11 +949,7 @@ class NodeHandler:
             if not panel:
                 return
 
-            success, result = self.marzban_api.delete_node(
-                panel['url'],
-                panel['access_token'],
-                node_id
-            )
+            success, result = self.marzban_api.call_with_reauth(panel, self.db, 'delete_node', node_id)
 
             if success:
                 self.bot.answer_callback_query(
@@ -587,7 +959,7 @@ class NodeHandler:
                 )
 
                 # Refresh nodes list
-                self._show_nodes_list(call, panel_id, lang)
+                self._show_nodes_list(call, panel_id, lang, refresh=True)
             else:
                 self.bot.answer_callback_query(
                     call.id,
@@ -610,29 +982,24 @@ class NodeHandler:
             if not panel:
                 return
 
-            success, node_data = self.marzban_api.get_node_info(
-                panel['url'],
-                panel['access_token'],
-                node_id
-            )
+            success, node_data = self.marzban_api.call_with_reauth(panel, self.db, 'get_node_info', node_id)
 
             if success:
                 # Update local database
-                db_nodes = self.db.get_nodes(panel_id)
-                for db_node in db_nodes:
-                    if db_node['node_id'] == node_id:
-                        self.db.update_node(
-                            db_node['id'],
-                            name=node_data.get('name'),
-                            address=node_data.get('address'),
-                            port=node_data.get('port'),
-                            api_port=node_data.get('api_port'),
-                            usage_coefficient=node_data.get('usage_coefficient'),
-                            xray_version=node_data.get('xray_version'),
-                            status=node_data.get('status'),
-                            message=node_data.get('message')
-                        )
-                        break
+                db_node = self.db.get_node_by_remote_id(panel_id, node_id)
+                if db_node:
+                    self.db.update_node(
+                        db_node['id'],
+                        name=node_data.get('name'),
+                        address=node_data.get('address'),
+                        port=node_data.get('port'),
+                        api_port=node_data.get('api_port'),
+                        usage_coefficient=node_data.get('usage_coefficient'),
+                        xray_version=node_data.get('xray_version'),
+                        status=node_data.get('status'),
+                        message=node_data.get('message'),
+                        durable=False
+                    )
 
                 self.bot.answer_callback_query(
                     call.id,
@@ -657,6 +1024,309 @@ class NodeHandler:
                 show_alert=True
             )
 
+    @admin_only
+    def _start_health_interval(self, call, panel_id, lang):
+        """Ask for how often the node monitor should poll the panel"""
+        panel = self.db.get_panel(panel_id)
+        if not panel:
+            self.bot.answer_callback_query(call.id, get_text('panel_not_found', lang), show_alert=True)
+            return
+
+        user_id = call.from_user.id
+        self.bot.active_sessions = getattr(self.bot, 'active_sessions', {})
+        self.bot.active_sessions[user_id] = {
+            'step': 'health_interval',
+            'panel_id': panel_id,
+            'data': {},
+            'handler': self._handle_health_interval_input
+        }
+
+        keyboard = InlineKeyboardMarkup()
+        keyboard.row(InlineKeyboardButton(
+            get_text('cancel', lang),
+            callback_data=f'node_select_panel_{panel_id}'
+        ))
+
+        self.bot.edit_message_text(
+            get_text('health_interval_prompt', lang, current=panel.get('health_interval') or NODE_MONITOR_INTERVAL,
+                     default=NODE_MONITOR_INTERVAL, minimum=MIN_HEALTH_INTERVAL),
+            call.message.chat.id,
+            call.message.message_id,
+            reply_markup=keyboard
+        )
+
+    def _handle_health_interval_input(self, message, session):
+        """Save the panel's health check interval; 0 restores the default"""
+        user = self.db.get_user(message.from_user.id)
+        lang = user['language'] if user else 'en'
+
+        try:
+            seconds = int((message.text or '').strip())
+        except ValueError:
+            seconds = -1
+        if seconds != 0 and seconds < MIN_HEALTH_INTERVAL:
+            self.bot.send_message(
+                message.chat.id,
+                get_text('health_interval_invalid', lang, minimum=MIN_HEALTH_INTERVAL)
+            )
+            return
+
+        panel_id = session['panel_id']
+        del self.bot.active_sessions[message.from_user.id]
+        if not self.db.set_panel_health_interval(panel_id, seconds or None):
+            self.bot.send_message(message.chat.id, get_text('health_interval_failed', lang))
+            return
+
+        keyboard = InlineKeyboardMarkup()
+        keyboard.row(InlineKeyboardButton(
+            get_text('back', lang),
+            callback_data=f'node_select_panel_{panel_id}'
+        ))
+        self.bot.send_message(
+            message.chat.id,
+            get_text('health_interval_saved', lang, interval=seconds or NODE_MONITOR_INTERVAL),
+            reply_markup=keyboard
+        )
+
+    @admin_only
+    def _confirm_node_sync(self, call, panel_id, lang):
+        """Ask before pushing the certificate and compose file to every installed server"""
+        servers = self.db.get_ssh_servers(panel_id, status='installed')
+        if not servers:
+            self.bot.answer_callback_query(call.id, get_text('fleet_no_servers', lang), show_alert=True)
+            return
+
+        keyboard = InlineKeyboardMarkup()
+        keyboard.row(
+            InlineKeyboardButton(get_text('confirm', lang), callback_data=f'node_sync_run_{panel_id}'),
+            InlineKeyboardButton(get_text('cancel', lang), callback_data=f'node_select_panel_{panel_id}')
+        )
+
+        self.bot.edit_message_text(
+            get_text('node_sync_confirm', lang, count=len(servers)),
+            call.message.chat.id,
+            call.message.message_id,
+            reply_markup=keyboard
+        )
+
+    @admin_only
+    def _run_node_sync(self, call, panel_id, lang):
+        """Start the certificate and compose sync in the background"""
+        panel = self.db.get_panel(panel_id)
+        if not panel:
+            self.bot.answer_callback_query(call.id, get_text('panel_not_found', lang), show_alert=True)
+            return
+
+        servers = self.db.get_ssh_servers(panel_id, status='installed')
+        self.bot.edit_message_text(
+            get_text('node_sync_progress', lang, done=0, total=len(servers)),
+            call.message.chat.id,
+            call.message.message_id
+        )
+        submit('installs', self._execute_node_sync, call.message, panel, servers, lang)
+
+    def _execute_node_sync(self, message, panel, servers, lang):
+        """Fetch the panel's certificate, push it with the compose file and report per-host results"""
+        last_edit = [time.monotonic()]
+
+        def on_result(result, done, total):
+            if done == total or time.monotonic() - last_edit[0] < BULK_PROGRESS_INTERVAL:
+                return
+            last_edit[0] = time.monotonic()
+            try:
+                with background_sends():
+                    self.bot.edit_message_text(
+                        get_text('node_sync_progress', lang, done=done, total=total),
+                        message.chat.id,
+                        message.message_id
+                    )
+            except Exception as e:
+                logger.error(f"Error updating sync progress: {e}")
+
+        try:
+            settings_ok, settings_data = self.marzban_api.call_with_reauth(panel, self.db, 'get_node_settings')
+            if not settings_ok or not settings_data or not settings_data.get('certificate'):
+                self.bot.edit_message_text(
+                    get_text('node_sync_no_certificate', lang),
+                    message.chat.id,
+                    message.message_id
+                )
+                return
+
+            sync = self.ssh_manager.sync_node_files(servers, settings_data['certificate'], on_result=on_result)
+        except Exception as e:
+            logger.error(f"Error syncing node files: {e}")
+            self.bot.edit_message_text(
+                get_text('error_occurred', lang, error=str(e)),
+                message.chat.id,
+                message.message_id
+            )
+            return
+
+        results, restart = sync['results'], sync['restart']
+        restart_failed = [result['host'] for result in restart['results'] if not result['success']] if restart else []
+        not_restarted = restart_failed + (restart['skipped'] if restart else [])
+        text = get_text(
+            'node_sync_complete', lang,
+            updated=sum(bool(result['success'] and result['sent']) for result in results),
+            current=sum(bool(result['success'] and not result['sent']) for result in results),
+            failed=sum(not result['success'] for result in results),
+            restarted=len(restart['results']) - len(restart_failed) if restart else 0
+        )
+        failed_hosts = [result['host'] for result in results if not result['success']]
+        if failed_hosts:
+            text += "\n\n" + get_text('node_sync_failed_hosts', lang, hosts=', '.join(failed_hosts))
+        if not_restarted:
+            text += "\n\n" + get_text('node_sync_not_restarted', lang, hosts=', '.join(not_restarted))
+
+        try:
+            with background_sends():
+                self.bot.edit_message_text(text[:FLEET_REPORT_MAX_CHARS], message.chat.id, message.message_id)
+        except Exception as e:
+            logger.error(f"Error sending sync report: {e}")
+
+    @admin_only
+    def _start_fleet_command(self, call, panel_id, lang):
+        """Ask for a command to run on every server installed for the panel"""
+        servers = self.db.get_ssh_servers(panel_id, status='installed')
+        if not servers:
+            self.bot.answer_callback_query(call.id, get_text('fleet_no_servers', lang), show_alert=True)
+            return
+
+        user_id = call.from_user.id
+        self.bot.active_sessions = getattr(self.bot, 'active_sessions', {})
+        self.bot.active_sessions[user_id] = {
+            'step': 'fleet_command',
+            'panel_id': panel_id,
+            'data': {},
+            'handler': self._handle_fleet_input
+        }
+
+        keyboard = InlineKeyboardMarkup()
+        keyboard.row(InlineKeyboardButton(
+            get_text('cancel', lang),
+            callback_data=f'node_select_panel_{panel_id}'
+        ))
+
+        self.bot.edit_message_text(
+            get_text('fleet_enter_command', lang, count=len(servers)),
+            call.message.chat.id,
+            call.message.message_id,
+            reply_markup=keyboard
+        )
+
+    def _handle_fleet_input(self, message, session):
+        """Take the fleet command and ask for confirmation"""
+        user = self.db.get_user(message.from_user.id)
+        lang = user['language'] if user else 'en'
+
+        command = (message.text or '').strip()
+        if session['step'] != 'fleet_command' or not command:
+            return
+
+        panel_id = session['panel_id']
+        servers = self.db.get_ssh_servers(panel_id, status='installed')
+        session['data']['command'] = command
+        session['step'] = 'fleet_confirm'
+
+        keyboard = InlineKeyboardMarkup()
+        keyboard.row(
+            InlineKeyboardButton(get_text('confirm', lang), callback_data=f'node_fleet_run_{panel_id}'),
+            InlineKeyboardButton(get_text('cancel', lang), callback_data=f'node_select_panel_{panel_id}')
+        )
+
+        self.bot.send_message(
+            message.chat.id,
+            get_text('fleet_confirm', lang, command=command, count=len(servers),
+                     batch=FLEET_BATCH_SIZE, rate=f"{FLEET_MAX_FAILURE_RATE:g}", timeout=FLEET_COMMAND_TIMEOUT),
+            reply_markup=keyboard
+        )
+
+    @admin_only
+    def _run_fleet_command(self, call, panel_id, lang):
+        """Start the confirmed fleet command in the background"""
+        user_id = call.from_user.id
+        session = getattr(self.bot, 'active_sessions', {}).get(user_id)
+        if not session or session['step'] != 'fleet_confirm' or session['panel_id'] != panel_id:
+            self.bot.answer_callback_query(call.id, get_text('session_expired', lang), show_alert=True)
+            return
+
+        command = session['data']['command']
+        del self.bot.active_sessions[user_id]
+        servers = self.db.get_ssh_servers(panel_id, status='installed')
+        self.bot.edit_message_text(
+            get_text('fleet_progress', lang, done=0, total=len(servers), failed=0),
+            call.message.chat.id,
+            call.message.message_id
+        )
+        submit('installs', self._execute_fleet_command, call.message, servers, command, lang)
+
+    def _execute_fleet_command(self, message, servers, command, lang):
+        """Run the fleet command, editing the progress message as hosts finish, then send the grouped report"""
+        failed = [0]
+        last_edit = [time.monotonic()]
+
+        def on_result(result, done, total):
+            failed[0] += not result['success']
+            if done == total or time.monotonic() - last_edit[0] < BULK_PROGRESS_INTERVAL:
+                return
+            last_edit[0] = time.monotonic()
+            try:
+                with background_sends():
+                    self.bot.edit_message_text(
+                        get_text('fleet_progress', lang, done=done, total=total, failed=failed[0]),
+                        message.chat.id,
+                        message.message_id
+                    )
+            except Exception as e:
+                logger.error(f"Error updating fleet progress: {e}")
+
+        try:
+            run = self.ssh_manager.run_fleet_command(servers, command, on_result=on_result)
+        except Exception as e:
+            logger.error(f"Error running fleet command: {e}")
+            self.bot.edit_message_text(
+                get_text('error_occurred', lang, error=str(e)),
+                message.chat.id,
+                message.message_id
+            )
+            return
+
+        results = run['results']
+        summary = get_text(
+            'fleet_complete', lang, command=command, total=len(results),
+            successful=sum(result['success'] for result in results), failed=failed[0],
+            groups=len(run['groups']), elapsed=f"{run['elapsed']:.0f}s"
+        )
+        if run['stopped']:
+            summary += "\n" + get_text('fleet_stopped', lang, skipped=len(run['skipped']),
+                                        rate=f"{FLEET_MAX_FAILURE_RATE:g}")
+
+        sections = []
+        for group in run['groups']:
+            sections.append(
+                get_text('fleet_group', lang, status="✅" if group['success'] else "❌", count=len(group['hosts']),
+                         hosts=', '.join(group['hosts'])) + "\n" + (group['output'] or "-")
+            )
+        if run['skipped']:
+            sections.append(get_text('fleet_skipped', lang, hosts=', '.join(run['skipped'])))
+        report = "\n\n".join(sections)
+
+        try:
+            with background_sends():
+                self.bot.edit_message_text(summary, message.chat.id, message.message_id)
+                if len(report) <= FLEET_REPORT_MAX_CHARS:
+                    self.bot.send_message(message.chat.id, report)
+                else:
+                    self.bot.send_document(
+                        message.chat.id,
+                        io.BytesIO(report.encode('utf-8')),
+                        visible_file_name=f"fleet-command-{time.strftime('%Y%m%d-%H%M%S')}.txt",
+                        caption=summary
+                    )
+        except Exception as e:
+            logger.error(f"Error sending fleet report: {e}")
+
     def _start_bulk_install(self, call, panel_id, lang):
         """Start bulk node installation process"""
         user_id = call.from_user.id
@@ -728,14 +1398,9 @@ class NodeHandler:
 
                 for line in lines:
                     if line.strip():
-                        parts = line.strip().split(' ')
-                        if len(parts) >= 3:  # ip username password
-                            servers.append({
-                                'ip': parts[0],
-                                'username': parts[1],
-                                'password': ' '.join(parts[2:]),  # In case password has spaces
-                                'auth_type': 'password'
-                            })
+                        server = parse_server_line(line, with_password=True)  # ip[:port] username password
+                        if server:
+                            servers.append(server)
 
                 if not servers:
                     self.bot.send_message(
@@ -749,7 +1414,8 @@ class NodeHandler:
                 session['data']['api_port'] = 62051
 
                 # Start bulk installation directly
-                self._start_bulk_node_installation(message, session, lang, user_id)
+                session['step'] = 'installing'
+                submit('installs', self._start_bulk_node_installation, message, session, lang, user_id)
 
             elif session['step'] == 'bulk_server_list_ssh':
                 # Parse server list without passwords (only IP and username)
@@ -758,13 +1424,9 @@ class NodeHandler:
 
                 for line in lines:
                     if line.strip():
-                        parts = line.strip().split(' ')
-                        if len(parts) >= 2:  # ip username
-                            servers.append({
-                                'ip': parts[0],
-                                'username': parts[1],
-                                'auth_type': 'ssh_key'
-                            })
+                        server = parse_server_line(line, with_password=False)  # ip[:port] username
+                        if server:
+                            servers.append(server)
 
                 if not servers:
                     self.bot.send_message(
@@ -792,8 +1454,8 @@ class NodeHandler:
                         # Handle text input
                         ssh_key_content = message.text.strip()
 
-                    # Validate SSH key format
-                    if not ssh_key_content.startswith('-----BEGIN'):
+                    # Parse the key now; workers reuse the parsed key from the cache
+                    if load_private_key(ssh_key_content) is None:
                         self.bot.send_message(
                             message.chat.id,
                             get_text('invalid_ssh_key_format', lang)
@@ -808,7 +1470,8 @@ class NodeHandler:
                     session['data']['api_port'] = 62051
 
                     # Start bulk installation
-                    self._start_bulk_node_installation(message, session, lang, user_id)
+                    session['step'] = 'installing'
+                    submit('installs', self._start_bulk_node_installation, message, session, lang, user_id)
 
                 except Exception as e:
                     logger.error(f"Error handling SSH key: {e}")
@@ -828,18 +1491,31 @@ class NodeHandler:
                 del self.bot.active_sessions[user_id]
 
     def _start_bulk_node_installation(self, message, session, lang, user_id):
-        """Start bulk node installation process with concurrent execution"""
+        """Start bulk node installation process with concurrent execution
+
+        Progress is shown on a single message edited at most every
+        BULK_PROGRESS_INTERVAL seconds; the per-host report is sent once,
+        as a document attached to the summary.
+        """
         try:
-            self.bot.send_message(
+            servers = session['data']['servers']
+            progress = BulkProgress(servers)
+            board = self.bot.send_message(
                 message.chat.id,
-                get_text('installing_bulk_nodes', lang)
+                get_text('installing_bulk_nodes', lang) + "\n\n" + progress.render(lang)
             )
-
-            servers = session['data']['servers']
+            stop = threading.Event()
+            updater = threading.Thread(
+                target=self._update_bulk_board,
+                args=(board, progress, stop, lang),
+                daemon=True
+            )
+            updater.start()
             
-            # Start concurrent installations using ThreadPoolExecutor
+            # Install one host; run_bulk schedules these concurrently
             def install_single_node(server):
                 """Install a single node - to be run in parallel"""
+                label = host_label(server)
                 try:
                     node_name = f"node-{server['ip'].replace('.', '-')}"
 
@@ -847,21 +1523,13 @@ class NodeHandler:
                     if server['auth_type'] == 'ssh_key':
                         ssh_password = None
                         ssh_key = server['ssh_key']
-                        auth_msg = f"🔑 {server['ip']}: استفاده از کلید SSH"
                     else:
                         ssh_password = server['password']
                         ssh_key = None
-                        auth_msg = f"🔒 {server['ip']}: استفاده از پسورد"
-
-                    # Send auth method info
-                    try:
-                        self.bot.send_message(message.chat.id, auth_msg)
-                    except Exception:
-                        pass  # Continue even if message sending fails
 
                     success, result = self.ssh_manager.install_node(
                         ssh_ip=server['ip'],
-                        ssh_port=22,
+                        ssh_port=server.get('port', 22),
                         ssh_username=server['username'],
                         ssh_password=ssh_password,
                         ssh_key=ssh_key,
@@ -869,65 +1537,49 @@ class NodeHandler:
                         node_name=node_name,
                         node_port=62050,
                         api_port=62051,
-                        db=self.db
+                        db=self.db,
+                        on_progress=lambda stage: progress.stage(label, stage)
                     )
 
-                    return {
-                        'ip': server['ip'],
-                        'success': success,
-                        'result': result
-                    }
-
                 except Exception as e:
                     logger.error(f"Error installing node on {server['ip']}: {e}")
-                    return {
-                        'ip': server['ip'],
-                        'success': False,
-                        'result': str(e)
-                    }
-
-            # Execute installations concurrently with max 5 threads
-            with ThreadPoolExecutor(max_workers=5) as executor:
-                # Submit all installation tasks
-                future_to_server = {executor.submit(install_single_node, server): server for server in servers}
-                
-                successful = 0
-                failed = 0
-                
-                # Process completed installations as they finish
-                for future in as_completed(future_to_server):
-                    try:
-                        install_result = future.result()
-                        
-                        if install_result['success']:
-                            successful += 1
-                            try:
-                                self.bot.send_message(
-                                    message.chat.id,
-                                    f"✅ {install_result['ip']}: {get_text('node_installed', lang)}"
-                                )
-                            except Exception:
-                                pass
-                        else:
-                            failed += 1
-                            try:
-                                self.bot.send_message(
-                                    message.chat.id,
-                                    f"❌ {install_result['ip']}: {get_text('installation_failed', lang, error=install_result['result'])}"
-                                )
-                            except Exception:
-                                pass
-                                
-                    except Exception as e:
+                    success, result = False, str(e)
+
+                progress.done(label, success, result)
+                return {
+                    'ip': server['ip'],
+                    'success': success,
+                    'result': result
+                }
+
+            successful = 0
+            failed = 0
+            
+            # Global/per-panel caps with adaptive concurrency (see bulk_scheduler)
+            try:
+                for install_result in run_bulk(servers, install_single_node, session['panel_id']):
+                    if install_result['success']:
+                        successful += 1
+                    else:
                         failed += 1
-                        logger.error(f"Error processing installation result: {e}")
+            finally:
+                progress.finish()
+                stop.set()
+                updater.join()
+
+            if successful:
+                get_node_snapshots().invalidate(session['panel_id'])
 
-            # Send summary
+            # Send summary with the full per-host report
             try:
-                self.bot.send_message(
-                    message.chat.id,
-                    get_text('bulk_install_complete', lang, successful=successful, failed=failed)
-                )
+                report = io.BytesIO(progress.report().encode('utf-8'))
+                with background_sends():
+                    self.bot.send_document(
+                        message.chat.id,
+                        report,
+                        visible_file_name=f"bulk-install-{time.strftime('%Y%m%d-%H%M%S')}.txt",
+                        caption=get_text('bulk_install_complete', lang, successful=successful, failed=failed)
+                    )
             except Exception as e:
                 logger.error(f"Error sending summary message: {e}")
 
@@ -938,9 +1590,33 @@ class NodeHandler:
                     message.chat.id,
                     get_text('installation_failed', lang, error=str(e))
                 )
-            except Exception:
-                pass
+            except Exception as send_error:
+                logger.error(f"Failed to send bulk installation error: {send_error}")
         finally:
             # Clear session
             if user_id in self.bot.active_sessions:
                 del self.bot.active_sessions[user_id]
+
+    def _update_bulk_board(self, board, progress, stop, lang):
+        """Edit the bulk progress message while the job runs, then once more with the final state"""
+        shown = progress.version
+        with background_sends():
+            while True:
+                finished = stop.wait(BULK_PROGRESS_INTERVAL)
+                if progress.version != shown or finished:
+                    version = progress.version
+                    try:
+                        # The outbox waits out flood limits and retries
+                        self.bot.edit_message_text(
+                            get_text('installing_bulk_nodes', lang) + "\n\n" + progress.render(lang),
+                            board.chat.id,
+                            board.message_id
+                        )
+                        shown = version
+                    except ApiTelegramException as e:
+                        if 'message is not modified' not in str(e):
+                            logger.error(f"Error updating bulk progress: {e}")
+                    except Exception as e:
+                        logger.error(f"Error updating bulk progress: {e}")
+                if finished:
+                    return
@@ -6,6 +6,7 @@ from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 from bot.database.db_manager import DatabaseManager
 from bot.texts.bot_texts import get_text
 from bot.services.marzban_api import MarzbanAPI
+from bot.services.token_manager import get_token_manager
 from bot.utils.decorators import admin_only
 import logging
 import re
@@ -210,10 +211,10 @@ class PanelHandler:
 
                 if panel_id and token_data:
                     # Save token
-                    self.db.update_panel_token(
+                    get_token_manager().store_token(
                         panel_id,
                         token_data.get('access_token'),
-                        token_data.get('expires_at')
+                        self.db
                     )
                     logger.info("Token saved")
 
@@ -75,7 +75,7 @@ class StartHandler:
         last_name = call.from_user.last_name
         
         # Save user with selected language
-        self.db.add_user(user_id, username, first_name, last_name, lang_code)
+        self.db.add_user(user_id, username, first_name, last_name, lang_code, durable=False)
         
         # Send confirmation
         self.bot.edit_message_text(
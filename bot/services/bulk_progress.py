@@ -0,0 +1,136 @@
+"""
+Bulk install progress
+
+Tracks the state of every host in a bulk job so the handler can show it as
+one message edited in place, and renders the final per-host report that is
+sent as a document instead of one message per host.
+"""
+
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from bot.texts.bot_texts import get_text
+
+# Hosts listed on the board; the rest are only counted (Telegram caps messages at 4096 chars)
+BOARD_MAX_ROWS = 30
+BOARD_ERROR_CHARS = 60
+
+STATE_EMOJI = {
+    'queued': "⏳",
+    'running': "🔄",
+    'ok': "✅",
+    'failed': "❌",
+}
+
+
+def host_label(server: Dict[str, Any]) -> str:
+    """ip, or ip:port when the port is not the default"""
+    port = server.get('port', 22)
+    return server['ip'] if port == 22 else f"{server['ip']}:{port}"
+
+
+def format_elapsed(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+
+class BulkProgress:
+    """Thread-safe per-host state of a bulk install
+
+    version increases on every change so a periodic renderer can tell
+    whether an edit is needed.
+    """
+
+    def __init__(self, servers: List[Dict[str, Any]]):
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+        self.version = 0
+        self._hosts: Dict[str, Dict[str, Any]] = {
+            host_label(server): {'state': 'queued', 'stage': None, 'result': None, 'started': None, 'ended': None}
+            for server in servers
+        }
+        self._lock = threading.Lock()
+
+    def _update(self, label: str, **changes):
+        with self._lock:
+            self._hosts[label].update(changes)
+            self.version += 1
+
+    def stage(self, label: str, stage: str):
+        """Host entered a new stage (connect, an install step, register...)"""
+        with self._lock:
+            host = self._hosts[label]
+            if host['started'] is None:
+                host['started'] = time.monotonic()
+            host['state'] = 'running'
+            host['stage'] = stage
+            self.version += 1
+
+    def done(self, label: str, success: bool, result: Any):
+        self._update(label, state='ok' if success else 'failed', stage=None,
+                     result=str(result), ended=time.monotonic())
+
+    def finish(self):
+        with self._lock:
+            self.finished = time.monotonic()
+            self.version += 1
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            counts = dict.fromkeys(STATE_EMOJI, 0)
+            for host in self._hosts.values():
+                counts[host['state']] += 1
+            return counts
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    def render(self, lang: str) -> str:
+        """Board text: counters, elapsed time and a table of the most relevant hosts"""
+        counts = self.counts()
+        text = get_text(
+            'bulk_progress', lang,
+            done=counts['ok'] + counts['failed'],
+            total=len(self._hosts),
+            running=counts['running'],
+            successful=counts['ok'],
+            failed=counts['failed'],
+            elapsed=format_elapsed(self.elapsed)
+        )
+
+        with self._lock:
+            hosts = list(self._hosts.items())
+        # Running hosts first, then failures, finished and queued ones
+        order = {'running': 0, 'failed': 1, 'ok': 2, 'queued': 3}
+        hosts.sort(key=lambda item: order[item[1]['state']])
+
+        rows = []
+        for label, host in hosts[:BOARD_MAX_ROWS]:
+            if host['state'] == 'running':
+                detail = host['stage']
+            elif host['state'] == 'failed':
+                detail = (host['result'] or '').splitlines()[0][:BOARD_ERROR_CHARS] if host['result'] else ''
+            elif host['state'] == 'ok':
+                detail = format_elapsed(host['ended'] - host['started']) if host['started'] else ''
+            else:
+                detail = ''
+            rows.append(f"{STATE_EMOJI[host['state']]} {label}" + (f" — {detail}" if detail else ''))
+        if rows:
+            text += "\n\n" + "\n".join(rows)
+        if len(hosts) > BOARD_MAX_ROWS:
+            text += "\n" + get_text('bulk_progress_more', lang, count=len(hosts) - BOARD_MAX_ROWS)
+        return text
+
+    def report(self) -> str:
+        """Plain-text report of every host, attached to the final summary"""
+        with self._lock:
+            hosts = list(self._hosts.items())
+        lines = [f"Bulk installation report - {len(hosts)} hosts, {format_elapsed(self.elapsed)}", ""]
+        for label, host in hosts:
+            duration = format_elapsed(host['ended'] - host['started']) if host['started'] and host['ended'] else '-'
+            lines.append(f"[{host['state'].upper()}] {label} ({duration})")
+            if host['state'] == 'failed' and host['result']:
+                lines += [f"    {line}" for line in host['result'].splitlines()]
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,169 @@
+"""
+Bulk install scheduling
+
+Runs many host installs under a process-wide concurrency budget (a global
+cap plus a per-panel cap shared by every running bulk job) and adapts each
+job's own concurrency additively-increase / multiplicatively-decrease:
+every success raises the limit by one, a burst of SSH timeouts halves it.
+"""
+
+import logging
+import queue
+import re
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+from bot.config.settings import (
+    BULK_MAX_CONCURRENCY, BULK_PER_PANEL_LIMIT, BULK_INITIAL_CONCURRENCY
+)
+from bot.core.executors import get_executor
+
+logger = logging.getLogger(__name__)
+
+# ip, ip:port, [ipv6] or [ipv6]:port
+HOST_PATTERN = re.compile(r'^(?:\[(?P<ipv6>[0-9A-Fa-f:.]+)\]|(?P<host>[^\s:\[\]]+))(?::(?P<port>\d{1,5}))?$')
+TIMEOUT_MARKERS = ('timed out', 'timeout', 'connection reset', 'unable to connect', 'no route to host')
+
+
+def parse_host(value: str, default_port: int = 22) -> Optional[Dict[str, Any]]:
+    """Split 'ip[:port]' (IPv6 as '[addr]:port') into ip and port"""
+    match = HOST_PATTERN.match(value.strip())
+    if not match:
+        return None
+    port = int(match.group('port') or default_port)
+    if not 0 < port < 65536:
+        return None
+    return {'ip': match.group('ipv6') or match.group('host'), 'port': port}
+
+
+def parse_server_line(line: str, with_password: bool) -> Optional[Dict[str, Any]]:
+    """Parse 'ip[:port] username [password]' from a bulk server list"""
+    parts = line.strip().split(' ')
+    if len(parts) < (3 if with_password else 2):
+        return None
+    host = parse_host(parts[0])
+    if not host:
+        return None
+
+    server = {
+        'ip': host['ip'],
+        'port': host['port'],
+        'username': parts[1],
+        'auth_type': 'password' if with_password else 'ssh_key'
+    }
+    if with_password:
+        server['password'] = ' '.join(parts[2:])  # In case password has spaces
+    return server
+
+
+def is_timeout_error(result: Any) -> bool:
+    """Whether an install failure looks like network congestion rather than a host problem"""
+    text = str(result).lower()
+    return any(marker in text for marker in TIMEOUT_MARKERS)
+
+
+class ConcurrencyBudget:
+    """Process-wide slots: at most global_limit installs, and per_panel_limit per panel"""
+
+    def __init__(self, global_limit: int = BULK_MAX_CONCURRENCY, per_panel_limit: int = BULK_PER_PANEL_LIMIT):
+        self.global_limit = max(1, global_limit)
+        self.per_panel_limit = max(1, per_panel_limit)
+        self.running = 0
+        self.per_panel: Dict[Any, int] = {}
+        self._cond = threading.Condition()
+
+    def try_acquire(self, panel_id) -> bool:
+        with self._cond:
+            if self.running >= self.global_limit or self.per_panel.get(panel_id, 0) >= self.per_panel_limit:
+                return False
+            self.running += 1
+            self.per_panel[panel_id] = self.per_panel.get(panel_id, 0) + 1
+            return True
+
+    def release(self, panel_id):
+        with self._cond:
+            self.running -= 1
+            self.per_panel[panel_id] -= 1
+            if not self.per_panel[panel_id]:
+                del self.per_panel[panel_id]
+            self._cond.notify_all()
+
+    def wait(self, timeout: float):
+        """Block until another job frees a slot (or timeout)"""
+        with self._cond:
+            self._cond.wait(timeout)
+
+
+class AdaptiveLimit:
+    """AIMD concurrency limit: +1 per success, halved on timeouts
+
+    Tasks started before the last decrease cannot lower the limit again, so
+    one congestion event costs a single halving, not one per timed-out host.
+    """
+
+    def __init__(self, initial: int = BULK_INITIAL_CONCURRENCY, maximum: int = BULK_MAX_CONCURRENCY,
+                 minimum: int = 1):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.value = float(min(max(initial, self.minimum), self.maximum))
+        self.epoch = 0
+
+    @property
+    def current(self) -> int:
+        return int(self.value)
+
+    def on_success(self):
+        self.value = min(self.maximum, self.value + 1)
+
+    def on_timeout(self, epoch: int) -> bool:
+        """Halve the limit for a timeout of a task started in epoch; False if already reacted"""
+        if epoch != self.epoch:
+            return False
+        self.value = max(self.minimum, self.value / 2)
+        self.epoch += 1
+        return True
+
+
+_budget = ConcurrencyBudget()
+
+
+def run_bulk(items: Iterable[Any], worker: Callable[[Any], Dict[str, Any]], panel_id,
+             initial: int = BULK_INITIAL_CONCURRENCY) -> Iterator[Dict[str, Any]]:
+    """Run worker(item) for every item, yielding results as they complete
+
+    worker must return a dict with a 'success' flag and a 'result' value;
+    exceptions are turned into failed results.
+    """
+    pending = list(items)
+    pending.reverse()
+    limit = AdaptiveLimit(initial=initial, maximum=_budget.global_limit)
+    done = queue.Queue()
+    executor = get_executor('bulk')
+    running = 0
+
+    def run(item, epoch):
+        try:
+            result = worker(item)
+        except Exception as e:
+            logger.error(f"Bulk task failed: {e}")
+            result = {'item': item, 'success': False, 'result': str(e)}
+        finally:
+            _budget.release(panel_id)
+        done.put((epoch, result))
+
+    while pending or running:
+        while pending and running < limit.current and _budget.try_acquire(panel_id):
+            executor.submit(run, pending.pop(), limit.epoch)
+            running += 1
+
+        if not running:
+            # Every slot is taken by other bulk jobs
+            _budget.wait(1.0)
+            continue
+
+        epoch, result = done.get()
+        running -= 1
+        if result.get('success'):
+            limit.on_success()
+        elif is_timeout_error(result.get('result')) and limit.on_timeout(epoch):
+            logger.info(f"Bulk install timeout, concurrency lowered to {limit.current}")
+        yield result
@@ -0,0 +1,244 @@
+"""
+File distribution over SFTP
+
+Pushes files (certificates, compose files, image tarballs...) to many
+hosts over their pooled SSH sessions. Each host gets one command that
+reads the checksums of the files it already has; files that match are
+skipped, the rest are written with pipelined SFTP requests to a temporary
+name, checked with sha256sum on the host and only then moved into place.
+Uploads from every host share one egress cap.
+"""
+
+import hashlib
+import io
+import logging
+import posixpath
+import shlex
+import threading
+import time
+import uuid
+from concurrent.futures import as_completed
+from contextlib import AbstractContextManager
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import paramiko
+from bot.config.settings import DISTRIBUTION_MAX_MBPS, DOCKER_COMPOSE_CONTENT
+from bot.core.executors import get_executor
+from bot.services.ssh_executor import execute_command
+from bot.services.node_diagnostics import CERT_PATH
+
+logger = logging.getLogger(__name__)
+
+# One SFTP write request (paramiko splits larger writes to this size anyway)
+CHUNK_SIZE = 32768
+# Seconds of unused bandwidth a burst may catch up on
+BURST_SECONDS = 1.0
+
+# SFTP and exec both start in the login directory, so relative paths match ~/...
+COMPOSE_PATH = 'Marzban-node/docker-compose.yml'
+
+ConnectFactory = Callable[[Any], AbstractContextManager]
+
+
+class Payload:
+    """One file to place on hosts; its checksum is computed once and shared by every host"""
+
+    def __init__(self, remote_path: str, data: bytes = None, source: Path = None,
+                 mode: int = 0o644, digest: str = None):
+        if (data is None) == (source is None):
+            raise ValueError("Payload needs exactly one of data or source")
+        self.remote_path = remote_path
+        self.data = data
+        self.source = Path(source) if source is not None else None
+        self.mode = mode
+        self._digest = digest
+
+    @property
+    def size(self) -> int:
+        return len(self.data) if self.data is not None else self.source.stat().st_size
+
+    @property
+    def digest(self) -> str:
+        """sha256 hex of the content"""
+        if self._digest is None:
+            sha256 = hashlib.sha256()
+            with self.open() as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    sha256.update(chunk)
+            self._digest = sha256.hexdigest()
+        return self._digest
+
+    def open(self):
+        return io.BytesIO(self.data) if self.data is not None else open(self.source, 'rb')
+
+
+def node_file_payloads(certificate: str = None, compose: Optional[str] = DOCKER_COMPOSE_CONTENT) -> List[Payload]:
+    """Payloads for the node's client certificate and compose file, written as the installer writes them"""
+    payloads = []
+    if certificate:
+        payloads.append(Payload(CERT_PATH, (certificate.rstrip() + "\n").encode('utf-8'), mode=0o600))
+    if compose:
+        payloads.append(Payload(COMPOSE_PATH, (compose.rstrip() + "\n").encode('utf-8')))
+    return payloads
+
+
+class BandwidthLimiter:
+    """Caps the combined upload rate of every thread (bytes per second, 0 disables it)"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+        self.stats = {'bytes': 0, 'throttled': 0.0}
+
+    def consume(self, size: int):
+        """Block until size more bytes may be sent"""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._next = max(self._next, now - BURST_SECONDS) + size / self.rate
+            delay = self._next - now
+            self.stats['bytes'] += size
+            if delay > 0:
+                self.stats['throttled'] += delay
+        if delay > 0:
+            time.sleep(delay)
+
+
+_limiter = BandwidthLimiter(DISTRIBUTION_MAX_MBPS * 1024 * 1024)
+
+
+def get_bandwidth_limiter() -> BandwidthLimiter:
+    """Process-wide shared egress cap"""
+    return _limiter
+
+
+def remote_checksums(ssh_client: paramiko.SSHClient, paths: List[str]) -> Dict[str, str]:
+    """sha256 of each path that exists on the host, creating missing parent directories"""
+    parents = sorted({posixpath.dirname(path) for path in paths} - {''})
+    quoted = ' '.join(shlex.quote(path) for path in paths)
+    command = f"sha256sum -- {quoted} 2>/dev/null; true"
+    if parents:
+        command = f"mkdir -p -- {' '.join(shlex.quote(parent) for parent in parents)}; {command}"
+    result = execute_command(ssh_client, command, timeout=300)
+
+    checksums = {}
+    for line in result.stdout.splitlines():
+        checksum, _, path = line.partition('  ')
+        if path:
+            checksums[path.strip()] = checksum
+    return checksums
+
+
+def _upload(sftp: paramiko.SFTPClient, payload: Payload, path: str, limiter: BandwidthLimiter) -> int:
+    """Write payload to path with pipelined requests; returns bytes sent"""
+    sent = 0
+    with payload.open() as source, sftp.open(path, 'wb') as remote:
+        # Don't wait for each write's ack; errors surface on close
+        remote.set_pipelined(True)
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            limiter.consume(len(chunk))
+            remote.write(chunk)
+            sent += len(chunk)
+    sftp.chmod(path, payload.mode)
+    return sent
+
+
+def push_files(ssh_client: paramiko.SSHClient, payloads: List[Payload], host: str = '',
+               limiter: BandwidthLimiter = None) -> Dict[str, Any]:
+    """Bring payloads up to date on one connected host
+
+    Returns {'sent', 'skipped', 'failed'} lists of remote paths plus the
+    bytes uploaded and the elapsed time.
+    """
+    limiter = limiter or _limiter
+    started = time.monotonic()
+    existing = remote_checksums(ssh_client, [payload.remote_path for payload in payloads])
+    result = {'sent': [], 'skipped': [], 'failed': [], 'bytes': 0}
+
+    stale = []
+    for payload in payloads:
+        if existing.get(payload.remote_path) == payload.digest:
+            result['skipped'].append(payload.remote_path)
+        else:
+            stale.append(payload)
+
+    if stale:
+        suffix = f".marz-partial-{uuid.uuid4().hex[:8]}"
+        sftp = ssh_client.open_sftp()
+        try:
+            for payload in stale:
+                try:
+                    result['bytes'] += _upload(sftp, payload, payload.remote_path + suffix, limiter)
+                except Exception:
+                    # Don't leave half-written files behind on the host
+                    try:
+                        sftp.remove(payload.remote_path + suffix)
+                    except Exception:
+                        pass
+                    raise
+        finally:
+            sftp.close()
+
+        # Verify every upload on the host and move the good ones into place in one round trip
+        checks = ['check() { [ "$(sha256sum < "$1" | cut -d" " -f1)" = "$2" ] '
+                  '&& mv -f -- "$1" "$3" && echo "ok $3" || { rm -f -- "$1"; echo "bad $3"; }; }']
+        for payload in stale:
+            checks.append(f"check {shlex.quote(payload.remote_path + suffix)} {payload.digest} "
+                          f"{shlex.quote(payload.remote_path)}")
+        output = execute_command(ssh_client, '\n'.join(checks), timeout=300).stdout
+        moved = {line[3:] for line in output.splitlines() if line.startswith('ok ')}
+        for payload in stale:
+            if payload.remote_path in moved:
+                result['sent'].append(payload.remote_path)
+            else:
+                logger.warning(f"Checksum of {payload.remote_path} on {host} did not match after upload")
+                result['failed'].append(payload.remote_path)
+
+    result['elapsed'] = time.monotonic() - started
+    logger.info(f"Files on {host}: {len(result['sent'])} sent ({result['bytes'] // 1024} KiB), "
+                f"{len(result['skipped'])} up to date, {len(result['failed'])} failed "
+                f"in {result['elapsed']:.1f}s")
+    return result
+
+
+def distribute(targets: List[Any], payloads: List[Payload], connect: ConnectFactory,
+               label: Callable[[Any], str] = str, limiter: BandwidthLimiter = None,
+               on_result: Callable[[Dict[str, Any], int, int], None] = None) -> List[Dict[str, Any]]:
+    """Push payloads to every target in parallel on the 'distribution' pool
+
+    connect(target) must return a context manager yielding a connected
+    SSHClient (e.g. SSHManager.server_session). on_result(result, done,
+    total) is called from this thread as each host finishes; every result
+    carries 'target', 'host', 'success' and 'error' besides push_files'.
+    """
+    # Hash every payload once before the hosts start comparing against it
+    for payload in payloads:
+        payload.digest
+
+    def push(target):
+        host = label(target)
+        try:
+            with connect(target) as ssh_client:
+                result = push_files(ssh_client, payloads, host=host, limiter=limiter)
+            result.update(success=not result['failed'], error=None)
+        except Exception as e:
+            logger.error(f"Distributing files to {host} failed: {e}")
+            result = {'sent': [], 'skipped': [], 'failed': [p.remote_path for p in payloads],
+                      'bytes': 0, 'success': False, 'error': str(e)}
+        result.update(target=target, host=host)
+        return result
+
+    executor = get_executor('distribution')
+    futures = [executor.submit(push, target) for target in targets]
+    results = []
+    for future in as_completed(futures):
+        results.append(future.result())
+        if on_result:
+            try:
+                on_result(results[-1], len(results), len(targets))
+            except Exception as e:
+                logger.error(f"Error reporting distribution progress: {e}")
+    return results
@@ -0,0 +1,120 @@
+"""
+Fleet command runner
+
+Runs one shell command on many hosts in rolling batches: each batch runs
+in parallel on the 'fleet' pool and the next batch only starts if the
+failure rate so far is within the limit, so a bad command stops after one
+batch instead of breaking the whole fleet. The command is wrapped in
+timeout(1) on the host so a hung command is killed there rather than left
+running after the bot gives up on it. Results are grouped by identical
+output for the report.
+"""
+
+import logging
+import shlex
+import time
+from concurrent.futures import as_completed
+from typing import Any, Callable, Dict, List, Tuple
+
+from bot.config.settings import FLEET_BATCH_SIZE, FLEET_MAX_FAILURE_RATE, FLEET_COMMAND_TIMEOUT
+from bot.core.executors import get_executor
+
+logger = logging.getLogger(__name__)
+
+# Seconds timeout(1) waits after TERM before KILL, and the extra time the
+# bot waits on the channel for the host-side timeout to fire first
+KILL_AFTER = 5
+CHANNEL_GRACE = 15
+# Output kept per host; the end of the output is where the errors are
+MAX_OUTPUT_CHARS = 2000
+
+RunFunction = Callable[[Any, str, int], Tuple[bool, str]]
+
+
+def remote_command(command: str, timeout: int) -> str:
+    """command run under timeout(1) with stderr folded into stdout"""
+    return (
+        f"timeout -k {KILL_AFTER} {timeout} sh -c {shlex.quote(command)} 2>&1; rc=$?; "
+        f"[ $rc -eq 124 ] && echo \"timed out after {timeout}s\"; exit $rc"
+    )
+
+
+def normalize_output(output: str) -> str:
+    """Output as compared between hosts: trailing whitespace dropped, long output cut to its tail"""
+    lines = [line.rstrip() for line in (output or '').replace('\r\n', '\n').split('\n')]
+    text = '\n'.join(lines).strip('\n')
+    if len(text) > MAX_OUTPUT_CHARS:
+        text = '…' + text[-MAX_OUTPUT_CHARS:]
+    return text
+
+
+def group_results(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Collapse results with the same status and output into one group
+
+    Each group is {'success', 'output', 'hosts'}; failures come first,
+    then larger groups before smaller ones.
+    """
+    groups = {}
+    for result in results:
+        key = (result['success'], result['output'])
+        group = groups.setdefault(key, {'success': result['success'], 'output': result['output'], 'hosts': []})
+        group['hosts'].append(result['host'])
+    return sorted(groups.values(), key=lambda group: (group['success'], -len(group['hosts'])))
+
+
+def run_fleet(targets: List[Any], command: str, run: RunFunction, label: Callable[[Any], str] = str,
+              batch_size: int = FLEET_BATCH_SIZE, max_failure_rate: float = FLEET_MAX_FAILURE_RATE,
+              timeout: int = FLEET_COMMAND_TIMEOUT,
+              on_result: Callable[[Dict[str, Any], int, int], None] = None) -> Dict[str, Any]:
+    """Run command on every target, batch_size hosts per batch
+
+    run(target, command, timeout) executes the wrapped command on one host
+    and returns (success, output). After each batch the run stops if more
+    than max_failure_rate percent of the hosts so far failed (100 never
+    stops). on_result(result, done, total) is called from this thread as
+    each host finishes.
+
+    Returns {'results', 'groups', 'stopped', 'skipped', 'elapsed'}, where
+    skipped lists the hosts never started because the run stopped.
+    """
+    started = time.monotonic()
+    wrapped = remote_command(command, timeout)
+    batch_size = max(1, batch_size)
+
+    def execute(target):
+        host = label(target)
+        host_started = time.monotonic()
+        try:
+            success, output = run(target, wrapped, timeout + KILL_AFTER + CHANNEL_GRACE)
+        except Exception as e:
+            logger.error(f"Fleet command on {host} failed: {e}")
+            success, output = False, str(e)
+        return {'target': target, 'host': host, 'success': success, 'output': normalize_output(output),
+                'elapsed': time.monotonic() - host_started}
+
+    executor = get_executor('fleet')
+    results = []
+    failed = 0
+    stopped = False
+    for offset in range(0, len(targets), batch_size):
+        if failed and failed * 100 > max_failure_rate * len(results):
+            stopped = True
+            break
+
+        futures = [executor.submit(execute, target) for target in targets[offset:offset + batch_size]]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            failed += not result['success']
+            if on_result:
+                try:
+                    on_result(result, len(results), len(targets))
+                except Exception as e:
+                    logger.error(f"Error reporting fleet progress: {e}")
+
+    skipped = [label(target) for target in targets[len(results):]]
+    elapsed = time.monotonic() - started
+    logger.info(f"Fleet command on {len(results)}/{len(targets)} hosts: {failed} failed"
+                f"{', stopped at the failure threshold' if stopped else ''} in {elapsed:.1f}s")
+    return {'results': results, 'groups': group_results(results), 'stopped': stopped,
+            'skipped': skipped, 'elapsed': elapsed}
@@ -0,0 +1,84 @@
+"""
+Remote host fingerprinting
+
+Collects everything the install planner needs to know about a server -
+OS release, docker and compose versions, existing Marzban node files and
+whether the node container runs - in one remote command.
+"""
+
+import logging
+import re
+from typing import Any, Dict, Optional, Tuple
+
+import paramiko
+from bot.config.settings import MIN_DOCKER_VERSION
+from bot.services.ssh_executor import execute_command
+
+logger = logging.getLogger(__name__)
+
+PROBE_COMMAND = r'''
+. /etc/os-release 2>/dev/null
+echo "os_id=${ID:-unknown}"
+echo "os_version=${VERSION_ID:-unknown}"
+echo "docker_version=$(docker version --format '{{.Server.Version}}' 2>/dev/null || docker --version 2>/dev/null | sed 's/^Docker version \([^,]*\).*/\1/')"
+echo "compose_version=$(docker compose version --short 2>/dev/null)"
+missing=""
+for tool in curl socat git; do command -v $tool >/dev/null 2>&1 || missing="$missing $tool"; done
+echo "missing_packages=${missing# }"
+test -d ~/Marzban-node/.git && echo "repo_cloned=1" || echo "repo_cloned=0"
+test -f ~/Marzban-node/docker-compose.yml && echo "compose_file=1" || echo "compose_file=0"
+test -d /var/lib/marzban-node && echo "data_dir=1" || echo "data_dir=0"
+test -s /var/lib/marzban-node/ssl_client_cert.pem && echo "cert_present=1" || echo "cert_present=0"
+echo "container_running=$(docker ps --filter name=marzban-node --filter status=running -q 2>/dev/null | head -n 1 | grep -q . && echo 1 || echo 0)"
+'''
+
+
+def version_tuple(version: Optional[str]) -> Optional[Tuple[int, ...]]:
+    """Leading numeric part of a version string ('24.0.7+dfsg1' -> (24, 0, 7)); None if there is none"""
+    match = re.match(r'v?(\d+(?:\.\d+)*)', (version or '').strip())
+    if not match:
+        return None
+    return tuple(int(part) for part in match.group(1).split('.'))
+
+
+def parse_facts(output: str) -> Dict[str, Any]:
+    """Turn the probe's key=value lines into facts, adding derived flags"""
+    raw = {}
+    for line in output.splitlines():
+        key, sep, value = line.partition('=')
+        if sep:
+            raw[key.strip()] = value.strip()
+
+    facts: Dict[str, Any] = {
+        'os_id': raw.get('os_id', 'unknown'),
+        'os_version': raw.get('os_version', 'unknown'),
+        'docker_version': raw.get('docker_version') or None,
+        'compose_version': raw.get('compose_version') or None,
+        'missing_packages': raw.get('missing_packages', 'curl socat git').split(),
+    }
+    for flag in ('repo_cloned', 'compose_file', 'data_dir', 'cert_present', 'container_running'):
+        facts[flag] = raw.get(flag) == '1'
+
+    docker_version = version_tuple(facts['docker_version'])
+    facts['docker_ready'] = bool(
+        docker_version and docker_version >= version_tuple(MIN_DOCKER_VERSION) and facts['compose_version']
+    )
+    facts['packages_ready'] = not facts['missing_packages']
+    return facts
+
+
+def probe_host(ssh_client: paramiko.SSHClient, ip: str, port: int) -> Optional[Dict[str, Any]]:
+    """Facts about a connected host; None if the probe fails"""
+    try:
+        result = execute_command(ssh_client, PROBE_COMMAND, timeout=60)
+    except Exception as e:
+        logger.warning(f"Host probe of {ip}:{port} failed: {e}")
+        return None
+
+    facts = parse_facts(result.stdout)
+    logger.info(
+        f"Host {ip}:{port}: {facts['os_id']} {facts['os_version']}, "
+        f"docker {facts['docker_version'] or '-'}, compose {facts['compose_version'] or '-'}, "
+        f"container {'running' if facts['container_running'] else 'stopped'}"
+    )
+    return facts
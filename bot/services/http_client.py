@@ -0,0 +1,115 @@
+"""
+Shared HTTP client for panel APIs
+
+One keep-alive session per panel host, real connect/read timeouts and
+jittered exponential retries on transient failures.
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import Dict
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from bot.config.settings import (
+    API_TIMEOUT, API_CONNECT_TIMEOUT, MAX_API_RETRIES, API_POOL_SIZE
+)
+
+logger = logging.getLogger(__name__)
+
+# Methods that can be replayed safely after the request may have reached the server
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+
+
+class PanelHTTPClient:
+    def __init__(self, connect_timeout: float = API_CONNECT_TIMEOUT, read_timeout: float = API_TIMEOUT,
+                 max_retries: int = MAX_API_RETRIES, pool_size: int = API_POOL_SIZE):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max(0, max_retries)
+        self.pool_size = pool_size
+        self._sessions: Dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+
+    def _session_for(self, url: str) -> requests.Session:
+        """Keep-alive session dedicated to the URL's scheme and host"""
+        parts = urlsplit(url)
+        key = f"{parts.scheme}://{parts.netloc}"
+
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[key] = session
+            return session
+
+    @staticmethod
+    def _backoff(attempt: int, response: requests.Response = None) -> float:
+        """Full-jitter exponential backoff, honoring Retry-After when the server sends one"""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                return min(float(retry_after), BACKOFF_CAP)
+        return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
+
+    def request(self, method: str, url: str, retry: bool = None, **kwargs) -> requests.Response:
+        """Send a request, retrying transient failures up to max_retries times
+
+        retry forces replay on read errors for non-idempotent methods; connect
+        failures are always retried since the request never left this host.
+        """
+        method = method.upper()
+        replayable = method in IDEMPOTENT_METHODS if retry is None else retry
+        kwargs.setdefault('timeout', self.timeout)
+        session = self._session_for(url)
+
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                response = session.request(method, url, **kwargs)
+            except requests.exceptions.ConnectTimeout as e:
+                if last_attempt:
+                    raise
+                logger.warning(f"{method} {url} connect timeout (attempt {attempt + 1}): {e}")
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if last_attempt or not replayable:
+                    raise
+                logger.warning(f"{method} {url} failed (attempt {attempt + 1}): {e}")
+            else:
+                if response.status_code in RETRY_STATUS_CODES and replayable and not last_attempt:
+                    logger.warning(f"{method} {url} returned {response.status_code} (attempt {attempt + 1})")
+                    time.sleep(self._backoff(attempt, response))
+                    continue
+                return response
+
+            time.sleep(self._backoff(attempt))
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self.request('DELETE', url, **kwargs)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_http_client() -> PanelHTTPClient:
+    """Process-wide shared client"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = PanelHTTPClient()
+        return _client
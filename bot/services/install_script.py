@@ -0,0 +1,291 @@
+"""
+Single-script node installation
+
+The whole install is rendered into one idempotent bash script that is
+uploaded over SFTP and run in a single channel, so shell state persists
+between steps and a high-latency link pays one round trip per install
+instead of one per command. Each step prints markers that StepTracker
+turns back into per-step status.
+
+Steps form a small dependency graph. Steps with a check are skipped on the
+host when the check already passes. Checkpointed steps that completed in
+an earlier, interrupted run and steps whose 'unless' host facts all hold
+are left out of the plan entirely.
+"""
+
+import logging
+import shlex
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+from bot.config.settings import (
+    DOCKER_COMPOSE_CONTENT, INSTALL_STEPS, NODE_READY_TIMEOUT, NODE_READY_MAX_INTERVAL, NODE_IMAGE
+)
+
+logger = logging.getLogger(__name__)
+
+STEP_MARKER = '##MARZ-STEP'
+HEREDOC_DELIMITER = 'MARZ_NODE_EOF'
+# Lines of output kept per step for error reports
+STEP_OUTPUT_LINES = 40
+# First pause between readiness probes; it doubles up to NODE_READY_MAX_INTERVAL
+READY_INITIAL_DELAY_MS = 250
+
+# Polls until every compose container runs (and is healthy, when it has a
+# healthcheck) and the node port listens, backing off exponentially, and
+# fails once the deadline passes
+READY_COMMAND = r'''ready=1
+ready_start=$(date +%s)
+ready_delay={initial_ms}
+cd ~/Marzban-node && while :; do
+  states=''
+  ids=$(docker compose ps -q 2>/dev/null)
+  [ -n "$ids" ] && states=$(docker inspect --format '{{{{.State.Status}}}} {{{{if .State.Health}}}}{{{{.State.Health.Status}}}}{{{{end}}}}' $ids 2>/dev/null)
+  if [ -n "$states" ] && ! echo "$states" | grep -qv '^running' && ! echo "$states" | grep -qE 'starting|unhealthy' \
+     && {{ ss -ltnH "( sport = :{port} )" 2>/dev/null | grep -q . || netstat -ltn 2>/dev/null | grep -q ":{port} "; }}; then
+    echo "Node ready after $(( $(date +%s) - ready_start ))s"
+    ready=0
+    break
+  fi
+  if [ $(( $(date +%s) - ready_start )) -ge {timeout} ]; then
+    echo "Node not ready after {timeout}s: ${{states:-no containers}}"
+    break
+  fi
+  sleep "$((ready_delay / 1000)).$(printf '%03d' $((ready_delay % 1000)))"
+  ready_delay=$((ready_delay * 2))
+  [ "$ready_delay" -gt {max_ms} ] && ready_delay={max_ms}
+done
+[ "$ready" -eq 0 ]'''
+
+
+class InstallStep(NamedTuple):
+    name: str
+    command: str
+    # A failed optional step is reported but does not stop the install
+    required: bool = True
+    requires: Tuple[str, ...] = ()
+    # Shell test; when it succeeds on the host the step is skipped
+    check: Optional[str] = None
+    # Completion is persisted so a resumed install leaves the step out
+    checkpoint: bool = False
+    # Host facts that, when all true, make the step unnecessary
+    unless: Tuple[str, ...] = ()
+
+
+def _write_file(path: str, content: str) -> str:
+    """Shell command writing content to path verbatim"""
+    return f"cat > {path} << '{HEREDOC_DELIMITER}'\n{content.rstrip()}\n{HEREDOC_DELIMITER}"
+
+
+def ready_command(node_port: int, timeout: int = NODE_READY_TIMEOUT,
+                  max_interval: float = NODE_READY_MAX_INTERVAL) -> str:
+    """Shell command waiting until the node container is up and node_port listens"""
+    return READY_COMMAND.format(
+        port=int(node_port),
+        timeout=int(timeout),
+        initial_ms=READY_INITIAL_DELAY_MS,
+        max_ms=max(READY_INITIAL_DELAY_MS, int(max_interval * 1000))
+    )
+
+
+def build_install_steps(certificate: str, node_port: int, api_port: int) -> List[InstallStep]:
+    """Every step of a node install, in declaration order"""
+    steps = [
+        InstallStep(
+            name=step['name'],
+            command=step['command'],
+            requires=tuple(step.get('requires', ())),
+            check=step.get('check'),
+            checkpoint=step.get('checkpoint', False),
+            unless=tuple(step.get('unless', ()))
+        )
+        for step in INSTALL_STEPS
+    ]
+    steps += [
+        InstallStep('compose', f"cd ~/Marzban-node && {_write_file('docker-compose.yml', DOCKER_COMPOSE_CONTENT)}",
+                    requires=('clone',)),
+        InstallStep('certificate', _write_file('/var/lib/marzban-node/ssl_client_cert.pem', certificate),
+                    requires=('data-dir',)),
+        InstallStep('env', _write_file(
+            '/var/lib/marzban-node/.env',
+            f"SERVICE_PORT={node_port}\nXRAY_API_PORT={api_port}"
+        ), required=False, requires=('data-dir',)),
+        InstallStep('chmod', 'chmod 600 /var/lib/marzban-node/ssl_client_cert.pem',
+                    required=False, requires=('certificate',)),
+        InstallStep('verify', 'ls -la ~/Marzban-node/docker-compose.yml /var/lib/marzban-node/ssl_client_cert.pem',
+                    requires=('compose', 'certificate')),
+        InstallStep('start', 'cd ~/Marzban-node && docker compose up -d', requires=('verify', 'docker')),
+        # A node that is slow to come up is still registered; the panel shows its state
+        InstallStep('ready', ready_command(node_port), required=False, requires=('start',)),
+        InstallStep('status', 'cd ~/Marzban-node && docker compose ps', required=False, requires=('ready',)),
+        InstallStep('logs', 'cd ~/Marzban-node && docker compose logs --tail=20', required=False, requires=('ready',)),
+    ]
+    return steps
+
+
+def apply_rollout(steps: List[InstallStep], staged: Dict[str, Optional[str]],
+                  image: str = NODE_IMAGE) -> List[InstallStep]:
+    """Swap the steps that download from the internet for artifacts staged on the host
+
+    staged comes from Rollout.stage: docker is installed from the uploaded
+    script, the node image is loaded from the uploaded tarball and the
+    Marzban-node checkout is replaced by a plain directory, since only the
+    compose file we write is used from it.
+    """
+    loaded = f"docker image inspect --format '{{{{.Id}}}}' {shlex.quote(image)} | grep -qx {shlex.quote(staged['image_id'])}"
+    if staged.get('image'):
+        load = f"docker load -i {shlex.quote(staged['image'])} && rm -f {shlex.quote(staged['image'])}"
+    else:
+        # The host had the image when it was staged; pull only if it vanished since
+        load = f"docker pull {shlex.quote(image)}"
+
+    result = []
+    for step in steps:
+        if step.name == 'docker':
+            step = step._replace(command=f"sh {shlex.quote(staged['installer'])}")
+        elif step.name == 'clone':
+            step = step._replace(command='mkdir -p ~/Marzban-node', check='test -d ~/Marzban-node')
+        elif step.name == 'start':
+            step = step._replace(requires=step.requires + ('image',))
+        result.append(step)
+        if step.name == 'docker':
+            result.append(InstallStep('image', load, requires=('docker',), check=loaded))
+    return result
+
+
+def satisfied_steps(steps: List[InstallStep], facts: Optional[Dict[str, Any]]) -> List[str]:
+    """Names of steps whose 'unless' facts all hold on the host"""
+    if not facts:
+        return []
+    return [step.name for step in steps if step.unless and all(facts.get(fact) for fact in step.unless)]
+
+
+def plan_steps(steps: List[InstallStep], completed: Iterable[str] = (),
+               facts: Optional[Dict[str, Any]] = None) -> List[InstallStep]:
+    """Order steps so each runs after its requirements
+
+    Completed checkpoints and steps the host facts already satisfy are left
+    out. Declaration order is kept wherever the graph allows it.
+    """
+    by_name = {step.name: step for step in steps}
+    for step in steps:
+        unknown = [name for name in step.requires if name not in by_name]
+        if unknown:
+            raise ValueError(f"Install step {step.name} requires unknown steps: {unknown}")
+
+    done = {name for name in completed if name in by_name and by_name[name].checkpoint}
+    done.update(satisfied_steps(steps, facts))
+    placed = set(done)
+    plan = []
+    pending = [step for step in steps if step.name not in done]
+    while pending:
+        ready = next((step for step in pending if all(name in placed for name in step.requires)), None)
+        if ready is None:
+            raise ValueError(f"Install steps have a dependency cycle: {[step.name for step in pending]}")
+        pending.remove(ready)
+        placed.add(ready.name)
+        plan.append(ready)
+    return plan
+
+
+def render_script(steps: List[InstallStep]) -> str:
+    """Bash script running steps in one shell; the first argument is the step index to start from"""
+    lines = [
+        '#!/bin/bash',
+        '# Generated by the Marzban node bot; safe to re-run',
+        'export DEBIAN_FRONTEND=noninteractive',
+        'START=${1:-0}',
+        '',
+    ]
+    for index, step in enumerate(steps):
+        on_failure = 'exit $rc' if step.required else ':'
+        lines += [
+            f'if [ "$START" -le {index} ]; then',
+            f'echo "{STEP_MARKER} {index} begin"',
+            'cd ~ || exit 1',
+        ]
+        if step.check:
+            lines += [
+                f'if {{ {step.check}; }} >/dev/null 2>&1; then echo "{STEP_MARKER} {index} skip"; else',
+            ]
+        lines += [
+            '{',
+            step.command,
+            '} 2>&1',
+            'rc=$?',
+            f'if [ $rc -eq 0 ]; then echo "{STEP_MARKER} {index} ok"; '
+            f'else echo "{STEP_MARKER} {index} fail $rc"; {on_failure}; fi',
+        ]
+        if step.check:
+            lines.append('fi')
+        lines += ['fi', '']
+    lines.append('exit 0')
+    return '\n'.join(lines) + '\n'
+
+
+def script_command(path: str, start: int = 0) -> str:
+    """Command that runs an uploaded script from step start"""
+    return f"bash {shlex.quote(path)} {int(start)}"
+
+
+class StepTracker:
+    """Turns streamed script output back into per-step status
+
+    on_step(index, step, status) is called for every 'begin', 'ok', 'skip'
+    and 'fail' marker as it arrives.
+    """
+
+    def __init__(self, steps: List[InstallStep],
+                 on_step: Callable[[int, InstallStep, str], None] = None):
+        self.steps = steps
+        self.on_step = on_step
+        self.statuses: Dict[int, str] = {}
+        self.output: Dict[int, deque] = {}
+        self.current: Optional[int] = None
+        self._partial = ''
+
+    def feed(self, stream: str, text: str):
+        """on_output callback for the SSH executor"""
+        if stream != 'stdout':
+            return
+        lines = (self._partial + text).split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self._line(line)
+
+    def _line(self, line: str):
+        if line.startswith(STEP_MARKER):
+            parts = line.split()
+            try:
+                index, status = int(parts[1]), parts[2]
+            except (IndexError, ValueError):
+                return
+            self.statuses[index] = status
+            self.current = index if status == 'begin' else None
+            if status == 'begin':
+                self.output[index] = deque(maxlen=STEP_OUTPUT_LINES)
+            elif status == 'fail':
+                logger.warning(f"Install step {self.steps[index].name} failed: {line}")
+            if self.on_step:
+                try:
+                    self.on_step(index, self.steps[index], status)
+                except Exception as e:
+                    logger.error(f"Error reporting install step: {e}")
+        elif self.current is not None:
+            self.output[self.current].append(line)
+
+    @property
+    def failed_index(self) -> Optional[int]:
+        """First required step that failed, or the step that was running when output stopped"""
+        for index, status in sorted(self.statuses.items()):
+            if status == 'fail' and self.steps[index].required:
+                return index
+        return self.current
+
+    @property
+    def completed(self) -> List[str]:
+        """Names of steps that finished or were already satisfied"""
+        return [self.steps[index].name for index, status in sorted(self.statuses.items())
+                if status in ('ok', 'skip')]
+
+    def step_output(self, index: int) -> str:
+        return '\n'.join(self.output.get(index, ()))
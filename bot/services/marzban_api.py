@@ -6,14 +6,50 @@ Marzban panel API service
 import requests
 import logging
 from typing import Tuple, Dict, Any, List, Optional
-from bot.config.settings import API_TIMEOUT, MAX_API_RETRIES
+from bot.services.http_client import get_http_client
 
 logger = logging.getLogger(__name__)
 
 class MarzbanAPI:
     def __init__(self):
-        self.session = requests.Session()
-        self.session.timeout = API_TIMEOUT
+        # Shared keep-alive client: per-host pools, timeouts and retries
+        self.session = get_http_client()
+    
+    def refresh_token(self, panel: Dict[str, Any], db=None) -> Optional[str]:
+        """Re-authenticate against a stored panel and persist the new token and its expiry"""
+        if db and panel.get('id'):
+            from bot.services.token_manager import get_token_manager
+            # Single-flight: concurrent callers for one panel share a login
+            return get_token_manager().refresh(panel, db)
+        
+        auth_success, token_data = self.authenticate(
+            panel['url'],
+            panel['username'],
+            panel['password']
+        )
+        
+        if not auth_success or not token_data:
+            return None
+        return token_data.get('access_token')
+    
+    def call_with_reauth(self, panel: Dict[str, Any], db, method: str, *args) -> Tuple[bool, Any]:
+        """Call an API method with the panel's token, re-authenticating once if it was rejected"""
+        api_method = getattr(self, method)
+        if db and panel.get('id'):
+            from bot.services.token_manager import get_token_manager
+            # Normally a no-op: the background refresher renews tokens before they expire
+            get_token_manager().ensure_fresh(panel, db)
+        success, result = api_method(panel['url'], panel['access_token'], *args)
+        
+        if success or result != "not_authenticated":
+            return success, result
+        
+        access_token = self.refresh_token(panel, db)
+        if not access_token:
+            return success, result
+        
+        panel['access_token'] = access_token
+        return api_method(panel['url'], access_token, *args)
     
     def verify_token(self, panel_url: str, access_token: str) -> bool:
         """Verify if token is still valid"""
@@ -43,7 +79,8 @@ class MarzbanAPI:
                 'password': password
             }
             
-            response = self.session.post(url, data=data)
+            # Replaying a token request is harmless
+            response = self.session.post(url, data=data, retry=True)
             
             if response.status_code == 200:
                 token_data = response.json()
@@ -81,11 +118,8 @@ class MarzbanAPI:
                 nodes_data = response.json()
                 return True, nodes_data
             elif response.status_code == 401:
-                # Not authenticated
-                error_data = response.json()
-                if "Not authenticated" in str(error_data):
-                    return False, "not_authenticated"
-                return False, error_data
+                # Missing, invalid or expired token
+                return False, "not_authenticated"
             elif response.status_code == 403:
                 # Not allowed (not sudo)
                 error_data = response.json()
@@ -147,7 +181,8 @@ class MarzbanAPI:
                 'Content-Type': 'application/json'
             }
             
-            response = self.session.post(url, headers=headers)
+            # Reconnecting twice is harmless
+            response = self.session.post(url, headers=headers, retry=True)
             
             if response.status_code == 200:
                 result = response.json() if response.content else "Success"
@@ -214,6 +249,8 @@ class MarzbanAPI:
             if response.status_code == 200:
                 settings_data = response.json()
                 return True, settings_data
+            elif response.status_code == 401:
+                return False, "not_authenticated"
             else:
                 logger.error(f"Get node settings failed with status {response.status_code}")
                 return False, None
@@ -0,0 +1,125 @@
+"""
+Node diagnostics over SSH
+
+Collects what we check by hand when a node shows 'error' - container
+state, the last log lines, whether the node ports listen, the checksum of
+the installed client certificate and the load average - in one remote
+command, and caches the result per host for a short time.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import paramiko
+from bot.config.settings import NODE_DIAGNOSTICS_TTL, NODE_DIAGNOSTICS_LOG_LINES, DEFAULT_NODE_PORT, DEFAULT_API_PORT
+from bot.services.ssh_executor import execute_command
+
+logger = logging.getLogger(__name__)
+
+SECTION_MARKER = '##MARZ-DIAG '
+CERT_PATH = '/var/lib/marzban-node/ssl_client_cert.pem'
+
+DIAGNOSTICS_COMMAND = r'''
+cd ~/Marzban-node 2>/dev/null
+echo "##MARZ-DIAG containers"
+docker compose ps --all --format '{{{{.Name}}}} {{{{.State}}}} {{{{.Status}}}}' 2>&1 || docker ps -a --filter name=marzban-node --format '{{{{.Names}}}} {{{{.State}}}} {{{{.Status}}}}' 2>&1
+echo "##MARZ-DIAG logs"
+docker compose logs --no-color --tail {log_lines} 2>&1
+echo "##MARZ-DIAG ports"
+for port in {ports}; do
+  if ss -ltnH "( sport = :$port )" 2>/dev/null | grep -q . || netstat -ltn 2>/dev/null | grep -q ":$port "; then echo "$port 1"; else echo "$port 0"; fi
+done
+echo "##MARZ-DIAG cert"
+sha256sum {cert_path} 2>/dev/null | cut -d' ' -f1
+echo "##MARZ-DIAG load"
+cat /proc/loadavg 2>/dev/null | cut -d' ' -f1-3
+'''
+
+
+def certificate_checksum(certificate: str) -> str:
+    """sha256 of the certificate file exactly as the installer writes it"""
+    return hashlib.sha256((certificate.rstrip() + "\n").encode('utf-8')).hexdigest()
+
+
+def parse_diagnostics(output: str) -> Dict[str, Any]:
+    """Split the command's sections into a diagnostics dict"""
+    sections: Dict[str, list] = {}
+    current = None
+    for line in output.splitlines():
+        if line.startswith(SECTION_MARKER):
+            current = line[len(SECTION_MARKER):].strip()
+            sections[current] = []
+        elif current:
+            sections[current].append(line)
+
+    ports = {}
+    for line in sections.get('ports', []):
+        port, _, listening = line.partition(' ')
+        if port.isdigit():
+            ports[int(port)] = listening.strip() == '1'
+
+    containers = [line for line in sections.get('containers', []) if line.strip()]
+    cert = ''.join(sections.get('cert', [])).strip()
+    return {
+        'containers': containers,
+        'running': any(' running ' in f" {line.lower()} " for line in containers),
+        'logs': [line for line in sections.get('logs', []) if line.strip()],
+        'ports': ports,
+        'cert_checksum': cert or None,
+        'load': ' '.join(sections.get('load', [])).strip() or None,
+        'collected_at': time.time(),
+    }
+
+
+class DiagnosticsCache:
+    """Diagnostics per (ip, port) with a TTL"""
+
+    def __init__(self, ttl: float = NODE_DIAGNOSTICS_TTL):
+        self.ttl = ttl
+        self._results: Dict[Tuple[str, int], Tuple[float, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, ip: str, port: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._results.get((ip, port))
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            return None
+        return entry[1]
+
+    def put(self, ip: str, port: int, diagnostics: Dict[str, Any]):
+        with self._lock:
+            self._results[(ip, port)] = (time.monotonic(), diagnostics)
+
+    def invalidate(self, ip: str, port: int):
+        with self._lock:
+            self._results.pop((ip, port), None)
+
+
+_cache = DiagnosticsCache()
+
+
+def get_diagnostics_cache() -> DiagnosticsCache:
+    """Process-wide shared diagnostics cache"""
+    return _cache
+
+
+def collect_diagnostics(ssh_client: paramiko.SSHClient, ip: str, port: int,
+                        node_port: int = DEFAULT_NODE_PORT, api_port: int = DEFAULT_API_PORT,
+                        log_lines: int = NODE_DIAGNOSTICS_LOG_LINES) -> Dict[str, Any]:
+    """Run the diagnostics command on a connected host and cache the result"""
+    command = DIAGNOSTICS_COMMAND.format(
+        log_lines=int(log_lines),
+        ports=f"{int(node_port)} {int(api_port)}",
+        cert_path=CERT_PATH
+    )
+    result = execute_command(ssh_client, command, timeout=60)
+    diagnostics = parse_diagnostics(result.stdout)
+    logger.info(
+        f"Diagnostics of {ip}:{port}: container {'running' if diagnostics['running'] else 'not running'}, "
+        f"ports {diagnostics['ports']}, load {diagnostics['load']}"
+    )
+    _cache.put(ip, port, diagnostics)
+    return diagnostics
@@ -0,0 +1,164 @@
+"""
+Multi-panel node inventory
+
+Fans get_nodes out to every panel at once on a bounded pool and reports
+each panel as soon as it answers, so one slow panel never delays the rest.
+Fetched node lists are kept as short-lived per-panel snapshots so paging,
+filtering and "back" navigation do not hit the panel again.
+"""
+
+import logging
+import math
+import threading
+import time
+from concurrent.futures import as_completed, TimeoutError as FuturesTimeoutError
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from bot.config.settings import INVENTORY_DEADLINE, NODES_PAGE_SIZE, NODE_SNAPSHOT_TTL
+from bot.core.executors import get_executor
+from bot.services.marzban_api import MarzbanAPI
+
+logger = logging.getLogger(__name__)
+
+# Status filters offered by the node browser; None matches every node
+NODE_FILTERS = {
+    'all': None,
+    'connected': {'connected'},
+    'error': {'error', 'connecting'},
+    'disabled': {'disabled'},
+}
+
+
+class NodeSnapshotCache:
+    """Per-panel node lists with a short TTL"""
+
+    def __init__(self, ttl: float = NODE_SNAPSHOT_TTL):
+        self.ttl = ttl
+        self._snapshots: Dict[int, Tuple[float, List[Dict[str, Any]]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, panel_id: int) -> Optional[Tuple[List[Dict[str, Any]], float]]:
+        """Return (nodes, age in seconds) while the snapshot is fresh"""
+        with self._lock:
+            entry = self._snapshots.get(panel_id)
+        if entry is None:
+            return None
+        age = time.monotonic() - entry[0]
+        if age > self.ttl:
+            return None
+        return entry[1], age
+
+    def put(self, panel_id: int, nodes: List[Dict[str, Any]]):
+        with self._lock:
+            self._snapshots[panel_id] = (time.monotonic(), nodes)
+
+    def invalidate(self, panel_id: int = None):
+        """Drop one panel's snapshot, or all of them"""
+        with self._lock:
+            if panel_id is None:
+                self._snapshots.clear()
+            else:
+                self._snapshots.pop(panel_id, None)
+
+
+_snapshots = NodeSnapshotCache()
+
+
+def get_node_snapshots() -> NodeSnapshotCache:
+    """Process-wide shared snapshot cache"""
+    return _snapshots
+
+
+def get_panel_nodes(panel: Dict[str, Any], db, refresh: bool = False) -> Tuple[bool, Any, float]:
+    """Nodes of one panel from its snapshot, fetching when missing, stale or refresh is set
+
+    Returns (success, nodes or error, snapshot age in seconds).
+    """
+    if not refresh:
+        cached = _snapshots.get(panel['id'])
+        if cached is not None:
+            return True, cached[0], cached[1]
+
+    result = _fetch_panel(MarzbanAPI(), panel, db)
+    if not result['success']:
+        return False, result['error'], 0.0
+    return True, result['nodes'], 0.0
+
+
+def filter_nodes(nodes: List[Dict[str, Any]], status_filter: str) -> List[Dict[str, Any]]:
+    """Nodes matching one of NODE_FILTERS"""
+    statuses = NODE_FILTERS.get(status_filter)
+    if statuses is None:
+        return nodes
+    return [node for node in nodes if node.get('status') in statuses]
+
+
+def _fetch_panel(api: MarzbanAPI, panel: Dict[str, Any], db) -> Dict[str, Any]:
+    """Fetch one panel's nodes, never raising"""
+    start = time.perf_counter()
+    try:
+        success, nodes = api.call_with_reauth(panel, db, 'get_nodes')
+    except Exception as e:
+        logger.error(f"Error fetching nodes of panel {panel['id']}: {e}")
+        success, nodes = False, None
+
+    if success and isinstance(nodes, list):
+        _snapshots.put(panel['id'], nodes)
+
+    return {
+        'panel': panel,
+        'success': bool(success) and isinstance(nodes, list),
+        'nodes': nodes if success and isinstance(nodes, list) else [],
+        'error': None if success else (nodes if isinstance(nodes, str) else 'unavailable'),
+        'elapsed': time.perf_counter() - start
+    }
+
+
+def fetch_inventory(panels: List[Dict[str, Any]], db,
+                    on_result: Callable[[Dict[str, Any], int, int], None] = None,
+                    deadline: float = INVENTORY_DEADLINE) -> List[Dict[str, Any]]:
+    """Fetch nodes of every panel in parallel
+
+    on_result(result, done, total) is called from this thread as each panel
+    finishes. Panels still pending after deadline seconds are reported with
+    error 'timeout'; their requests finish in the background and are discarded.
+    """
+    api = MarzbanAPI()
+    executor = get_executor('inventory')
+    futures = {executor.submit(_fetch_panel, api, panel, db): panel for panel in panels}
+    results = []
+
+    def report(result):
+        results.append(result)
+        if on_result:
+            try:
+                on_result(result, len(results), len(panels))
+            except Exception as e:
+                logger.error(f"Error reporting inventory progress: {e}")
+
+    try:
+        for future in as_completed(futures, timeout=deadline):
+            report(future.result())
+    except FuturesTimeoutError:
+        for future, panel in futures.items():
+            if not future.done():
+                future.cancel()
+                logger.warning(f"Panel {panel['id']} did not answer within {deadline}s")
+                report({'panel': panel, 'success': False, 'nodes': [], 'error': 'timeout', 'elapsed': deadline})
+
+    return results
+
+
+def flatten_inventory(results: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """(panel, node) pairs ordered by panel name, then node name"""
+    entries = []
+    for result in sorted(results, key=lambda r: (r['panel']['name'].lower(), r['panel']['id'])):
+        for node in sorted(result['nodes'], key=lambda n: str(n.get('name', '')).lower()):
+            entries.append((result['panel'], node))
+    return entries
+
+
+def paginate(items: List[Any], page: int, page_size: int = NODES_PAGE_SIZE) -> Tuple[List[Any], int, int]:
+    """Slice items for page, returning (items, clamped page, page count)"""
+    pages = max(1, math.ceil(len(items) / page_size))
+    page = min(max(page, 0), pages - 1)
+    return items[page * page_size:(page + 1) * page_size], page, pages
@@ -0,0 +1,143 @@
+"""
+Background node health monitor
+
+Polls /api/nodes of every panel on its own interval (with jitter), writes
+the nodes whose state changed since the last look to the nodes table in a
+single batch and reports nodes that moved between connected and error, so
+admins are told instead of having to open each node.
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from bot.config.settings import NODE_MONITOR_INTERVAL
+from bot.services.node_inventory import fetch_inventory
+
+logger = logging.getLogger(__name__)
+
+# Node fields mirrored in the nodes table
+NODE_FIELDS = ('name', 'address', 'port', 'api_port', 'usage_coefficient', 'xray_version', 'status', 'message')
+# Statuses worth an alert; 'connecting' and 'disabled' never trigger one
+ALERT_STATUSES = ('connected', 'error')
+# How often the loop looks for due panels
+TICK = 5
+
+AlertCallback = Callable[[Dict[str, Any], List[Dict[str, Any]], List[Dict[str, Any]]], None]
+
+
+def changed_nodes(stored: Dict[int, Dict[str, Any]], nodes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """API nodes that are new or differ from their stored row"""
+    return [
+        node for node in nodes
+        if node.get('id') not in stored
+        or any(stored[node['id']].get(field) != node.get(field) for field in NODE_FIELDS)
+    ]
+
+
+class NodeMonitor:
+    """on_alert(panel, went_down, recovered) is called from the monitor thread"""
+
+    def __init__(self, on_alert: Optional[AlertCallback] = None, interval: int = NODE_MONITOR_INTERVAL):
+        self.on_alert = on_alert
+        self.interval = interval
+        # Last connected/error status seen per (panel id, node id)
+        self._last_status: Dict[Tuple[int, int], str] = {}
+        self._next_check: Dict[int, float] = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def panel_interval(self, panel: Dict[str, Any]) -> int:
+        return panel.get('health_interval') or self.interval
+
+    def check_panels(self, panels: List[Dict[str, Any]], db):
+        """Poll panels in parallel, store changes and raise alerts"""
+        for result in fetch_inventory(panels, db):
+            if not result['success']:
+                logger.warning(f"Health check of panel {result['panel']['id']} failed: {result['error']}")
+                continue
+            try:
+                self._apply(result['panel'], result['nodes'], db)
+            except Exception as e:
+                logger.error(f"Error applying health check of panel {result['panel']['id']}: {e}")
+
+    def _apply(self, panel: Dict[str, Any], nodes: List[Dict[str, Any]], db):
+        stored = {row['node_id']: row for row in db.get_nodes(panel['id']) if row['node_id'] is not None}
+        changed = changed_nodes(stored, nodes)
+        if changed and not db.upsert_nodes(panel['id'], changed):
+            return
+
+        # Nodes removed from the panel are never seen again
+        node_ids = {node.get('id') for node in nodes}
+        for key in [key for key in self._last_status if key[0] == panel['id'] and key[1] not in node_ids]:
+            self._last_status.pop(key, None)
+
+        went_down, recovered = [], []
+        for node in nodes:
+            key = (panel['id'], node.get('id'))
+            status = node.get('status')
+            if status not in ALERT_STATUSES:
+                continue
+            previous = self._last_status.get(key)
+            if previous is None and node.get('id') in stored:
+                previous = stored[node['id']]['status']
+            self._last_status[key] = status
+            if previous in ALERT_STATUSES and previous != status:
+                (went_down if status == 'error' else recovered).append(node)
+
+        if changed:
+            logger.info(f"Panel {panel['id']}: {len(changed)} node(s) changed, "
+                        f"{len(went_down)} down, {len(recovered)} recovered")
+        if (went_down or recovered) and self.on_alert:
+            try:
+                self.on_alert(panel, went_down, recovered)
+            except Exception as e:
+                logger.error(f"Error sending node health alert: {e}")
+
+    def _forget_removed_panels(self, panel_ids):
+        """Drop schedule and status entries of panels that were deleted"""
+        for panel_id in [panel_id for panel_id in self._next_check if panel_id not in panel_ids]:
+            self._next_check.pop(panel_id, None)
+        for key in [key for key in self._last_status if key[0] not in panel_ids]:
+            self._last_status.pop(key, None)
+
+    def _monitor_loop(self, db):
+        """Background poller - checks each panel when its interval has elapsed"""
+        while not self._stop.is_set():
+            now = time.monotonic()
+            panels = db.get_panels()
+            self._forget_removed_panels({panel['id'] for panel in panels})
+            due = []
+            for panel in panels:
+                next_check = self._next_check.get(panel['id'])
+                if next_check is not None and next_check > now + self.panel_interval(panel) * 1.2:
+                    # The panel's interval was shortened since it was scheduled
+                    next_check = self._next_check[panel['id']] = now + random.uniform(0, self.panel_interval(panel))
+                if next_check is None:
+                    # Spread the first round over one interval instead of hitting every panel at start
+                    self._next_check[panel['id']] = now + random.uniform(0, self.panel_interval(panel))
+                elif next_check <= now:
+                    due.append(panel)
+                    # Jitter keeps panels from drifting into lockstep
+                    self._next_check[panel['id']] = now + self.panel_interval(panel) * random.uniform(0.8, 1.2)
+
+            if due:
+                try:
+                    self.check_panels(due, db)
+                except Exception as e:
+                    logger.error(f"Error checking node health: {e}")
+
+            self._stop.wait(TICK)
+
+    def start(self, db):
+        """Start the background monitor"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._monitor_loop, args=(db,), name='node-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background monitor"""
+        self._stop.set()
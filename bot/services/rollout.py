@@ -0,0 +1,450 @@
+"""
+Fleet rollout artifacts
+
+In rollout mode the bot downloads the docker installer script and the node
+image once and pushes them to every host over its SSH session, instead of
+each host fetching them from the internet. The image is pulled straight
+from its registry (the bot host needs no docker daemon) and assembled
+into a `docker save` style tarball that `docker load` accepts.
+
+Artifacts live on disk under ROLLOUT_CACHE_DIR, named by their sha256
+digest. They are verified when first used by the process and evicted least
+recently used first once the cache exceeds ROLLOUT_CACHE_MAX_MB.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import shlex
+import tarfile
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Tuple
+
+import paramiko
+from bot.config.settings import (
+    ROLLOUT_CACHE_DIR, ROLLOUT_CACHE_MAX_MB, ROLLOUT_CACHE_TTL, DOCKER_INSTALL_SCRIPT_URL, NODE_IMAGE
+)
+from bot.services.http_client import get_http_client
+from bot.services.ssh_executor import execute_command
+from bot.services.distribution import Payload, push_files
+
+logger = logging.getLogger(__name__)
+
+REMOTE_DIR = '/var/tmp/marz-node-rollout'
+INDEX_FILE = 'index.json'
+CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_TIMEOUT = (10, 120)
+
+DEFAULT_REGISTRY = 'registry-1.docker.io'
+MANIFEST_TYPES = ', '.join([
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.oci.image.index.v1+json',
+    'application/vnd.docker.distribution.manifest.v2+json',
+    'application/vnd.oci.image.manifest.v1+json',
+])
+
+# uname -m -> (registry architecture, variant)
+PLATFORMS = {
+    'x86_64': ('amd64', None),
+    'amd64': ('amd64', None),
+    'aarch64': ('arm64', None),
+    'arm64': ('arm64', None),
+    'armv7l': ('arm', 'v7'),
+    'i686': ('386', None),
+    'i386': ('386', None),
+}
+
+
+class Artifact(NamedTuple):
+    digest: str
+    path: Path
+    size: int
+    # Image id (config digest) `docker load` gives the image; None for plain files
+    image_id: Optional[str] = None
+
+
+class ArtifactError(Exception):
+    """An artifact could not be fetched, verified or staged"""
+
+
+def sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _HashingWriter:
+    """Write-only file that hashes what passes through it"""
+
+    def __init__(self, f):
+        self._f = f
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self._f.write(data)
+        self.sha256.update(data)
+        self.size += len(data)
+        return len(data)
+
+
+class _VerifyingReader:
+    """Reads exactly the announced size of a blob and checks its digest"""
+
+    def __init__(self, chunks: Iterable[bytes], digest: str, size: int):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+        self._sha256 = hashlib.sha256()
+        self.digest = digest
+        self.remaining = size
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0:
+            size = self.remaining
+        while len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        self._sha256.update(data)
+        self.remaining -= len(data)
+        return data
+
+    def verify(self):
+        if self.remaining or self._buffer or 'sha256:' + self._sha256.hexdigest() != self.digest:
+            raise ArtifactError(f"Blob {self.digest} failed verification")
+
+
+class ArtifactCache:
+    """Content-addressed files on disk plus named references to them"""
+
+    def __init__(self, root: str = ROLLOUT_CACHE_DIR, max_bytes: int = ROLLOUT_CACHE_MAX_MB * 1024 * 1024):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # (digest, mtime, size) of files hashed by this process
+        self._verified = set()
+        self.stats = {'hits': 0, 'stored': 0, 'evicted': 0}
+
+    def path_for(self, digest: str) -> Path:
+        return self.root / f"sha256-{digest}"
+
+    def get(self, digest: str) -> Optional[Path]:
+        """Path of a cached artifact after checking its content, None if missing or corrupt"""
+        path = self.path_for(digest)
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+
+        key = (digest, stat.st_mtime_ns, stat.st_size)
+        if key not in self._verified:
+            if sha256_file(path) != digest:
+                logger.warning(f"Cached artifact {path.name} is corrupt, dropping it")
+                path.unlink(missing_ok=True)
+                return None
+        # The mtime doubles as last-use time for eviction
+        os.utime(path)
+        stat = path.stat()
+        self._verified.add((digest, stat.st_mtime_ns, stat.st_size))
+        self.stats['hits'] += 1
+        return path
+
+    def store(self, write, expected: Optional[str] = None) -> Tuple[str, Path]:
+        """Store what write(f) writes to a file object; returns (digest, path)"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix='.partial-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                writer = _HashingWriter(f)
+                write(writer)
+            digest = writer.sha256.hexdigest()
+            if expected and digest != expected:
+                raise ArtifactError(f"Downloaded artifact has digest {digest}, expected {expected}")
+            path = self.path_for(digest)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+        stat = path.stat()
+        self._verified.add((digest, stat.st_mtime_ns, stat.st_size))
+        self.stats['stored'] += 1
+        self.evict(keep=path)
+        return digest, path
+
+    def evict(self, keep: Optional[Path] = None):
+        """Remove least recently used artifacts until the cache fits max_bytes"""
+        with self._lock:
+            files = []
+            for path in self.root.glob('sha256-*'):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                path.unlink(missing_ok=True)
+                total -= size
+                self.stats['evicted'] += 1
+                logger.info(f"Evicted rollout artifact {path.name} ({size // 1024} KiB)")
+
+    def ref(self, name: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._read_index().get(name)
+
+    def set_ref(self, name: str, **entry):
+        with self._lock:
+            index = self._read_index()
+            index[name] = entry
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp = self.root / (INDEX_FILE + '.tmp')
+            tmp.write_text(json.dumps(index, indent=1))
+            os.replace(tmp, self.root / INDEX_FILE)
+
+    def _read_index(self) -> Dict[str, Any]:
+        try:
+            return json.loads((self.root / INDEX_FILE).read_text())
+        except (FileNotFoundError, ValueError):
+            return {}
+
+
+def parse_image_ref(image: str) -> Tuple[str, str, str]:
+    """'gozargah/marzban-node:latest' -> (registry, repository, tag)"""
+    name, _, tag = image.rpartition(':') if ':' in image.rsplit('/', 1)[-1] else (image, '', 'latest')
+    first, _, rest = name.partition('/')
+    if rest and ('.' in first or ':' in first or first == 'localhost'):
+        registry, repository = first, rest
+    else:
+        registry, repository = DEFAULT_REGISTRY, name
+    if registry == DEFAULT_REGISTRY and '/' not in repository:
+        repository = f"library/{repository}"
+    return registry, repository, tag
+
+
+class RegistryClient:
+    """Anonymous pulls from a Docker registry v2 API"""
+
+    def __init__(self, registry: str, repository: str):
+        self.base = f"https://{registry}/v2/{repository}"
+        self.repository = repository
+        self._token = None
+        self.http = get_http_client()
+
+    def _get(self, url: str, reauthenticated: bool = False, **kwargs):
+        headers = dict(kwargs.pop('headers', {}))
+        if self._token:
+            headers['Authorization'] = f"Bearer {self._token}"
+        response = self.http.get(url, headers=headers, timeout=DOWNLOAD_TIMEOUT, **kwargs)
+        if response.status_code == 401 and not reauthenticated:
+            # No token yet, or it expired during a long pull (Docker Hub's last 300s)
+            response.close()
+            self._token = None
+            self._authenticate(response.headers.get('WWW-Authenticate', ''))
+            return self._get(url, reauthenticated=True, headers=headers, **kwargs)
+        if response.status_code != 200:
+            response.close()
+            raise ArtifactError(f"GET {url} returned {response.status_code}")
+        return response
+
+    def _authenticate(self, challenge: str):
+        params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+        realm = params.pop('realm', None)
+        if not realm:
+            raise ArtifactError(f"Registry refused access to {self.repository}")
+        params.setdefault('scope', f"repository:{self.repository}:pull")
+        response = self.http.get(realm, params=params, timeout=DOWNLOAD_TIMEOUT)
+        if response.status_code != 200:
+            raise ArtifactError(f"Registry token request returned {response.status_code}")
+        body = response.json()
+        self._token = body.get('token') or body.get('access_token')
+
+    def manifest(self, reference: str) -> Tuple[str, Dict[str, Any]]:
+        """(digest, manifest) for a tag or digest"""
+        response = self._get(f"{self.base}/manifests/{reference}", headers={'Accept': MANIFEST_TYPES})
+        content = response.content
+        digest = response.headers.get('Docker-Content-Digest') or 'sha256:' + hashlib.sha256(content).hexdigest()
+        return digest, json.loads(content)
+
+    def platform_manifest(self, tag: str, arch: str, variant: Optional[str]) -> Tuple[str, Dict[str, Any]]:
+        """Manifest of tag for one platform, resolving multi-arch indexes"""
+        digest, manifest = self.manifest(tag)
+        if 'manifests' not in manifest:
+            return digest, manifest
+        for entry in manifest['manifests']:
+            platform = entry.get('platform', {})
+            if platform.get('os') == 'linux' and platform.get('architecture') == arch \
+                    and (variant is None or platform.get('variant') in (None, variant)):
+                return self.manifest(entry['digest'])
+        raise ArtifactError(f"{self.repository}:{tag} has no linux/{arch} image")
+
+    def blob(self, digest: str):
+        """Streaming response for a blob (the registry may redirect to a CDN)"""
+        return self._get(f"{self.base}/blobs/{digest}", stream=True)
+
+
+class Rollout:
+    """Installer script and per-architecture node image, fetched once and shared by every install"""
+
+    def __init__(self, cache: ArtifactCache = None, image: str = NODE_IMAGE,
+                 installer_url: str = DOCKER_INSTALL_SCRIPT_URL, ttl: float = ROLLOUT_CACHE_TTL):
+        self.cache = cache or ArtifactCache()
+        self.image = image
+        self.installer_url = installer_url
+        self.ttl = ttl
+        # One download per artifact even when many installs ask at once
+        self._fetch_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _fetch_lock(self, name: str) -> threading.Lock:
+        with self._lock:
+            return self._fetch_locks.setdefault(name, threading.Lock())
+
+    def _cached(self, name: str, fresh_only: bool = True) -> Optional[Artifact]:
+        ref = self.cache.ref(name)
+        if not ref or (fresh_only and time.time() - ref['fetched_at'] > self.ttl):
+            return None
+        path = self.cache.get(ref['digest'])
+        if path is None:
+            return None
+        return Artifact(ref['digest'], path, path.stat().st_size, ref.get('image_id'))
+
+    def installer(self) -> Artifact:
+        """The docker install script"""
+        name = f"installer:{self.installer_url}"
+        with self._fetch_lock(name):
+            artifact = self._cached(name)
+            if artifact:
+                return artifact
+
+            response = get_http_client().get(self.installer_url, timeout=DOWNLOAD_TIMEOUT)
+            if response.status_code != 200:
+                raise ArtifactError(f"GET {self.installer_url} returned {response.status_code}")
+            digest, path = self.cache.store(lambda f: f.write(response.content))
+            self.cache.set_ref(name, digest=digest, fetched_at=time.time())
+            logger.info(f"Cached docker installer {digest[:12]} ({len(response.content)} bytes)")
+            return Artifact(digest, path, path.stat().st_size)
+
+    def image_for(self, machine: str) -> Artifact:
+        """`docker load` tarball of the node image for a host's `uname -m`"""
+        if machine not in PLATFORMS:
+            raise ArtifactError(f"Unsupported architecture {machine}")
+        arch, variant = PLATFORMS[machine]
+        name = f"image:{self.image}:{arch}{variant or ''}"
+
+        with self._fetch_lock(name):
+            artifact = self._cached(name)
+            if artifact:
+                return artifact
+
+            registry, repository, tag = parse_image_ref(self.image)
+            client = RegistryClient(registry, repository)
+            manifest_digest, manifest = client.platform_manifest(tag, arch, variant)
+
+            # Upstream unchanged since the last fetch: keep the tarball we have
+            ref = self.cache.ref(name)
+            if ref and ref.get('manifest') == manifest_digest:
+                artifact = self._cached(name, fresh_only=False)
+                if artifact:
+                    self.cache.set_ref(name, **dict(ref, fetched_at=time.time()))
+                    return artifact
+
+            started = time.monotonic()
+            digest, path = self.cache.store(lambda f: self._write_image(client, manifest, f))
+            image_id = manifest['config']['digest']
+            self.cache.set_ref(name, digest=digest, fetched_at=time.time(),
+                               manifest=manifest_digest, image_id=image_id)
+            logger.info(f"Cached {self.image} for {arch} ({path.stat().st_size // (1024 * 1024)} MiB) "
+                        f"in {time.monotonic() - started:.1f}s")
+            return Artifact(digest, path, path.stat().st_size, image_id)
+
+    def _write_image(self, client: RegistryClient, manifest: Dict[str, Any], f):
+        """Write a `docker save` layout (manifest.json, config, layers) streaming each verified blob"""
+        config = manifest['config']
+        config_response = client.blob(config['digest'])
+        config_data = config_response.content
+        if 'sha256:' + hashlib.sha256(config_data).hexdigest() != config['digest']:
+            raise ArtifactError(f"Image config {config['digest']} failed verification")
+        config_name = config['digest'].split(':', 1)[1] + '.json'
+
+        # Layers stay compressed; docker load decompresses them itself
+        layer_names = [layer['digest'].split(':', 1)[1] + '/layer.tar' for layer in manifest['layers']]
+        index = json.dumps([{'Config': config_name, 'RepoTags': [self.image], 'Layers': layer_names}]).encode()
+
+        with tarfile.open(fileobj=f, mode='w|') as tar:
+            for member, data in ((config_name, config_data), ('manifest.json', index)):
+                info = tarfile.TarInfo(member)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+            for layer, member in zip(manifest['layers'], layer_names):
+                response = client.blob(layer['digest'])
+                try:
+                    reader = _VerifyingReader(response.raw.stream(CHUNK_SIZE, decode_content=False),
+                                              layer['digest'], layer['size'])
+                    info = tarfile.TarInfo(member)
+                    info.size = layer['size']
+                    tar.addfile(info, reader)
+                    reader.verify()
+                finally:
+                    response.close()
+
+    def stage(self, ssh_client: paramiko.SSHClient, ip: str, port: int) -> Dict[str, Optional[str]]:
+        """Push the installer and, unless the host already has it, the node image
+
+        Returns the remote paths for install_script.apply_rollout. Files
+        already on the host with the right checksum are not sent again.
+        """
+        result = execute_command(
+            ssh_client,
+            f"uname -m && (docker image inspect --format '{{{{.Id}}}}' {shlex.quote(self.image)} 2>/dev/null || echo -)",
+            timeout=60
+        )
+        lines = result.stdout.split()
+        if len(lines) < 2:
+            raise ArtifactError(f"Could not inspect {ip}: {result.stderr.strip()}")
+        machine, loaded_id = lines[0], lines[1]
+
+        installer = self.installer()
+        image = self.image_for(machine)
+        installer_path = f"{REMOTE_DIR}/{installer.path.name}"
+        image_path = f"{REMOTE_DIR}/{image.path.name}"
+        payloads = [Payload(installer_path, source=installer.path, mode=0o700, digest=installer.digest)]
+        if loaded_id != image.image_id:
+            payloads.append(Payload(image_path, source=image.path, digest=image.digest))
+
+        pushed = push_files(ssh_client, payloads, host=f"{ip}:{port}")
+        if pushed['failed']:
+            raise ArtifactError(f"Checksum of {', '.join(pushed['failed'])} on {ip} does not match")
+
+        return {
+            'installer': installer_path,
+            'image': image_path if len(payloads) > 1 else None,
+            'image_id': image.image_id,
+        }
+
+
+_rollout = None
+_rollout_lock = threading.Lock()
+
+
+def get_rollout() -> Rollout:
+    """Process-wide shared rollout artifacts"""
+    global _rollout
+    with _rollout_lock:
+        if _rollout is None:
+            _rollout = Rollout()
+        return _rollout
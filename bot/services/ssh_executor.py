@@ -0,0 +1,162 @@
+"""
+Streaming SSH command execution
+
+Waits on the channel's event descriptor with a selector instead of
+sleep-polling, drains stdout and stderr as soon as data arrives and keeps
+at most a bounded tail of each stream in memory.
+"""
+
+import codecs
+import logging
+import selectors
+import time
+from collections import deque
+from typing import Callable, Iterator, NamedTuple, Optional, Tuple
+
+import paramiko
+
+logger = logging.getLogger(__name__)
+
+# Bytes of each stream kept for the result; older output is dropped
+OUTPUT_BUFFER_BYTES = 1024 * 1024
+READ_SIZE = 32768
+# Upper bound on a single selector wait so EOF and deadline are rechecked
+MAX_WAIT = 1.0
+
+
+class RingBuffer:
+    """Bounded byte buffer that keeps the most recent data"""
+
+    def __init__(self, limit: int = OUTPUT_BUFFER_BYTES):
+        self.limit = limit
+        self.total = 0
+        self._chunks = deque()
+        self._size = 0
+
+    def append(self, data: bytes):
+        self.total += len(data)
+        self._chunks.append(data)
+        self._size += len(data)
+        while self._size > self.limit:
+            overflow = self._size - self.limit
+            head = self._chunks[0]
+            if len(head) <= overflow:
+                self._chunks.popleft()
+                self._size -= len(head)
+            else:
+                self._chunks[0] = head[overflow:]
+                self._size -= overflow
+
+    @property
+    def truncated(self) -> bool:
+        return self.total > self._size
+
+    def getvalue(self) -> bytes:
+        return b''.join(self._chunks)
+
+    def text(self) -> str:
+        return self.getvalue().decode('utf-8', errors='ignore')
+
+
+class CommandResult(NamedTuple):
+    exit_status: int
+    stdout: str
+    stderr: str
+    truncated: bool
+    elapsed: float
+
+
+class CommandStream:
+    """Run a command and iterate its output as (stream, text) chunks
+
+    stream is 'stdout' or 'stderr'. After iteration finishes, result holds
+    the exit status and the buffered tail of both streams.
+    """
+
+    def __init__(self, ssh_client: paramiko.SSHClient, command: str, timeout: float = 600,
+                 buffer_limit: int = OUTPUT_BUFFER_BYTES):
+        self.ssh_client = ssh_client
+        self.command = command
+        self.timeout = timeout
+        self.stdout = RingBuffer(buffer_limit)
+        self.stderr = RingBuffer(buffer_limit)
+        self.result: Optional[CommandResult] = None
+
+    def _drain(self, channel: paramiko.Channel, decoders) -> Iterator[Tuple[str, str]]:
+        """Read everything currently buffered on the channel without blocking"""
+        while channel.recv_ready():
+            data = channel.recv(READ_SIZE)
+            if not data:
+                break
+            self.stdout.append(data)
+            text = decoders['stdout'].decode(data)
+            if text:
+                yield 'stdout', text
+        while channel.recv_stderr_ready():
+            data = channel.recv_stderr(READ_SIZE)
+            if not data:
+                break
+            self.stderr.append(data)
+            text = decoders['stderr'].decode(data)
+            if text:
+                yield 'stderr', text
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        start = time.monotonic()
+        deadline = start + self.timeout
+        decoders = {
+            'stdout': codecs.getincrementaldecoder('utf-8')(errors='ignore'),
+            'stderr': codecs.getincrementaldecoder('utf-8')(errors='ignore'),
+        }
+
+        debug = logger.isEnabledFor(logging.DEBUG)
+
+        channel = self.ssh_client.get_transport().open_session(timeout=self.timeout)
+        selector = selectors.DefaultSelector()
+        try:
+            channel.exec_command(self.command)
+            # The channel's fileno is a pipe signalled on stdout/stderr data and on close
+            selector.register(channel, selectors.EVENT_READ)
+
+            while True:
+                for stream, text in self._drain(channel, decoders):
+                    if debug:
+                        logger.debug(f"Command {stream} chunk: {text[:200]}")
+                    yield stream, text
+
+                # sshd may send the exit status before the last output, so the
+                # output is only complete at EOF with nothing left buffered
+                if ((channel.eof_received or channel.closed)
+                        and not channel.recv_ready() and not channel.recv_stderr_ready()):
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Command timed out after {self.timeout}s")
+                selector.select(min(remaining, MAX_WAIT))
+
+            # The exit status can also arrive after EOF
+            if not channel.status_event.wait(max(0.0, deadline - time.monotonic())):
+                raise TimeoutError(f"Command timed out after {self.timeout}s")
+
+            self.result = CommandResult(
+                exit_status=channel.recv_exit_status(),
+                stdout=self.stdout.text(),
+                stderr=self.stderr.text(),
+                truncated=self.stdout.truncated or self.stderr.truncated,
+                elapsed=time.monotonic() - start
+            )
+        finally:
+            selector.close()
+            channel.close()
+
+
+def execute_command(ssh_client: paramiko.SSHClient, command: str, timeout: float = 600,
+                    on_output: Callable[[str, str], None] = None,
+                    buffer_limit: int = OUTPUT_BUFFER_BYTES) -> CommandResult:
+    """Run a command to completion, passing each output chunk to on_output(stream, text)"""
+    stream = CommandStream(ssh_client, command, timeout, buffer_limit)
+    for name, text in stream:
+        if on_output:
+            on_output(name, text)
+    return stream.result
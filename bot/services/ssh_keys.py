@@ -0,0 +1,160 @@
+"""
+SSH private key loading
+
+Detects the key type from the PEM header (or, for OpenSSH-format keys,
+from the public key blob inside it) so a key is parsed by the right
+paramiko class on the first try, and caches parsed keys by the hash of
+their text. A bulk job that uses one key for every server parses it once
+and all workers share the resulting PKey.
+"""
+
+import base64
+import hashlib
+import io
+import logging
+import struct
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Type
+
+import paramiko
+
+logger = logging.getLogger(__name__)
+
+# Parsed keys kept; bulk jobs use one key, single installs one each
+KEY_CACHE_SIZE = 256
+
+ALL_KEY_TYPES: List[Type[paramiko.PKey]] = [paramiko.RSAKey, paramiko.Ed25519Key, paramiko.ECDSAKey, paramiko.DSSKey]
+
+PEM_KEY_TYPES = {
+    'RSA PRIVATE KEY': paramiko.RSAKey,
+    'EC PRIVATE KEY': paramiko.ECDSAKey,
+    'DSA PRIVATE KEY': paramiko.DSSKey,
+}
+
+OPENSSH_KEY_TYPES = {
+    'ssh-rsa': paramiko.RSAKey,
+    'ssh-ed25519': paramiko.Ed25519Key,
+    'ssh-dss': paramiko.DSSKey,
+    'ecdsa-sha2-nistp256': paramiko.ECDSAKey,
+    'ecdsa-sha2-nistp384': paramiko.ECDSAKey,
+    'ecdsa-sha2-nistp521': paramiko.ECDSAKey,
+}
+
+OPENSSH_MAGIC = b'openssh-key-v1\x00'
+
+
+def _openssh_key_type(body: str) -> Optional[str]:
+    """Key type name from the public key blob of an 'OPENSSH PRIVATE KEY' body"""
+    try:
+        data = base64.b64decode(''.join(body.split()))
+    except Exception:
+        return None
+    if not data.startswith(OPENSSH_MAGIC):
+        return None
+
+    offset = len(OPENSSH_MAGIC)
+
+    def read_string():
+        nonlocal offset
+        (length,) = struct.unpack('>I', data[offset:offset + 4])
+        offset += 4
+        value = data[offset:offset + length]
+        offset += length
+        return value
+
+    try:
+        read_string()  # cipher name
+        read_string()  # kdf name
+        read_string()  # kdf options
+        offset += 4    # number of keys
+        public_blob = read_string()
+        (length,) = struct.unpack('>I', public_blob[:4])
+        return public_blob[4:4 + length].decode('ascii')
+    except Exception:
+        return None
+
+
+def detect_key_types(ssh_key: str) -> List[Type[paramiko.PKey]]:
+    """paramiko classes to try for a key text, the detected one first"""
+    lines = ssh_key.strip().splitlines()
+    header = lines[0].strip() if lines else ''
+    label = header[len('-----BEGIN '):-len('-----')] if header.startswith('-----BEGIN ') and header.endswith('-----') else ''
+
+    detected = PEM_KEY_TYPES.get(label)
+    if label == 'OPENSSH PRIVATE KEY':
+        body = [line for line in lines[1:] if not line.startswith('-----')]
+        detected = OPENSSH_KEY_TYPES.get(_openssh_key_type('\n'.join(body)) or '')
+
+    if detected is None:
+        # PKCS#8 or an unexpected header: fall back to trying every type
+        return list(ALL_KEY_TYPES)
+    return [detected] + [key_type for key_type in ALL_KEY_TYPES if key_type is not detected]
+
+
+def key_fingerprint(ssh_key: str) -> str:
+    """Cache key of a private key text"""
+    return hashlib.sha256(ssh_key.strip().encode('utf-8')).hexdigest()
+
+
+class KeyCache:
+    """Parsed private keys (or None for invalid ones) by key_fingerprint"""
+
+    def __init__(self, max_size: int = KEY_CACHE_SIZE):
+        self.max_size = max_size
+        self._keys: 'OrderedDict[str, Optional[paramiko.PKey]]' = OrderedDict()
+        self._lock = threading.Lock()
+        # Parsing is serialized so concurrent bulk workers wait for one parse instead of repeating it
+        self._parse_lock = threading.Lock()
+        self.stats = {'hits': 0, 'parses': 0}
+
+    def _get(self, fingerprint: str):
+        with self._lock:
+            if fingerprint in self._keys:
+                self._keys.move_to_end(fingerprint)
+                self.stats['hits'] += 1
+                return True, self._keys[fingerprint]
+            return False, None
+
+    def load(self, ssh_key: str) -> Optional[paramiko.PKey]:
+        """Parsed key for ssh_key, None if no supported type accepts it"""
+        fingerprint = key_fingerprint(ssh_key)
+        found, pkey = self._get(fingerprint)
+        if found:
+            return pkey
+
+        with self._parse_lock:
+            found, pkey = self._get(fingerprint)
+            if found:
+                return pkey
+
+            pkey = None
+            for key_type in detect_key_types(ssh_key):
+                try:
+                    pkey = key_type.from_private_key(io.StringIO(ssh_key.strip()))
+                    break
+                except paramiko.PasswordRequiredException:
+                    logger.warning("SSH private key is encrypted; passphrase-protected keys are not supported")
+                    break
+                except Exception:
+                    continue
+
+            with self._lock:
+                self.stats['parses'] += 1
+                self._keys[fingerprint] = pkey
+                while len(self._keys) > self.max_size:
+                    self._keys.popitem(last=False)
+            return pkey
+
+
+_cache = KeyCache()
+
+
+def load_private_key(ssh_key: str) -> Optional[paramiko.PKey]:
+    """Parse a private key once per distinct key text (shared process-wide)"""
+    return _cache.load(ssh_key)
+
+
+def get_key_cache() -> KeyCache:
+    """Process-wide shared key cache"""
+    return _cache
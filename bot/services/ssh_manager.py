@@ -6,30 +6,76 @@ import paramiko
 import logging
 import time
 import random
-import io
-from typing import Tuple, Optional
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Tuple, Optional
 from bot.config.settings import (
-    SSH_TIMEOUT, MAX_SSH_RETRIES, DOCKER_COMPOSE_CONTENT, 
-    INSTALL_COMMANDS, DEFAULT_NODE_PORT, DEFAULT_API_PORT
+    MAX_SSH_RETRIES, DEFAULT_NODE_PORT, DEFAULT_API_PORT,
+    INSTALL_SCRIPT_TIMEOUT, INSTALL_SKIP_SATISFIED, ROLLOUT_MODE
 )
 from bot.services.marzban_api import MarzbanAPI
+from bot.services.install_script import (
+    build_install_steps, apply_rollout, plan_steps, render_script, script_command, StepTracker
+)
+from bot.services.ssh_executor import execute_command
+from bot.services.host_probe import probe_host
+from bot.services.node_diagnostics import collect_diagnostics, get_diagnostics_cache
+from bot.services.ssh_pool import get_ssh_pool, BROKEN_ERRORS
+from bot.services.ssh_keys import load_private_key
+from bot.services.rollout import get_rollout
+from bot.services.distribution import Payload, distribute, node_file_payloads
+from bot.services.fleet_runner import run_fleet
 
 logger = logging.getLogger(__name__)
 
+# Jittered exponential backoff between SSH connection attempts (seconds)
+RETRY_BACKOFF_BASE = 1.0
+RETRY_BACKOFF_CAP = 10.0
+# Picks up a new certificate or compose file on an installed node
+NODE_RESTART_COMMAND = "cd ~/Marzban-node && docker compose up -d --force-recreate"
+
+
+def retry_delay(attempt: int) -> float:
+    """Pause before retrying after failed attempt number attempt (0-based)"""
+    return random.uniform(0.5, 1.0) * min(RETRY_BACKOFF_CAP, RETRY_BACKOFF_BASE * (2 ** attempt))
+
 class SSHManager:
     def __init__(self):
         self.marzban_api = MarzbanAPI()
+        self.pool = get_ssh_pool()
     
     def install_node(self, ssh_ip: str, ssh_port: int, ssh_username: str,
                      ssh_password: str = None, ssh_key: str = None,
                      panel_id: int = None, node_name: str = None,
                      node_port: int = None, api_port: int = None,
-                     db=None) -> Tuple[bool, str]:
-        """Install Marzban node on remote server"""
+                     db=None, on_progress: Callable[[str], None] = None) -> Tuple[bool, str]:
+        """Install Marzban node on remote server
+
+        on_progress(stage) is called as the install moves through its stages:
+        'connect', 'probe', 'stage' (rollout mode), each install step name
+        and 'register'.
+        """
+        
+        def report(stage):
+            if on_progress:
+                try:
+                    on_progress(stage)
+                except Exception as e:
+                    logger.error(f"Error reporting install progress: {e}")
         
         ssh_client = None
+        broken = False
         try:
             logger.info(f"Starting SSH connection to {ssh_ip}:{ssh_port}")
+            report('connect')
+            
+            private_key = None
+            if ssh_key:
+                private_key = load_private_key(ssh_key)
+                if not private_key:
+                    return False, "❌ کلید SSH معتبر نیست! لطفاً کلید خصوصی (private key) معتبر وارد کنید"
+            elif not ssh_password:
+                return False, "SSH password is required"
             
             # Test connection first
             test_success, test_msg = self.test_ssh_connection(
@@ -39,213 +85,118 @@ class SSHManager:
             if not test_success:
                 return False, f"SSH connection test failed: {test_msg}"
             
-            # Create SSH client
-            ssh_client = paramiko.SSHClient()
-            ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            
-            # Connect to server with retry logic
-            for attempt in range(MAX_SSH_RETRIES):
-                try:
-                    if ssh_key:
-                        # Use SSH key authentication
-                        key_file = io.StringIO(ssh_key)
-                        try:
-                            # Try different key types
-                            private_key = None
-                            key_types = [
-                                paramiko.RSAKey,
-                                paramiko.Ed25519Key,
-                                paramiko.ECDSAKey,
-                                paramiko.DSSKey
-                            ]
-                            
-                            for key_type in key_types:
-                                try:
-                                    key_file.seek(0)
-                                    private_key = key_type.from_private_key(key_file)
-                                    break
-                                except Exception:
-                                    continue
-                            
-                            if not private_key:
-                                return False, "❌ کلید SSH معتبر نیست! لطفاً کلید خصوصی (private key) معتبر وارد کنید"
-                                
-                        except paramiko.ssh_exception.PasswordRequiredException:
-                            return False, "❌ کلید SSH نیاز به رمز عبور دارد (پشتیبانی نمی‌شود)"
-                        except Exception as e:
-                            return False, f"❌ فرمت کلید SSH اشتباه است: {str(e)}"
-                        
-                        ssh_client.connect(
-                            hostname=ssh_ip,
-                            port=ssh_port,
-                            username=ssh_username,
-                            pkey=private_key,
-                            timeout=SSH_TIMEOUT,
-                            look_for_keys=False,
-                            allow_agent=False
-                        )
-                    else:
-                        # Use password authentication
-                        if not ssh_password:
-                            return False, "SSH password is required"
-                        
-                        ssh_client.connect(
-                            hostname=ssh_ip,
-                            port=ssh_port,
-                            username=ssh_username,
-                            password=ssh_password,
-                            timeout=SSH_TIMEOUT,
-                            look_for_keys=False,
-                            allow_agent=False
-                        )
-                    
-                    logger.info(f"SSH connection successful on attempt {attempt + 1}")
-                    break
-                    
-                except Exception as e:
-                    logger.warning(f"SSH connection attempt {attempt + 1} failed: {e}")
-                    if attempt == MAX_SSH_RETRIES - 1:
-                        raise e
-                    time.sleep(2)
-            
-            logger.info(f"SSH connection established to {ssh_ip}")
-            
-            # Execute installation commands with intelligent error handling
-            for i, command in enumerate(INSTALL_COMMANDS, 1):
-                logger.info(f"Executing step {i}/{len(INSTALL_COMMANDS)}: {command}")
-                success, output = self._execute_command(ssh_client, command)
-                
-                if not success:
-                    logger.warning(f"Command failed at step {i}: {command}")
-                    logger.warning(f"Error output: {output}")
-                    
-                    # Try to fix common installation issues
-                    if self._try_fix_installation_issues(ssh_client, output):
-                        logger.info(f"Fixed installation issue, retrying step {i}")
-                        # Retry the failed command
-                        success, output = self._execute_command(ssh_client, command)
-                        
-                        if not success:
-                            logger.error(f"Command still failed after fix attempt: {command}")
-                            return False, f"Failed at step {i}: {command}\nOutput: {output}"
-                    else:
-                        logger.error(f"Could not fix installation issue: {command}")
-                        return False, f"Failed at step {i}: {command}\nOutput: {output}"
-                
-                logger.info(f"Step {i} completed successfully: {command}")
-                if output.strip():
-                    logger.info(f"Command output: {output[:500]}...")  # Log first 500 chars
-            
-            # Create docker-compose.yml with correct content in Marzban-node directory
-            docker_compose_command = f'''cd ~/Marzban-node && cat > docker-compose.yml << 'EOF'
-{DOCKER_COMPOSE_CONTENT}
-EOF'''
-            
-            logger.info("Creating docker-compose.yml file")
-            success, output = self._execute_command(ssh_client, docker_compose_command)
-            if not success:
-                return False, f"Failed to create docker-compose.yml: {output}"
-            
-            # Verify file was created
-            success, output = self._execute_command(ssh_client, 'ls -la ~/Marzban-node/docker-compose.yml')
-            if not success:
-                return False, f"docker-compose.yml file was not created properly"
-            logger.info("docker-compose.yml created successfully")
-            
             # Get panel information
             panel = db.get_panel(panel_id) if db and panel_id else None
             if not panel:
                 return False, "Panel not found"
             
-            # Get node settings (certificate)
-            success, settings_data = self.marzban_api.get_node_settings(
-                panel['url'],
-                panel['access_token']
-            )
-            
-            if not success or not settings_data:
-                # Try to re-authenticate
-                auth_success, token_data = self.marzban_api.authenticate(
-                    panel['url'],
-                    panel['username'],
-                    panel['password']
-                )
-                
-                if auth_success:
-                    db.update_panel_token(panel_id, token_data.get('access_token'))
-                    success, settings_data = self.marzban_api.get_node_settings(
-                        panel['url'],
-                        token_data.get('access_token')
-                    )
+            # Get node settings (certificate) before touching the server
+            success, settings_data = self.marzban_api.call_with_reauth(panel, db, 'get_node_settings')
             
             if not success or not settings_data:
                 return False, "Failed to get node settings from panel"
             
-            certificate = settings_data.get('certificate', '')
+            # Resume from the checkpoints of an earlier interrupted install on this server
+            server = db.get_ssh_server(ssh_ip, ssh_port, panel_id)
+            completed = server['completed_steps'] if server and server['status'] != 'installed' else []
+            server_id = db.save_ssh_server(
+                ssh_ip, ssh_port, ssh_username, panel_id,
+                auth_method='ssh_key' if ssh_key else 'password',
+                password=ssh_password,
+                ssh_key=ssh_key
+            )
             
-            # Create certificate file
-            cert_command = f'''cat > /var/lib/marzban-node/ssl_client_cert.pem << 'EOF'
-{certificate}
-EOF'''
+            all_steps = build_install_steps(
+                settings_data.get('certificate', ''),
+                node_port or DEFAULT_NODE_PORT,
+                api_port or DEFAULT_API_PORT
+            )
+            if completed:
+                logger.info(f"Resuming install on {ssh_ip}, already completed: {', '.join(completed)}")
             
-            logger.info("Creating SSL certificate file")
-            success, output = self._execute_command(ssh_client, cert_command)
-            if not success:
-                return False, f"Failed to create certificate file: {output}"
+            def record_step(index, step, status):
+                if status == 'begin':
+                    report(step.name)
+                # Persist each checkpoint as soon as it is reached
+                if server_id and step.checkpoint and status in ('ok', 'skip') and step.name not in completed:
+                    completed.append(step.name)
+                    db.update_ssh_server(server_id, completed_steps=completed)
             
-            # Create node configuration
-            node_config = f'''cat > /var/lib/marzban-node/.env << 'EOF'
-SERVICE_PORT={node_port or DEFAULT_NODE_PORT}
-XRAY_API_PORT={api_port or DEFAULT_API_PORT}
-EOF'''
+            if server_id:
+                db.update_ssh_server(server_id, status='installing')
             
-            logger.info("Creating node configuration file")
-            success, output = self._execute_command(ssh_client, node_config)
-            if not success:
-                logger.warning(f"Failed to create node config: {output}")
+            # Reuses the session the connection test above left in the pool
+            for attempt in range(MAX_SSH_RETRIES):
+                try:
+                    ssh_client = self.pool.acquire(
+                        ssh_ip, ssh_port, ssh_username,
+                        password=ssh_password, pkey=private_key
+                    )
+                    logger.info(f"SSH connection successful on attempt {attempt + 1}")
+                    break
+                    
+                except paramiko.AuthenticationException:
+                    raise
+                except Exception as e:
+                    logger.warning(f"SSH connection attempt {attempt + 1} failed: {e}")
+                    if attempt == MAX_SSH_RETRIES - 1:
+                        raise e
+                    time.sleep(retry_delay(attempt))
             
-            # Set proper permissions
-            success, output = self._execute_command(ssh_client, 'chmod 600 /var/lib/marzban-node/ssl_client_cert.pem')
-            if not success:
-                logger.warning(f"Failed to set certificate permissions: {output}")
+            logger.info(f"SSH connection established to {ssh_ip}")
             
-            # Verify certificate file was created
-            success, output = self._execute_command(ssh_client, 'ls -la /var/lib/marzban-node/ssl_client_cert.pem')
-            if not success:
-                return False, f"Certificate file was not created properly"
-            logger.info("SSL certificate file created successfully")
+            # Leave out steps the host already satisfies (current docker, cloned repo, ...)
+            if INSTALL_SKIP_SATISFIED:
+                report('probe')
+            facts = probe_host(ssh_client, ssh_ip, ssh_port) if INSTALL_SKIP_SATISFIED else None
             
-            # Start Marzban node
-            success, output = self._execute_command(
-                ssh_client,
-                'cd ~/Marzban-node && docker compose up -d'
-            )
-            if not success:
-                return False, f"Failed to start Marzban node: {output}"
+            # Rollout mode: send the installer and image from the bot's cache instead of downloading on the host
+            if ROLLOUT_MODE:
+                report('stage')
+                try:
+                    all_steps = apply_rollout(all_steps, get_rollout().stage(ssh_client, ssh_ip, ssh_port))
+                except Exception as e:
+                    transport = ssh_client.get_transport()
+                    if not (transport and transport.is_active()):
+                        raise
+                    logger.warning(f"Rollout staging on {ssh_ip} failed, installing from the internet: {e}")
             
-            # Wait for the service to start
-            logger.info("Waiting for Marzban node to start...")
-            time.sleep(10)
+            steps = plan_steps(all_steps, completed, facts)
+            skipped = [step.name for step in all_steps if step not in steps]
+            if skipped:
+                logger.info(f"Skipping steps on {ssh_ip}: {', '.join(skipped)}")
             
-            # Check if container is running
-            success, output = self._execute_command(
-                ssh_client,
-                'cd ~/Marzban-node && docker compose ps'
-            )
-            if success:
-                logger.info(f"Container status: {output}")
+            # Run the whole install as one uploaded script in a single channel
+            success, output, tracker = self._run_install_script(ssh_client, steps, on_step=record_step)
             
-            # Check logs to ensure proper startup
-            success, logs = self._execute_command(
-                ssh_client,
-                'cd ~/Marzban-node && docker compose logs --tail=20'
-            )
-            if success:
-                logger.info(f"Container logs: {logs}")
-            else:
-                logger.warning("Could not retrieve container logs")
+            if not success:
+                failed = tracker.failed_index
+                logger.warning(f"Install script failed at step {failed}: {output[-500:]}")
+                
+                # Try to fix common installation issues, then resume from the failed step
+                if failed is not None and self._try_fix_installation_issues(ssh_client, output):
+                    logger.info(f"Fixed installation issue, resuming from step {failed}")
+                    success, output, tracker = self._run_install_script(
+                        ssh_client, steps, start=failed, on_step=record_step
+                    )
+                
+                if not success:
+                    if server_id:
+                        db.update_ssh_server(server_id, status='failed')
+                    failed = tracker.failed_index
+                    step = steps[failed] if failed is not None else None
+                    if step:
+                        step_output = tracker.step_output(failed) or output
+                        return False, f"Failed at step {failed + 1} ({step.name}): {step.command}\nOutput: {step_output}"
+                    return False, f"Install script failed: {output}"
+            
+            logger.info(f"Install script completed on {ssh_ip}")
+            for index, step in enumerate(steps):
+                if step.name in ('status', 'logs'):
+                    logger.info(f"Container {step.name}: {tracker.step_output(index)}")
             
             # Add node to panel
+            report('register')
             node_data = {
                 'add_as_new_host': True,
                 'address': ssh_ip,
@@ -255,16 +206,12 @@ EOF'''
                 'usage_coefficient': 1
             }
             
-            success, node_result = self.marzban_api.add_node(
-                panel['url'],
-                panel['access_token'],
-                node_data
-            )
+            success, node_result = self.marzban_api.call_with_reauth(panel, db, 'add_node', node_data)
             
             if success and node_result:
                 # Save node to database
                 if db:
-                    db.add_node(
+                    db_node_id = db.add_node(
                         panel_id=panel_id,
                         node_id=node_result.get('id'),
                         name=node_result.get('name'),
@@ -276,10 +223,16 @@ EOF'''
                         status=node_result.get('status'),
                         message=node_result.get('message')
                     )
+                    
+                    if server_id:
+                        # Checkpoints only matter for unfinished installs
+                        db.update_ssh_server(server_id, status='installed', node_id=db_node_id, completed_steps=[])
                 
                 logger.info(f"Node installed and added successfully: {node_name}")
                 return True, "Node installed and configured successfully"
             else:
+                if server_id:
+                    db.update_ssh_server(server_id, status='failed')
                 return False, f"Node installed but failed to add to panel: {node_result}"
         
         except paramiko.AuthenticationException:
@@ -287,72 +240,144 @@ EOF'''
             return False, "SSH authentication failed"
         except paramiko.SSHException as e:
             logger.error(f"SSH connection error: {e}")
+            broken = True
             return False, f"SSH connection error: {str(e)}"
         except Exception as e:
             logger.error(f"Unexpected error during node installation: {e}")
+            broken = isinstance(e, BROKEN_ERRORS)
             return False, f"Installation error: {str(e)}"
         finally:
             if ssh_client:
-                ssh_client.close()
+                # The install changes the host, so cached diagnostics are stale either way
+                get_diagnostics_cache().invalidate(ssh_ip, ssh_port)
+                self.pool.release(ssh_client, broken=broken)
+    
+    @contextmanager
+    def server_session(self, server) -> Iterator[paramiko.SSHClient]:
+        """Pooled session for a stored ssh_servers record"""
+        pkey = None
+        if server['auth_method'] == 'ssh_key':
+            pkey = load_private_key(server['ssh_key'] or '')
+            if not pkey:
+                raise ValueError("Invalid SSH private key")
+        
+        with self.pool.session(server['ip_address'], server['port'], server['username'],
+                               password=server['password'], pkey=pkey) as ssh_client:
+            yield ssh_client
+    
+    def diagnose_node(self, server, node_port: int = None, api_port: int = None,
+                      refresh: bool = False) -> Tuple[bool, Any]:
+        """Diagnostics of the node on a stored ssh_servers record, cached unless refresh is set"""
+        ip, port = server['ip_address'], server['port']
+        if not refresh:
+            diagnostics = get_diagnostics_cache().get(ip, port)
+            if diagnostics is not None:
+                return True, diagnostics
+        
+        try:
+            with self.server_session(server) as ssh_client:
+                return True, collect_diagnostics(
+                    ssh_client, ip, port,
+                    node_port=node_port or DEFAULT_NODE_PORT,
+                    api_port=api_port or DEFAULT_API_PORT
+                )
+        except paramiko.AuthenticationException:
+            return False, "SSH authentication failed"
+        except Exception as e:
+            logger.error(f"Error collecting diagnostics of {ip}:{port}: {e}")
+            return False, str(e)
+    
+    def run_command(self, server, command: str, timeout: int = 600) -> Tuple[bool, str]:
+        """Run a command on a stored ssh_servers record over its pooled session
+
+        Unlike _execute_command, only exit status 0 counts as success: the
+        install's tolerance for pkill, rm -f etc. must not apply to admin commands.
+        """
+        try:
+            with self.server_session(server) as ssh_client:
+                try:
+                    result = execute_command(ssh_client, command, timeout=timeout)
+                except TimeoutError as e:
+                    # The command hung, not the session; keep it pooled
+                    return False, str(e)
+            return result.exit_status == 0, result.stdout + result.stderr
+        except paramiko.AuthenticationException:
+            return False, "SSH authentication failed"
+        except Exception as e:
+            logger.error(f"Error running command on {server['ip_address']}:{server['port']}: {e}")
+            return False, f"Connection error: {str(e)}"
+    
+    def distribute_files(self, servers, payloads: List[Payload],
+                         on_result: Callable[[Dict[str, Any], int, int], None] = None) -> List[Dict[str, Any]]:
+        """Push payloads to stored ssh_servers records over pooled SFTP sessions (see distribution.distribute)"""
+        return distribute(
+            servers, payloads, self.server_session,
+            label=lambda server: f"{server['ip_address']}:{server['port']}",
+            on_result=on_result
+        )
+    
+    def sync_node_files(self, servers, certificate: str,
+                        on_result: Callable[[Dict[str, Any], int, int], None] = None) -> Dict[str, Any]:
+        """Push the client certificate and compose file to servers, then restart the nodes whose files changed
+
+        Returns {'results'} from distribute_files and {'restart'} from
+        run_fleet_command (None when no files changed).
+        """
+        results = self.distribute_files(servers, node_file_payloads(certificate), on_result=on_result)
+        changed = [result['target'] for result in results if result['success'] and result['sent']]
+        for server in changed:
+            get_diagnostics_cache().invalidate(server['ip_address'], server['port'])
+        restart = self.run_fleet_command(changed, NODE_RESTART_COMMAND) if changed else None
+        return {'results': results, 'restart': restart}
+    
+    def run_fleet_command(self, servers, command: str,
+                          on_result: Callable[[Dict[str, Any], int, int], None] = None) -> Dict[str, Any]:
+        """Run command on stored ssh_servers records in rolling batches (see fleet_runner.run_fleet)"""
+        return run_fleet(
+            servers, command, self.run_command,
+            label=lambda server: f"{server['ip_address']}:{server['port']}",
+            on_result=on_result
+        )
+    
+    def _run_install_script(self, ssh_client: paramiko.SSHClient, steps, start: int = 0,
+                            on_step=None) -> Tuple[bool, str, StepTracker]:
+        """Upload the install script over SFTP and run it from step start in one channel"""
+        path = f"/tmp/marz-node-install-{uuid.uuid4().hex[:12]}.sh"
+        tracker = StepTracker(steps, on_step)
+        
+        sftp = ssh_client.open_sftp()
+        try:
+            with sftp.file(path, 'w') as script_file:
+                script_file.write(render_script(steps))
+            sftp.chmod(path, 0o700)
+            
+            success, output = self._execute_command(
+                ssh_client,
+                script_command(path, start),
+                timeout=INSTALL_SCRIPT_TIMEOUT,
+                on_output=tracker.feed
+            )
+        finally:
+            try:
+                sftp.remove(path)
+            except Exception:
+                pass
+            sftp.close()
+        
+        return success, output, tracker
     
     def _execute_command(self, ssh_client: paramiko.SSHClient, command: str, 
-                        timeout: int = 600) -> Tuple[bool, str]:
-        """Execute command on remote server"""
+                        timeout: int = 600, on_output=None) -> Tuple[bool, str]:
+        """Execute command on remote server, streaming output chunks to on_output(stream, text)"""
         try:
             logger.info(f"Executing command: {command}")
             
-            # Set timeout for the channel
-            stdin, stdout, stderr = ssh_client.exec_command(command, timeout=timeout)
-            
-            # Set timeout for the channel operations
-            stdout.channel.settimeout(timeout)
-            stderr.channel.settimeout(timeout)
+            result = execute_command(ssh_client, command, timeout=timeout, on_output=on_output)
+            exit_status = result.exit_status
+            output = result.stdout
+            error = result.stderr
             
-            # Read output with timeout handling
-            output_data = []
-            error_data = []
-            
-            # Use select to handle non-blocking reads
-            import select
-            
-            while True:
-                # Check if command is still running
-                if stdout.channel.exit_status_ready():
-                    break
-                
-                # Read available data
-                if stdout.channel.recv_ready():
-                    chunk = stdout.read(4096).decode('utf-8', errors='ignore')
-                    if chunk:
-                        output_data.append(chunk)
-                        logger.info(f"Command output chunk: {chunk[:200]}...")
-                
-                if stderr.channel.recv_stderr_ready():
-                    chunk = stderr.read(4096).decode('utf-8', errors='ignore')
-                    if chunk:
-                        error_data.append(chunk)
-                        logger.warning(f"Command error chunk: {chunk[:200]}...")
-                
-                # Small delay to prevent busy waiting
-                import time
-                time.sleep(0.1)
-            
-            # Get final exit status
-            exit_status = stdout.channel.recv_exit_status()
-            
-            # Read any remaining data
-            remaining_output = stdout.read().decode('utf-8', errors='ignore')
-            remaining_error = stderr.read().decode('utf-8', errors='ignore')
-            
-            if remaining_output:
-                output_data.append(remaining_output)
-            if remaining_error:
-                error_data.append(remaining_error)
-            
-            output = ''.join(output_data)
-            error = ''.join(error_data)
-            
-            logger.info(f"Command completed with exit status: {exit_status}")
+            logger.info(f"Command completed with exit status: {exit_status} in {result.elapsed:.1f}s")
             
             # Special handling for certain commands that can have non-zero exit but are still successful
             if self._is_command_success(command, exit_status, output, error):
@@ -403,7 +428,11 @@ EOF'''
                 
                 # Kill any running dpkg processes
                 self._execute_command(ssh_client, "pkill -f dpkg || true")
-                time.sleep(2)
+                # Returns as soon as dpkg has exited instead of always waiting
+                self._execute_command(
+                    ssh_client,
+                    "timeout 10 sh -c 'while pgrep -x dpkg >/dev/null; do sleep 0.5; done' || true"
+                )
                 
                 # Remove lock files
                 fix_commands = [
@@ -493,47 +522,17 @@ EOF'''
 
     def test_ssh_connection(self, ssh_ip: str, ssh_port: int, ssh_username: str,
                           ssh_password: str = None, ssh_key: str = None) -> Tuple[bool, str]:
-        """Test SSH connection to server"""
+        """Test SSH connection to server, leaving the session pooled for the operation that follows"""
         ssh_client = None
+        broken = False
         try:
-            ssh_client = paramiko.SSHClient()
-            ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            
+            private_key = None
             if ssh_key:
-                key_file = io.StringIO(ssh_key)
-                private_key = None
-                key_types = [
-                    paramiko.RSAKey,
-                    paramiko.Ed25519Key,
-                    paramiko.ECDSAKey,
-                    paramiko.DSSKey
-                ]
-                
-                for key_type in key_types:
-                    try:
-                        key_file.seek(0)
-                        private_key = key_type.from_private_key(key_file)
-                        break
-                    except Exception:
-                        continue
-                
+                private_key = load_private_key(ssh_key)
                 if not private_key:
                     return False, "❌ کلید SSH معتبر نیست!"
-                ssh_client.connect(
-                    hostname=ssh_ip,
-                    port=ssh_port,
-                    username=ssh_username,
-                    pkey=private_key,
-                    timeout=SSH_TIMEOUT
-                )
-            else:
-                ssh_client.connect(
-                    hostname=ssh_ip,
-                    port=ssh_port,
-                    username=ssh_username,
-                    password=ssh_password,
-                    timeout=SSH_TIMEOUT
-                )
+            
+            ssh_client = self.pool.acquire(ssh_ip, ssh_port, ssh_username, password=ssh_password, pkey=private_key)
             
             # Test with simple command
             success, output = self._execute_command(ssh_client, 'echo "Connection test successful"')
@@ -541,14 +540,16 @@ EOF'''
             if success:
                 return True, "SSH connection successful"
             else:
+                broken = True
                 return False, f"Command execution failed: {output}"
         
         except paramiko.AuthenticationException:
             return False, "SSH authentication failed"
         except paramiko.SSHException as e:
+            broken = True
             return False, f"SSH connection error: {str(e)}"
         except Exception as e:
             return False, f"Connection error: {str(e)}"
         finally:
             if ssh_client:
-                ssh_client.close()
+                self.pool.release(ssh_client, broken=broken)
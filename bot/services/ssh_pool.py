@@ -0,0 +1,228 @@
+"""
+Persistent SSH sessions
+
+Keeps one authenticated paramiko client per (ip, port, user, credential
+fingerprint) so a connection test, the install that follows it,
+diagnostics and later operations on the same host share a single
+transport instead of repeating the TCP, key exchange and auth handshake.
+Transports carry any number of concurrent channels, so a session is
+shared rather than checked out exclusively. Idle sessions are closed
+after SSH_POOL_IDLE_TIMEOUT seconds and keepalives stop NATs and
+firewalls from silently dropping the rest.
+"""
+
+import hashlib
+import logging
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+import paramiko
+from bot.config.settings import SSH_TIMEOUT, SSH_POOL_SIZE, SSH_POOL_IDLE_TIMEOUT, SSH_KEEPALIVE
+
+logger = logging.getLogger(__name__)
+
+# Errors after which a session is not trusted again
+BROKEN_ERRORS = (paramiko.SSHException, EOFError, socket.error)
+
+PoolKey = Tuple[str, int, str, str]
+
+
+def credential_fingerprint(password: str = None, pkey: paramiko.PKey = None) -> str:
+    """Stable id of the credentials, so sessions are never shared across different logins"""
+    if pkey is not None:
+        return 'key:' + pkey.get_fingerprint().hex()
+    return 'pw:' + hashlib.sha256((password or '').encode('utf-8')).hexdigest()
+
+
+class _Session:
+    __slots__ = ('client', 'users', 'last_used')
+
+    def __init__(self, client: paramiko.SSHClient):
+        self.client = client
+        self.users = 0
+        self.last_used = time.monotonic()
+
+    @property
+    def alive(self) -> bool:
+        transport = self.client.get_transport()
+        return bool(transport and transport.is_active())
+
+
+class SSHSessionPool:
+    def __init__(self, max_size: int = SSH_POOL_SIZE, idle_timeout: float = SSH_POOL_IDLE_TIMEOUT,
+                 keepalive: int = SSH_KEEPALIVE):
+        self.max_size = max(1, max_size)
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self._sessions: Dict[PoolKey, _Session] = {}
+        self._clients: Dict[int, PoolKey] = {}
+        # Sessions dropped from the pool while still in use, closed by their last release
+        self._retired: Dict[int, _Session] = {}
+        # Per-key handshake lock and the number of acquires using it; removed by the last one
+        self._connecting: Dict[PoolKey, List] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._reaper = None
+        self.stats = {'hits': 0, 'connects': 0, 'evicted': 0}
+
+    def acquire(self, ip: str, port: int, username: str, password: str = None,
+                pkey: paramiko.PKey = None, timeout: float = SSH_TIMEOUT) -> paramiko.SSHClient:
+        """Pooled client for the host, connecting if there is no live session (raises on failure)
+
+        Every acquire must be paired with release(client).
+        """
+        key = (ip, port, username, credential_fingerprint(password, pkey))
+        self._start_reaper()
+
+        with self._lock:
+            connecting = self._connecting.setdefault(key, [threading.Lock(), 0])
+            connecting[1] += 1
+        try:
+            return self._acquire(key, connecting[0], ip, port, username, password, pkey, timeout)
+        finally:
+            with self._lock:
+                connecting[1] -= 1
+                if not connecting[1]:
+                    del self._connecting[key]
+
+    def _acquire(self, key: PoolKey, connect_lock: threading.Lock, ip: str, port: int, username: str,
+                 password: str, pkey: paramiko.PKey, timeout: float) -> paramiko.SSHClient:
+        # One handshake per key even when many workers ask at once
+        with connect_lock:
+            with self._lock:
+                session = self._sessions.get(key)
+                if session and session.alive:
+                    session.users += 1
+                    session.last_used = time.monotonic()
+                    self.stats['hits'] += 1
+                    return session.client
+                if session:
+                    self._drop(key)
+
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            try:
+                client.connect(
+                    hostname=ip,
+                    port=port,
+                    username=username,
+                    password=None if pkey else password,
+                    pkey=pkey,
+                    timeout=timeout,
+                    look_for_keys=False,
+                    allow_agent=False
+                )
+            except Exception:
+                client.close()
+                raise
+            if self.keepalive:
+                client.get_transport().set_keepalive(self.keepalive)
+
+            with self._lock:
+                self.stats['connects'] += 1
+                self._evict_for_room()
+                session = _Session(client)
+                session.users = 1
+                self._sessions[key] = session
+                self._clients[id(client)] = key
+            return client
+
+    def release(self, client: paramiko.SSHClient, broken: bool = False):
+        """Give a client back; broken drops its session"""
+        with self._lock:
+            key = self._clients.get(id(client))
+            session = self._sessions.get(key) if key else None
+            if session is not None and session.client is client:
+                session.users = max(0, session.users - 1)
+                session.last_used = time.monotonic()
+                if broken or not session.alive:
+                    self._drop(key)
+                return
+
+            retired = self._retired.get(id(client))
+            if retired is not None:
+                retired.users -= 1
+                if retired.users > 0:
+                    return
+                del self._retired[id(client)]
+        try:
+            client.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def session(self, ip: str, port: int, username: str, password: str = None,
+                pkey: paramiko.PKey = None) -> Iterator[paramiko.SSHClient]:
+        """Borrow a pooled client for a block, dropping it if the block hit a connection error"""
+        client = self.acquire(ip, port, username, password=password, pkey=pkey)
+        broken = False
+        try:
+            yield client
+        except BROKEN_ERRORS:
+            broken = True
+            raise
+        finally:
+            self.release(client, broken=broken)
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def close_all(self):
+        self._stop.set()
+        with self._lock:
+            for key in list(self._sessions):
+                self._drop(key)
+
+    def _drop(self, key: PoolKey):
+        """Remove a session; it is closed now if idle, otherwise by its last release (under the lock)"""
+        session = self._sessions.pop(key, None)
+        if session is None:
+            return
+        self._clients.pop(id(session.client), None)
+        self.stats['evicted'] += 1
+        if session.users:
+            self._retired[id(session.client)] = session
+            return
+        try:
+            session.client.close()
+        except Exception:
+            pass
+
+    def _evict_for_room(self):
+        """Close the least recently used idle session when the pool is full (under the lock)"""
+        while len(self._sessions) >= self.max_size:
+            idle = [(session.last_used, key) for key, session in self._sessions.items() if not session.users]
+            if not idle:
+                return
+            self._drop(min(idle)[1])
+
+    def _reap_loop(self):
+        """Background reaper - closes sessions idle longer than idle_timeout"""
+        while not self._stop.wait(max(1.0, self.idle_timeout / 4)):
+            now = time.monotonic()
+            with self._lock:
+                for key, session in list(self._sessions.items()):
+                    if not session.users and (now - session.last_used > self.idle_timeout or not session.alive):
+                        self._drop(key)
+
+    def _start_reaper(self):
+        if self._reaper and self._reaper.is_alive():
+            return
+        with self._lock:
+            if self._reaper and self._reaper.is_alive():
+                return
+            self._stop.clear()
+            self._reaper = threading.Thread(target=self._reap_loop, name='ssh-pool-reaper', daemon=True)
+            self._reaper.start()
+
+
+_pool = SSHSessionPool()
+
+
+def get_ssh_pool() -> SSHSessionPool:
+    """Process-wide shared SSH session pool"""
+    return _pool
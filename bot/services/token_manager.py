@@ -0,0 +1,159 @@
+"""
+Panel access token lifecycle
+
+Decodes the JWT expiry returned by the panel, refreshes tokens shortly
+before they expire in the background and coalesces concurrent refreshes
+of the same panel into a single authentication request.
+"""
+
+import base64
+import json
+import logging
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+from bot.config.settings import TOKEN_REFRESH_MARGIN, TOKEN_CHECK_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Same layout SQLite uses for CURRENT_TIMESTAMP (UTC)
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def decode_token_expiry(access_token: str) -> Optional[datetime]:
+    """Read the exp claim of a JWT without verifying it"""
+    try:
+        payload = access_token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return datetime.fromtimestamp(int(claims['exp']), tz=timezone.utc)
+    except Exception:
+        return None
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """Parse a stored token_expires value"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+class TokenManager:
+    def __init__(self, refresh_margin: int = TOKEN_REFRESH_MARGIN, check_interval: int = TOKEN_CHECK_INTERVAL):
+        from bot.services.marzban_api import MarzbanAPI
+
+        self.api = MarzbanAPI()
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self.check_interval = check_interval
+        self._inflight: Dict[int, Dict[str, Any]] = {}
+        self._inflight_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def token_expiry(self, panel: Dict[str, Any]) -> Optional[datetime]:
+        """Known expiry of the panel's current token"""
+        return parse_timestamp(panel.get('token_expires')) or decode_token_expiry(panel.get('access_token') or '')
+
+    def needs_refresh(self, panel: Dict[str, Any]) -> bool:
+        """True when the token is missing or expires within the refresh margin"""
+        if not panel.get('access_token'):
+            return True
+        expiry = self.token_expiry(panel)
+        if expiry is None:
+            # Non-expiring (or opaque) token - refresh only after the panel rejects it
+            return False
+        return expiry - self.refresh_margin <= datetime.now(timezone.utc)
+
+    def store_token(self, panel_id: int, access_token: str, db, durable: bool = True) -> Optional[str]:
+        """Persist a token together with its decoded expiry, returning the stored expiry"""
+        expiry = decode_token_expiry(access_token or '')
+        expires_at = expiry.strftime(TIMESTAMP_FORMAT) if expiry else None
+        db.update_panel_token(panel_id, access_token, expires_at=expires_at, durable=durable)
+        return expires_at
+
+    def refresh(self, panel: Dict[str, Any], db) -> Optional[str]:
+        """Re-authenticate a panel; concurrent callers for the same panel share one request"""
+        panel_id = panel['id']
+        with self._inflight_lock:
+            flight = self._inflight.get(panel_id)
+            leader = flight is None
+            if leader:
+                flight = {'done': threading.Event(), 'token': None, 'expires': None}
+                self._inflight[panel_id] = flight
+
+        if not leader:
+            flight['done'].wait(timeout=60)
+        else:
+            try:
+                auth_success, token_data = self.api.authenticate(
+                    panel['url'],
+                    panel['username'],
+                    panel['password']
+                )
+                if auth_success and token_data and token_data.get('access_token'):
+                    flight['token'] = token_data['access_token']
+                    flight['expires'] = self.store_token(panel_id, flight['token'], db, durable=False)
+                    logger.info(f"Refreshed access token for panel {panel_id}")
+                else:
+                    logger.warning(f"Token refresh failed for panel {panel_id}")
+            except Exception as e:
+                logger.error(f"Error refreshing token for panel {panel_id}: {e}")
+            finally:
+                with self._inflight_lock:
+                    self._inflight.pop(panel_id, None)
+                flight['done'].set()
+
+        if flight['token']:
+            panel['access_token'] = flight['token']
+            panel['token_expires'] = flight['expires']
+        return flight['token']
+
+    def ensure_fresh(self, panel: Dict[str, Any], db) -> Optional[str]:
+        """Return a usable token, refreshing first if the current one is about to expire"""
+        if self.needs_refresh(panel):
+            return self.refresh(panel, db) or panel.get('access_token')
+        return panel.get('access_token')
+
+    def _refresh_loop(self, db):
+        """Background refresher - renews tokens before they expire"""
+        while not self._stop.is_set():
+            for panel in db.get_panels():
+                if self._stop.is_set():
+                    break
+                try:
+                    if self.needs_refresh(panel):
+                        self.refresh(panel, db)
+                except Exception as e:
+                    logger.error(f"Error checking token for panel {panel.get('id')}: {e}")
+
+            # Jitter keeps many bots from hitting shared panels in lockstep
+            self._stop.wait(self.check_interval * random.uniform(0.8, 1.2))
+
+    def start(self, db):
+        """Start the background refresher"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._refresh_loop, args=(db,), name='token-refresher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background refresher"""
+        self._stop.set()
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_token_manager() -> TokenManager:
+    """Process-wide shared token manager"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = TokenManager()
+        return _manager
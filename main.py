@@ -7,6 +7,7 @@ Main entry point for the Telegram bot
 import asyncio
 import logging
 from bot.core.bot import MarzNodeBot
+from bot.config.settings import ASYNC_MODE
 
 # Configure logging
 logging.basicConfig(
@@ -16,7 +17,7 @@ logging.basicConfig(
 
 def main():
     """Main function to start the bot"""
-    bot = MarzNodeBot()
+    bot = MarzNodeBot(async_mode=ASYNC_MODE)
     bot.start()
 
 if __name__ == "__main__":
@@ -0,0 +1,93 @@
+"""DatabaseManager write-behind queue and restores"""
+
+import os
+import sqlite3
+
+import pytest
+
+os.environ.setdefault('BOT_TOKEN', '0:test')
+
+from bot.database.db_manager import MIGRATIONS, DatabaseManager
+
+# Schema written by releases before versioned migrations (PRAGMA user_version 0)
+BASELINE_SCHEMA = '''
+CREATE TABLE users (
+    user_id INTEGER PRIMARY KEY, username TEXT, first_name TEXT, last_name TEXT,
+    language TEXT DEFAULT 'en', is_admin BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE panels (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, url TEXT NOT NULL,
+    username TEXT NOT NULL, password TEXT NOT NULL, panel_type TEXT DEFAULT 'marzban',
+    access_token TEXT, token_expires TIMESTAMP, added_by INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE nodes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, panel_id INTEGER, node_id INTEGER, name TEXT,
+    address TEXT, port INTEGER, api_port INTEGER, usage_coefficient REAL DEFAULT 1.0,
+    xray_version TEXT, status TEXT, message TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE ssh_servers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, ip_address TEXT NOT NULL, port INTEGER DEFAULT 22,
+    username TEXT NOT NULL, auth_method TEXT DEFAULT 'password', password TEXT, ssh_key TEXT,
+    status TEXT DEFAULT 'pending', node_id INTEGER, added_by INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE bot_stats (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT UNIQUE, total_users INTEGER DEFAULT 0,
+    active_users INTEGER DEFAULT 0, panels_added INTEGER DEFAULT 0,
+    nodes_installed INTEGER DEFAULT 0, commands_executed INTEGER DEFAULT 0
+);
+'''
+
+
+@pytest.fixture
+def db(tmp_path):
+    # A long interval so only reads and durable writes flush the queue
+    manager = DatabaseManager(str(tmp_path / 'bot.db'), write_behind_ms=60000)
+    yield manager
+    manager.close()
+
+
+def test_failed_durable_write_keeps_queued_writes(db):
+    db.add_user(1, 'queued', durable=False)
+
+    with pytest.raises(Exception):
+        db._execute_write('INSERT INTO missing_table VALUES (?)', (1,))
+
+    assert db.get_write_behind_stats() == {'pending': 0, 'failed': 0}
+    assert db.get_user(1)['username'] == 'queued'
+
+
+def test_reads_only_flush_rows_they_touch(db):
+    db.add_user(1, 'one')
+    db.add_user(2, 'two', language='fa', durable=False)
+
+    assert db.get_user(1)['username'] == 'one'
+    assert db.get_panels() == []
+    assert db.get_write_behind_stats()['pending'] == 1
+
+    assert db.get_user(2)['language'] == 'fa'
+    assert db.get_write_behind_stats()['pending'] == 0
+
+
+def test_restore_of_old_backup_is_migrated(db, tmp_path):
+    backup = str(tmp_path / 'old-backup.db')
+    conn = sqlite3.connect(backup)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.execute("INSERT INTO panels (name, url, username, password) VALUES ('old', 'https://x', 'admin', 'pw')")
+    conn.execute("INSERT INTO ssh_servers (ip_address, username, status) VALUES ('10.0.0.1', 'root', 'installed')")
+    conn.commit()
+    conn.close()
+
+    assert db.restore_from(backup)
+
+    panels = db.get_panels()
+    assert [panel['name'] for panel in panels] == ['old']
+    assert panels[0]['health_interval'] is None
+    with db._read() as cursor:
+        assert cursor.execute('PRAGMA user_version').fetchone()[0] == len(MIGRATIONS)
+        server = db._ssh_server_from_row(cursor.execute('SELECT * FROM ssh_servers').fetchone())
+    assert server['ip_address'] == '10.0.0.1'
+    assert server['panel_id'] is None
@@ -0,0 +1,33 @@
+"""Facts parsed from the host probe output"""
+
+import os
+
+os.environ.setdefault('BOT_TOKEN', '0:test')
+
+from bot.services.host_probe import parse_facts, version_tuple
+
+PROBE_OUTPUT = """\
+os_id=ubuntu
+os_version=22.04
+docker_version={docker}
+compose_version=2.24.5
+missing_packages=
+repo_cloned=1
+compose_file=1
+data_dir=1
+cert_present=0
+container_running=0
+"""
+
+
+def test_version_tuple():
+    assert version_tuple('24.0.7+dfsg1') == (24, 0, 7)
+    assert version_tuple('v2.24.5') == (2, 24, 5)
+    assert version_tuple('') is None
+
+
+def test_docker_ready_requires_minimum_version():
+    assert parse_facts(PROBE_OUTPUT.format(docker='24.0.7'))['docker_ready']
+    assert parse_facts(PROBE_OUTPUT.format(docker='20.10.24+dfsg1'))['docker_ready']
+    assert not parse_facts(PROBE_OUTPUT.format(docker='19.03.13'))['docker_ready']
+    assert not parse_facts(PROBE_OUTPUT.format(docker='unknown'))['docker_ready']
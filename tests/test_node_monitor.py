@@ -0,0 +1,38 @@
+"""NodeMonitor bookkeeping for removed nodes and panels"""
+
+import os
+
+os.environ.setdefault('BOT_TOKEN', '0:test')
+
+from bot.services.node_monitor import NodeMonitor
+
+
+class FakeDB:
+    def __init__(self, panels):
+        self.panels = panels
+
+    def get_panels(self):
+        return self.panels
+
+    def get_nodes(self, panel_id):
+        return []
+
+    def upsert_nodes(self, panel_id, nodes):
+        return True
+
+
+def test_removed_nodes_and_panels_are_forgotten():
+    monitor = NodeMonitor()
+    db = FakeDB([{'id': 1}, {'id': 2}])
+    nodes = [{'id': 10, 'status': 'connected'}, {'id': 11, 'status': 'error'}]
+    monitor._apply({'id': 1}, nodes, db)
+    monitor._apply({'id': 2}, [{'id': 20, 'status': 'connected'}], db)
+    assert set(monitor._last_status) == {(1, 10), (1, 11), (2, 20)}
+
+    monitor._apply({'id': 1}, nodes[:1], db)
+    assert set(monitor._last_status) == {(1, 10), (2, 20)}
+
+    monitor._next_check = {1: 0.0, 2: 0.0}
+    monitor._forget_removed_panels({1})
+    assert set(monitor._next_check) == {1}
+    assert set(monitor._last_status) == {(1, 10)}
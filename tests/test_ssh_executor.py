@@ -0,0 +1,78 @@
+"""
+ssh_executor against a local paramiko server that sends the exit status
+before the last of its output, as sshd can when the child's pipes are
+still being drained after it exits.
+"""
+
+import os
+import socket
+import threading
+import time
+
+import paramiko
+import pytest
+
+os.environ.setdefault('BOT_TOKEN', '0:test')
+
+from bot.services.ssh_executor import execute_command
+
+
+class LateOutputServer(paramiko.ServerInterface):
+    """Answers every exec with exit-status first, then stdout/stderr, then EOF"""
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_exec_request(self, channel, command):
+        def run():
+            channel.sendall(b"##MARZ-STEP 1 ok\n")
+            channel.send_exit_status(3)
+            # The tail arrives after the exit status
+            time.sleep(0.2)
+            channel.sendall(b"##MARZ-STEP 2 ok\n")
+            channel.sendall_stderr(b"last error line\n")
+            time.sleep(0.1)
+            channel.shutdown_write()
+            channel.close()
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+
+@pytest.fixture
+def ssh_client():
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    host_key = paramiko.RSAKey.generate(2048)
+
+    def serve():
+        conn, _ = listener.accept()
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(host_key)
+        transport.start_server(server=LateOutputServer())
+
+    threading.Thread(target=serve, daemon=True).start()
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    client.connect('127.0.0.1', listener.getsockname()[1], 'test', password='test',
+                   look_for_keys=False, allow_agent=False)
+    yield client
+    client.close()
+    listener.close()
+
+
+def test_output_after_exit_status_is_kept(ssh_client):
+    chunks = []
+    result = execute_command(ssh_client, 'install', timeout=10,
+                             on_output=lambda stream, text: chunks.append((stream, text)))
+
+    assert result.exit_status == 3
+    assert result.stdout == "##MARZ-STEP 1 ok\n##MARZ-STEP 2 ok\n"
+    assert result.stderr == "last error line\n"
+    assert ''.join(text for stream, text in chunks if stream == 'stdout') == result.stdout